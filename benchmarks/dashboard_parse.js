@@ -0,0 +1,64 @@
+#!/usr/bin/env node
+/*
+ * Script: dashboard_parse.js
+ *
+ * Parse and load time of a plot_scores.py dashboard in V8, the JavaScript
+ * engine of Chrome, run through node instead of a headless browser:
+ *   parse  compiling every inline <script> (the inlined plotly.js of
+ *          --offline, and the dashboard script with its data payload)
+ *   load   running the dashboard script against stub DOM and Plotly objects
+ *          until its marker-map records are available, which with
+ *          --compress-data includes the base64 + gzip decode
+ * Rendering, layout and the plotly.js run itself are not measured.
+ *
+ * Prints one JSON object: {bytes, scripts, parse_seconds, load_seconds}.
+ *
+ * Usage:
+ *   node benchmarks/dashboard_parse.js gmwi2_dashboard.html
+ */
+'use strict';
+const fs = require('fs');
+const vm = require('vm');
+
+const seconds = start => Number(process.hrtime.bigint() - start) / 1e9;
+
+async function main() {
+  const path = process.argv[2];
+  if (!path) {
+    console.error('usage: dashboard_parse.js <dashboard.html>');
+    process.exit(2);
+  }
+  const html = fs.readFileSync(path, 'utf8');
+  const scripts = [...html.matchAll(/<script(?![^>]*\bsrc=)[^>]*>([\s\S]*?)<\/script>/g)].map(m => m[1]);
+  if (!scripts.length) throw new Error(`${path}: no inline <script>`);
+
+  let start = process.hrtime.bigint();
+  const compiled = scripts.map((code, i) => new vm.Script(code, { filename: `script${i}.js` }));
+  const parse = seconds(start);
+
+  // the dashboard script is the last one; plotly.js (if inlined) only needs to compile here
+  const element = () => ({ style: {}, on() {}, set onclick(f) {}, textContent: '' });
+  const context = vm.createContext({
+    document: { getElementById: element },
+    Plotly: { react() {} },
+    atob, Blob, Response, DecompressionStream, Uint8Array, JSON, Math, Object, String
+  });
+  start = process.hrtime.bigint();
+  compiled[compiled.length - 1].runInContext(context);
+  const loaded = new vm.Script('Object.keys(statsBySample).length');
+  // --compress-data fills the records asynchronously once the payload is decoded
+  const compressed = html.includes('const statsGz');
+  while (compressed && !loaded.runInContext(context) && seconds(start) < 60) {
+    await new Promise(resolve => setImmediate(resolve));
+  }
+  const load = seconds(start);
+
+  console.log(JSON.stringify({
+    bytes: fs.statSync(path).size,
+    scripts: scripts.length,
+    parse_seconds: Number(parse.toFixed(4)),
+    load_seconds: Number(load.toFixed(4))
+  }));
+}
+
+main().catch(err => { console.error(err.message); process.exit(1); });
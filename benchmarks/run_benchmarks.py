@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Script: run_benchmarks.py
+
+Time and memory-profile the Python post-processing steps on synthetic cohorts
+(see synthetic_cohort.py) at several scales, and compare against a baseline.
+
+Each step runs as its own process, the way the pipeline runs it. Wall time is
+measured around the process and its peak RSS is taken from wait4(), so worker
+pools are not counted. The per-phase timings written by bin/perf_metrics.py
+(import, read, filter, join, write) are folded into every result. With
+--repeat N the fastest of N runs is kept.
+
+Steps: marker_map, merge_absolute_metaphlan, qiime_taxmerge, convert_abundance,
+plot_scores, check_samplesheet and check_samplesheet_preflight; marker_map_indexed
+and qiime_taxmerge_indexed run the same steps joined through a taxonomy index
+(bin/taxonomy_index.py), built once per cohort outside the timings.
+gmwi2_rescore rescores the cohort with the GMWI2 model recovered from its
+GMWI2 outputs and fails unless every sample's GMWI2 score is reproduced.
+plot_scores_offline and plot_scores_offline_compressed build the dashboard
+with --offline (and --compress-data). For every plot_scores step, the output
+size and the dashboard's V8 parse and load time (dashboard_parse.js, run
+with node when it is installed) are added to the result.
+marker_map_deep selects the top 100 species (--top-n) of deep strain-level
+reports: a companion cohort of the same size whose samples carry about 1000
+species, each with its strain row, instead of about 180.
+
+Results are written as JSON ({"environment": ..., "results": [{step, samples,
+wall_seconds, cpu_seconds, peak_rss_mb, phases[, dashboard]}, ...]}). Given --baseline, each
+result is compared with the baseline entry of the same step and scale; a
+slowdown or memory growth beyond --tolerance is flagged (and with
+--fail-on-regression, exits 1). The checked-in baseline is
+benchmarks/baseline.json; refresh it with --output benchmarks/baseline.json.
+
+Usage:
+  python3 benchmarks/run_benchmarks.py --scales 10 100 1000 --workdir /tmp/gmwi2-bench \
+    --baseline benchmarks/baseline.json --output bench_results.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from synthetic_cohort import GENERATOR_VERSION
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BIN = os.path.join(os.path.dirname(HERE), 'bin')
+STEPS = ['marker_map', 'marker_map_indexed', 'merge_absolute_metaphlan', 'qiime_taxmerge',
+         'qiime_taxmerge_indexed', 'convert_abundance', 'plot_scores', 'check_samplesheet',
+         'check_samplesheet_preflight', 'gmwi2_rescore', 'marker_map_deep', 'plot_scores_offline',
+         'plot_scores_offline_compressed']
+PLOT_OPTIONS = {'plot_scores': [], 'plot_scores_offline': ['--offline'],
+                'plot_scores_offline_compressed': ['--offline', '--compress-data']}
+# generator options and top-N of the deep strain-level cohort the marker_map_deep step runs on
+DEEP_COHORT = ['--species', '5000', '--mean-species', '1000', '--fastq-reads', '0']
+DEEP_TOP_N = 100
+# differences below these are noise rather than regressions
+MIN_SECONDS = 0.5
+MIN_RSS_MB = 20
+
+
+def script(name):
+    return [sys.executable, os.path.join(BIN, name)]
+
+
+def step_command(step, cohort, jobs):
+    """Command of one step against a generated cohort, run in an empty directory."""
+    files = lambda pattern: sorted(glob.glob(os.path.join(cohort, pattern)))
+    index = ['--taxonomy-index', os.path.join(cohort, 'taxonomy_index.npz')]
+    if step in ('marker_map', 'marker_map_indexed', 'marker_map_deep'):
+        return script('marker_map.py') + ['--manifest', os.path.join(cohort, 'marker_map_manifest.tsv'),
+                                          '--db', os.path.join(cohort, 'gmrepo_markers.csv'),
+                                          '--output', 'all_marker_map.tsv'] + (index if step.endswith('_indexed') else []) + \
+            (['--top-n', str(DEEP_TOP_N)] if step == 'marker_map_deep' else [])
+    if step == 'merge_absolute_metaphlan':
+        return script('merge_absolute_metaphlan.py') + ['-i'] + files('profiles/*_profile.txt') + ['--jobs', str(jobs)]
+    if step in ('qiime_taxmerge', 'qiime_taxmerge_indexed'):
+        return (script('qiime_taxmerge.py') + files('taxonomy/*_profile_taxonomy.txt') + ['--jobs', str(jobs)]
+                + (index if step.endswith('_indexed') else []))
+    if step == 'convert_abundance':
+        return script('convert_abundance.py') + ['-i', os.path.join(cohort, 'merged_filtered_counts.tsv')]
+    if step in PLOT_OPTIONS:
+        # the dashboard of the pipeline: scores plus the marker-map tooltips
+        return script('plot_scores.py') + ['--input', os.path.join(cohort, 'gmwi2_scores_table.tsv'),
+                                           '--stats', os.path.join(cohort, 'all_marker_map.tsv'),
+                                           '--output', 'gmwi2_dashboard.html'] + PLOT_OPTIONS[step]
+    if step == 'gmwi2_rescore':
+        return script('gmwi2_rescore.py') + ['--profiles'] + files('metaphlan/*_metaphlan.txt') + \
+            ['--gmwi2-taxa'] + files('gmwi2/*_GMWI2_taxa.txt') + ['--gmwi2-scores'] + files('gmwi2/*_GMWI2.txt') + \
+            ['--jobs', str(jobs)]
+    if step == 'check_samplesheet':
+        return script('check_samplesheet.py') + [os.path.join(cohort, 'samplesheet.csv'), 'samplesheet.valid.csv']
+    if step == 'check_samplesheet_preflight':
+        return script('check_samplesheet.py') + [os.path.join(cohort, 'samplesheet.csv'), 'samplesheet.valid.csv',
+                                                 '--preflight', '--jobs', str(jobs)]
+    raise ValueError(f"unknown step {step}")
+
+
+def cohort_version(cohort):
+    """Generator version of an existing cohort (1 before versions were recorded), None if there is none."""
+    path = os.path.join(cohort, 'cohort.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return json.load(fh).get('generator_version', 1)
+
+
+def ensure_cohort(cohort, samples, seed, options=()):
+    """Generate a cohort unless one of the current generator version is already there."""
+    if cohort_version(cohort) != GENERATOR_VERSION:
+        shutil.rmtree(cohort, ignore_errors=True)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(HERE, 'synthetic_cohort.py'), '--samples', str(samples),
+                        '--outdir', cohort, '--seed', str(seed)] + list(options), check=True, stdout=subprocess.DEVNULL)
+        print(f"Generated {samples}-sample cohort {os.path.basename(cohort)} in {time.perf_counter() - start:.0f}s",
+              file=sys.stderr)
+    os.makedirs(os.path.join(cohort, 'runs'), exist_ok=True)
+
+
+def build_index(cohort):
+    """Taxonomy index of the cohort's database, once per cohort (cohorts of older generators use their reports)."""
+    path = os.path.join(cohort, 'taxonomy_index.npz')
+    if not os.path.exists(path):
+        source = os.path.join(cohort, 'metaphlan_taxonomy.tsv')
+        clades = [source] if os.path.exists(source) else sorted(glob.glob(os.path.join(cohort, 'metaphlan', '*_metaphlan.txt')))
+        subprocess.run(script('taxonomy_index.py') + ['build', '--clades'] + clades + ['--database', 'synthetic', '--output', path],
+                       check=True, stderr=subprocess.DEVNULL)
+    return path
+
+
+def run_once(command, cwd, env):
+    """Run a command; returns (wall seconds, CPU seconds, peak RSS MB) of that process alone."""
+    start = time.perf_counter()
+    with open(os.path.join(cwd, 'stdout.log'), 'w') as out:
+        proc = subprocess.Popen(command, cwd=cwd, env=env, stdout=out, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        with open(os.path.join(cwd, 'stdout.log')) as log:
+            tail = log.read()[-2000:]
+        raise RuntimeError(f"{' '.join(command[:2])} failed with exit {proc.returncode}:\n{tail}")
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss * scale / 1e6
+
+
+def phases(perf_dir):
+    """Per-phase seconds from the perf_metrics.py record of the run."""
+    records = glob.glob(os.path.join(perf_dir, '*.perf.json'))
+    if not records:
+        return {}
+    with open(records[0]) as fh:
+        record = json.load(fh)
+    result = {'import': record['import_seconds']}
+    result.update({p['name']: p['seconds'] for p in record['phases']})
+    return {name: round(seconds, 4) for name, seconds in result.items()}
+
+
+def dashboard(html):
+    """Size and V8 parse/load seconds of a dashboard (dashboard_parse.js); None without node."""
+    node = shutil.which('node')
+    if node is None:
+        return None
+    out = subprocess.run([node, os.path.join(HERE, 'dashboard_parse.js'), html],
+                         check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+def benchmark(step, cohort, samples, repeat, jobs):
+    best = None
+    for _ in range(repeat):
+        cwd = tempfile.mkdtemp(prefix=f"{step}.", dir=os.path.join(cohort, 'runs'))
+        env = dict(os.environ, GMWI2_PERF_METRICS=os.path.join(cwd, 'perf_metrics'),
+                   MPLCONFIGDIR=os.path.join(cwd, 'mplconfigdir'))
+        wall, cpu, rss = run_once(step_command(step, cohort, jobs), cwd, env)
+        result = {'step': step, 'samples': samples, 'wall_seconds': round(wall, 3),
+                  'cpu_seconds': round(cpu, 3), 'peak_rss_mb': round(rss, 1),
+                  'phases': phases(os.path.join(cwd, 'perf_metrics'))}
+        if step in PLOT_OPTIONS:
+            measured = dashboard(os.path.join(cwd, 'gmwi2_dashboard.html'))
+            if measured:
+                result['dashboard'] = measured
+        if step == 'marker_map':
+            # plot_scores draws the marker map of this cohort
+            shutil.copyfile(os.path.join(cwd, 'all_marker_map.tsv'), os.path.join(cohort, 'all_marker_map.tsv'))
+        shutil.rmtree(cwd)
+        if best is None or result['wall_seconds'] < best['wall_seconds']:
+            best = result
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """Print each result next to its baseline; returns the regressed (step, samples) pairs."""
+    base = {(r['step'], r['samples']): r for r in baseline.get('results', [])}
+    regressions = []
+    print(f"{'step':<30}{'samples':>8}{'wall_s':>10}{'base_s':>10}{'ratio':>8}{'rss_mb':>10}{'base_mb':>10}  status")
+    for r in results:
+        b = base.get((r['step'], r['samples']))
+        if b is None:
+            print(f"{r['step']:<30}{r['samples']:>8}{r['wall_seconds']:>10.2f}{'-':>10}{'-':>8}{r['peak_rss_mb']:>10.1f}{'-':>10}  new")
+            continue
+        ratio = r['wall_seconds'] / b['wall_seconds'] if b['wall_seconds'] else float('inf')
+        slower = r['wall_seconds'] > b['wall_seconds'] * (1 + tolerance) and r['wall_seconds'] - b['wall_seconds'] > MIN_SECONDS
+        bigger = r['peak_rss_mb'] > b['peak_rss_mb'] * (1 + tolerance) and r['peak_rss_mb'] - b['peak_rss_mb'] > MIN_RSS_MB
+        status = ' '.join(s for s, flag in [('SLOWER', slower), ('MORE-MEMORY', bigger)] if flag) or 'ok'
+        if slower or bigger:
+            regressions.append((r['step'], r['samples']))
+        print(f"{r['step']:<30}{r['samples']:>8}{r['wall_seconds']:>10.2f}{b['wall_seconds']:>10.2f}{ratio:>8.2f}"
+              f"{r['peak_rss_mb']:>10.1f}{b['peak_rss_mb']:>10.1f}  {status}")
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the post-processing scripts on synthetic cohorts.")
+    p.add_argument('--scales',    type=int, nargs='+', default=[10, 100, 1000, 10000], help="Cohort sizes (default: 10 100 1000 10000)")
+    p.add_argument('--steps',     nargs='+', default=STEPS, choices=STEPS, help="Steps to run (default: all)")
+    p.add_argument('--workdir',   default=os.path.join(tempfile.gettempdir(), 'gmwi2-bench'),
+                   help="Where cohorts are generated; existing cohorts of the same size, seed and generator version are reused")
+    p.add_argument('--repeat',    type=int, default=1, help="Runs per step; the fastest is kept (default: 1)")
+    p.add_argument('--jobs',      type=int, default=1, help="--jobs passed to the steps that take it (default: 1)")
+    p.add_argument('--seed',      type=int, default=1, help="Cohort generator seed (default: 1)")
+    p.add_argument('--baseline',  default=None, help="Baseline JSON to compare against")
+    p.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative slowdown/memory growth (default: 0.25)")
+    p.add_argument('--fail-on-regression', action='store_true', help="Exit 1 when a step regressed against the baseline")
+    p.add_argument('--output',    default='bench_results.json', help="Results JSON (default: bench_results.json)")
+    args = p.parse_args()
+
+    results = []
+    for samples in args.scales:
+        cohort = os.path.join(args.workdir, f"cohort_{samples}_seed{args.seed}")
+        deep = os.path.join(args.workdir, f"deep_{samples}_seed{args.seed}")
+        ensure_cohort(cohort, samples, args.seed)
+        if 'marker_map_deep' in args.steps:
+            ensure_cohort(deep, samples, args.seed, DEEP_COHORT)
+        if any(step.endswith('_indexed') for step in args.steps):
+            build_index(cohort)
+        # plot_scores needs the marker map, which the marker_map step writes
+        steps = sorted(args.steps, key=STEPS.index)
+        if any(step in PLOT_OPTIONS for step in steps) and 'marker_map' not in steps and not os.path.exists(os.path.join(cohort, 'all_marker_map.tsv')):
+            steps.insert(0, 'marker_map')
+        for step in steps:
+            result = benchmark(step, deep if step == 'marker_map_deep' else cohort, samples, args.repeat, args.jobs)
+            extra = ''
+            if 'dashboard' in result:
+                d = result['dashboard']
+                extra = f"  html {d['bytes'] / 1e6:.2f} MB, parse {d['parse_seconds']:.3f}s, load {d['load_seconds']:.3f}s"
+            print(f"{step:<30}{samples:>8} samples {result['wall_seconds']:>9.2f}s {result['peak_rss_mb']:>8.1f} MB{extra}", file=sys.stderr)
+            results.append(result)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'jobs': args.jobs,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'date': time.strftime('%Y-%m-%d'),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as fh:
+        json.dump(report, fh, indent=2)
+        fh.write('\n')
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(f"{len(regressions)} step(s) regressed beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Script: synthetic_cohort.py
+
+Generate a synthetic, seeded cohort with the files the post-processing steps
+read, for benchmarking them at 10 to 10k samples without real sequencing data.
+
+One species universe (real gut genera, MetaPhlAn 4 style k__..|s__..|t__SGB
+lineages with consistent synthetic NCBI taxids) is shared by every sample.
+Each sample draws a log-normal number of species weighted by a Zipf-like
+prevalence, with log-normal abundances and an UNKNOWN fraction; a small share
+of samples is 100% UNKNOWN. A fixed GMWI2 model of --model-taxa species with
+signed coefficients gives every sample its coefficient file and score, with
+GMWI2's presence rule (relative abundance / 100 above 0.00001).
+
+Output layout (under --outdir):
+  metaphlan/<S>_metaphlan.txt        MetaPhlAn report with the 4-line header stripped by metaphlan_qiime.nf
+  profiles/<S>_profile.txt           the same report after that strip (merge_absolute_metaphlan.py input)
+  gmwi2/<S>_GMWI2.txt                GMWI2 score
+  gmwi2/<S>_GMWI2_taxa.txt           present model taxa and their coefficients
+  taxonomy/<S>_profile_taxonomy.txt  Feature ID / Taxon table (qiime_taxmerge.py input)
+  reads/<S>_R{1,2}.fastq.gz          small paired FASTQs (check_samplesheet.py --preflight input)
+  gmrepo_markers.csv                 GMrepo-style marker database (ncbi_taxon_id, Taxon, n_samples, mean, median, sd)
+  metaphlan_taxonomy.tsv             clade name / taxid path of every species and strain, the stand-in for the
+                                     MetaPhlAn database taxonomy (taxonomy_index.py build --clades input)
+  marker_map_manifest.tsv            sample, mpa, coef (marker_map.py --manifest)
+  gmwi2_scores_table.tsv             sample, gmwi2_score (plot_scores.py --input)
+  merged_filtered_counts.tsv         biom-convert TSV of the cohort (convert_abundance.py input)
+  samplesheet.csv                    sample, read_1, read_2, group, run_accession
+  cohort.json                        generator parameters
+
+Usage:
+  python3 benchmarks/synthetic_cohort.py --samples 1000 --outdir bench/1000 --seed 1
+"""
+import argparse
+import gzip
+import json
+import os
+import numpy as np
+
+# (phylum, class, order, family, genus) of common gut genera
+GENERA = [
+    ('Bacteroidetes', 'Bacteroidia', 'Bacteroidales', 'Bacteroidaceae', 'Bacteroides'),
+    ('Bacteroidetes', 'Bacteroidia', 'Bacteroidales', 'Bacteroidaceae', 'Phocaeicola'),
+    ('Bacteroidetes', 'Bacteroidia', 'Bacteroidales', 'Prevotellaceae', 'Prevotella'),
+    ('Bacteroidetes', 'Bacteroidia', 'Bacteroidales', 'Rikenellaceae', 'Alistipes'),
+    ('Bacteroidetes', 'Bacteroidia', 'Bacteroidales', 'Tannerellaceae', 'Parabacteroides'),
+    ('Bacteroidetes', 'Bacteroidia', 'Bacteroidales', 'Barnesiellaceae', 'Barnesiella'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Oscillospiraceae', 'Faecalibacterium'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Oscillospiraceae', 'Ruminococcus'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Oscillospiraceae', 'Oscillibacter'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Lachnospiraceae', 'Roseburia'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Lachnospiraceae', 'Blautia'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Lachnospiraceae', 'Coprococcus'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Lachnospiraceae', 'Dorea'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Lachnospiraceae', 'Anaerostipes'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Lachnospiraceae', 'Lachnospira'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Eubacteriaceae', 'Eubacterium'),
+    ('Firmicutes', 'Clostridia', 'Eubacteriales', 'Clostridiaceae', 'Clostridium'),
+    ('Firmicutes', 'Bacilli', 'Lactobacillales', 'Streptococcaceae', 'Streptococcus'),
+    ('Firmicutes', 'Bacilli', 'Lactobacillales', 'Lactobacillaceae', 'Lactobacillus'),
+    ('Firmicutes', 'Negativicutes', 'Veillonellales', 'Veillonellaceae', 'Veillonella'),
+    ('Firmicutes', 'Negativicutes', 'Acidaminococcales', 'Acidaminococcaceae', 'Phascolarctobacterium'),
+    ('Actinobacteria', 'Actinomycetia', 'Bifidobacteriales', 'Bifidobacteriaceae', 'Bifidobacterium'),
+    ('Actinobacteria', 'Coriobacteriia', 'Coriobacteriales', 'Coriobacteriaceae', 'Collinsella'),
+    ('Actinobacteria', 'Coriobacteriia', 'Eggerthellales', 'Eggerthellaceae', 'Eggerthella'),
+    ('Proteobacteria', 'Gammaproteobacteria', 'Enterobacterales', 'Enterobacteriaceae', 'Escherichia'),
+    ('Proteobacteria', 'Gammaproteobacteria', 'Enterobacterales', 'Enterobacteriaceae', 'Klebsiella'),
+    ('Proteobacteria', 'Betaproteobacteria', 'Burkholderiales', 'Sutterellaceae', 'Sutterella'),
+    ('Verrucomicrobia', 'Verrucomicrobiae', 'Verrucomicrobiales', 'Akkermansiaceae', 'Akkermansia'),
+]
+EPITHETS = ['vulgatus', 'uniformis', 'ovatus', 'fragilis', 'caccae', 'prausnitzii', 'copri', 'intestinalis',
+            'bromii', 'obeum', 'longum', 'adolescentis', 'rectale', 'hominis', 'putredinis', 'finegoldii',
+            'distasonis', 'merdae', 'formicigenerans', 'hadrus', 'comes', 'eutactus', 'wadsworthensis',
+            'muciniphila', 'coli', 'pneumoniae', 'salivarius', 'parvula', 'aerofaciens', 'lenta',
+            'faecis', 'massiliensis', 'stercoris', 'gnavus', 'torques', 'siraeum', 'callidus', 'catus']
+RANK_PREFIXES = ['k', 'p', 'c', 'o', 'f', 'g', 's']
+HEADER = 'clade_name\tclade_taxid\trelative_abundance\tcoverage\testimated_number_of_reads_from_the_clade'
+GMWI2_PRESENCE = 0.00001
+# bumped when the same parameters generate different files; recorded in cohort.json
+GENERATOR_VERSION = 2
+
+
+def build_universe(n_species, rng):
+    """
+    Species universe: names, lineages and taxids shared by the whole cohort.
+
+    Returns a dict of per-rank names/taxids (index arrays map species to their
+    ancestor at each rank) plus species prevalence weights.
+    """
+    genus_weight = 1.0 / np.arange(1, len(GENERA) + 1) ** 0.8
+    genus_of = np.sort(rng.choice(len(GENERA), size=n_species, p=genus_weight / genus_weight.sum()))
+    names, seen = [], {}
+    for g in genus_of:
+        genus = GENERA[g][4]
+        k = seen.get(genus, 0)
+        seen[genus] = k + 1
+        epithet = EPITHETS[k] if k < len(EPITHETS) else f"sp_AF{k - len(EPITHETS) + 1}"
+        names.append(f"{genus}_{epithet}")
+
+    ranks = {}
+    for depth in range(5):
+        labels = [GENERA[g][depth] for g in genus_of]
+        unique = sorted(set(labels))
+        # synthetic but stable NCBI-like taxids per rank block
+        taxid = {name: 1000 * (depth + 1) + i for i, name in enumerate(unique)}
+        if depth == 4:
+            taxid = {name: 100000 + i for i, name in enumerate(unique)}
+        ranks[RANK_PREFIXES[depth + 1]] = {
+            'names': unique,
+            'taxids': np.array([taxid[name] for name in unique]),
+            'index': np.array([unique.index(label) for label in labels]),
+        }
+    # prevalence: a few core species are in most samples, the long tail is rare
+    prevalence = 1.0 / np.arange(1, n_species + 1) ** 0.9
+    prevalence = rng.permutation(prevalence)
+    return {
+        'species': names,
+        'species_taxids': 1000000 + np.arange(n_species),
+        'sgb': 4000 + np.arange(n_species),
+        'ranks': ranks,
+        'prevalence': prevalence / prevalence.sum(),
+        'lineage': [lineage(ranks, names, i) for i in range(n_species)],
+    }
+
+
+def lineage(ranks, names, i):
+    """(clade name, taxid path) of species i down to the species rank."""
+    clade = ['k__Bacteria']
+    taxids = ['2']
+    for prefix in RANK_PREFIXES[1:6]:
+        r = ranks[prefix]
+        clade.append(f"{prefix}__{r['names'][r['index'][i]]}")
+        taxids.append(str(r['taxids'][r['index'][i]]))
+    clade.append(f"s__{names[i]}")
+    taxids.append(str(1000000 + i))
+    return '|'.join(clade), '|'.join(taxids)
+
+
+def draw_sample(universe, rng, mean_species):
+    """Present species (indices) and their percent abundances for one sample."""
+    n_universe = len(universe['species'])
+    richness = int(np.clip(rng.lognormal(np.log(mean_species), 0.35), 10, n_universe))
+    present = rng.choice(n_universe, size=richness, replace=False, p=universe['prevalence'])
+    weights = rng.lognormal(0.0, 2.0, size=richness)
+    unknown = rng.uniform(5, 40)
+    return present, weights / weights.sum() * (100 - unknown), unknown
+
+
+def profile_lines(universe, present, abundance, unknown, mapped_reads):
+    """MetaPhlAn 4 report rows (kingdom to strain, each rank by abundance) of one sample."""
+    reads = lambda a: int(round(a / 100 * mapped_reads))
+    rows = [f"k__Bacteria\t2\t{100 - unknown:.5f}\t-\t{reads(100 - unknown)}",
+            f"UNKNOWN\t-1\t{unknown:.5f}\t-\t{reads(unknown)}"]
+    for depth, prefix in enumerate(RANK_PREFIXES[1:6], start=1):
+        rank = universe['ranks'][prefix]
+        sums = np.bincount(rank['index'][present], weights=abundance, minlength=len(rank['names']))
+        for g in np.argsort(-sums, kind='stable'):
+            if sums[g] <= 0:
+                break
+            # lineage of any present member of the group
+            member = present[rank['index'][present] == g][0]
+            clade, taxids = universe['lineage'][member]
+            clade = '|'.join(clade.split('|')[:depth + 1])
+            taxids = '|'.join(taxids.split('|')[:depth + 1])
+            rows.append(f"{clade}\t{taxids}\t{sums[g]:.5f}\t-\t{reads(sums[g])}")
+    order = np.argsort(-abundance, kind='stable')
+    species_rows, strain_rows = [], []
+    for i in order:
+        clade, taxids = universe['lineage'][present[i]]
+        coverage = abundance[i] * mapped_reads * 150 / 100 / 3e6
+        species_rows.append(f"{clade}\t{taxids}\t{abundance[i]:.5f}\t{coverage:.5f}\t{reads(abundance[i])}")
+        strain_rows.append(f"{clade}|t__SGB{universe['sgb'][present[i]]}\t{taxids}|\t{abundance[i]:.5f}\t{coverage:.5f}\t{reads(abundance[i])}")
+    return rows + species_rows + strain_rows
+
+
+def fastq_bytes(n_reads, rng, length=150):
+    """One gzipped FASTQ of n_reads random reads, reused for every sample."""
+    bases = np.array(list('ACGT'))
+    lines = []
+    for i in range(n_reads):
+        lines += [f"@read{i}", ''.join(rng.choice(bases, size=length)), '+', 'F' * length]
+    return gzip.compress(('\n'.join(lines) + '\n').encode(), compresslevel=6, mtime=0)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Generate a synthetic cohort for benchmarking the post-processing steps.")
+    p.add_argument('--samples',      type=int, required=True, help="Number of samples")
+    p.add_argument('--outdir',       required=True, help="Output directory")
+    p.add_argument('--species',      type=int, default=1500, help="Size of the species universe (default: 1500)")
+    p.add_argument('--mean-species', type=float, default=180, help="Median species per sample (default: 180)")
+    p.add_argument('--model-taxa',   type=int, default=97, help="Species in the GMWI2 model (default: 97)")
+    p.add_argument('--db-fraction',  type=float, default=0.75, help="Share of the universe in the marker database (default: 0.75)")
+    p.add_argument('--unknown-only', type=float, default=0.005, help="Share of 100%% UNKNOWN samples (default: 0.005)")
+    p.add_argument('--fastq-reads',  type=int, default=100, help="Reads per FASTQ file; 0 skips the FASTQs (default: 100)")
+    p.add_argument('--seed',         type=int, default=1, help="Random seed (default: 1)")
+    args = p.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    universe = build_universe(args.species, rng)
+    n_species = len(universe['species'])
+    for sub in ['metaphlan', 'profiles', 'gmwi2', 'taxonomy', 'reads']:
+        os.makedirs(os.path.join(args.outdir, sub), exist_ok=True)
+    out = lambda *parts: os.path.join(args.outdir, *parts)
+
+    # GMWI2 model: prevalent species are more likely to be model features
+    model = rng.choice(n_species, size=min(args.model_taxa, n_species), replace=False, p=universe['prevalence'])
+    coefficients = np.zeros(n_species)
+    # rounded like the coefficients written to the taxa files, so scores can be recomputed from them
+    coefficients[model] = np.round(rng.choice([-1, 1], size=len(model)) * rng.uniform(0.05, 1.0, size=len(model)), 4)
+
+    # GMrepo-style marker database over a subset of the universe
+    in_db = np.sort(rng.choice(n_species, size=int(n_species * args.db_fraction), replace=False))
+    with open(out('gmrepo_markers.csv'), 'w') as f:
+        f.write('ncbi_taxon_id,Taxon,n_samples,mean,median,sd\n')
+        for i in in_db:
+            median = rng.lognormal(-1.0, 1.2)
+            f.write(f"{universe['species_taxids'][i]},{universe['species'][i]},{int(rng.integers(20, 20000))},"
+                    f"{median * rng.uniform(1.0, 2.5):.4f},{median:.4f},{median * rng.uniform(0.5, 3):.4f}\n")
+
+    with open(out('metaphlan_taxonomy.tsv'), 'w') as f:
+        for i in range(n_species):
+            clade, taxids = universe['lineage'][i]
+            f.write(f"{clade}\t{taxids}\n{clade}|t__SGB{universe['sgb'][i]}\t{taxids}|\n")
+
+    fastq = fastq_bytes(args.fastq_reads, rng) if args.fastq_reads else None
+    samples = [f"S{i:05d}" for i in range(args.samples)]
+    abundance_matrix = np.zeros((n_species, len(samples)))
+
+    with open(out('marker_map_manifest.tsv'), 'w') as manifest, \
+         open(out('gmwi2_scores_table.tsv'), 'w') as scores, \
+         open(out('samplesheet.csv'), 'w') as sheet:
+        manifest.write('sample\tmpa\tcoef\n')
+        scores.write('sample\tgmwi2_score\n')
+        sheet.write('sample,read_1,read_2,group,run_accession\n')
+        for col, sample in enumerate(samples):
+            total_reads = int(rng.uniform(5e6, 4e7))
+            mapped = int(total_reads * rng.uniform(0.3, 0.7))
+            if rng.random() < args.unknown_only:
+                present, abundance = np.empty(0, dtype=int), np.empty(0)
+                rows = [f"UNKNOWN\t-1\t100.00000\t-\t{total_reads}"]
+            else:
+                present, abundance, unknown = draw_sample(universe, rng, args.mean_species)
+                rows = profile_lines(universe, present, abundance, unknown, mapped)
+                abundance_matrix[present, col] = abundance
+
+            header = ["#mpa_vJan21_CHOCOPhlAnSGB_202103",
+                      f"#/usr/local/bin/metaphlan {sample}_R1.fastq.gz,{sample}_R2.fastq.gz --input_type fastq -t rel_ab_w_read_stats",
+                      f"#{total_reads} reads processed",
+                      f"#estimated_reads_mapped_to_known_clades:{mapped}"]
+            with open(out('metaphlan', f"{sample}_metaphlan.txt"), 'w') as f:
+                f.write('\n'.join(header + ['#' + HEADER] + rows) + '\n')
+            with open(out('profiles', f"{sample}_profile.txt"), 'w') as f:
+                f.write('\n'.join([HEADER] + rows) + '\n')
+
+            # GMWI2 presence: relative abundance as written in the report, as a fraction, above 0.00001
+            hits = [i for i, a in zip(present, abundance) if coefficients[i] != 0 and float(f"{a:.5f}") / 100 > GMWI2_PRESENCE]
+            with open(out('gmwi2', f"{sample}_GMWI2_taxa.txt"), 'w') as f:
+                f.write('taxa_name\tcoefficient\n')
+                for i in sorted(hits, key=lambda i: -coefficients[i]):
+                    f.write(f"{universe['lineage'][i][0]}\t{coefficients[i]:.4f}\n")
+            score = float(sum(coefficients[i] for i in hits))
+            with open(out('gmwi2', f"{sample}_GMWI2.txt"), 'w') as f:
+                f.write(f"{score:.6f}\n")
+
+            with open(out('taxonomy', f"{sample}_profile_taxonomy.txt"), 'w') as f:
+                f.write('Feature ID\tTaxon\n')
+                if not len(present):
+                    f.write('-1\tUNKNOWN\n')
+                for i in present:
+                    f.write(f"{universe['species_taxids'][i]}\t{universe['lineage'][i][0].replace('|', ';')}\n")
+
+            manifest.write(f"{sample}\t{os.path.abspath(out('metaphlan', sample + '_metaphlan.txt'))}\t"
+                           f"{os.path.abspath(out('gmwi2', sample + '_GMWI2_taxa.txt'))}\n")
+            scores.write(f"{sample}\t{score:.6f}\n")
+            if fastq is not None:
+                reads = [os.path.abspath(out('reads', f"{sample}_R{r}.fastq.gz")) for r in (1, 2)]
+                for path in reads:
+                    with open(path, 'wb') as f:
+                        f.write(fastq)
+                sheet.write(f"{sample},{reads[0]},{reads[1]},group{col % 2},\n")
+
+    # cohort feature table as written by `biom convert --to-tsv`
+    observed = abundance_matrix.any(axis=1)
+    with open(out('merged_filtered_counts.tsv'), 'w') as f:
+        f.write('# Constructed from biom file\n')
+        f.write('\t'.join(['#OTU ID'] + samples) + '\n')
+        for i in np.flatnonzero(observed):
+            f.write(str(universe['species_taxids'][i]) + '\t' + '\t'.join(f"{v:.5g}" for v in abundance_matrix[i]) + '\n')
+
+    with open(out('cohort.json'), 'w') as f:
+        json.dump(dict(vars(args), generator_version=GENERATOR_VERSION), f, indent=2)
+    print(f"Wrote {len(samples)} synthetic samples over {n_species} species to {args.outdir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Script: task_counts.py
+
+Task-count regression check of the pipeline on synthetic N-sample cohorts:
+counts the tasks of every process in the Nextflow trace file of a run and
+fails if any process ran more than once per sample, the way the old
+metaphlan x GMWI2 taxa cartesian product in FINAL_REPORT launched N*N
+MARKER_MAP tasks. Per-sample steps run N tasks, batched steps (MARKER_MAP,
+GMWI2_REPORT, ...) one per batch, so with N >= 2 a quadratic fan-out always
+exceeds the bound. --expect pins exact counts of given processes.
+
+  stub-run  generates a cohort of every --scales size (synthetic_cohort.py),
+            runs `nextflow run main.nf -stub-run` on it against an empty
+            database_location, and checks each trace; across the scales every
+            process must run a + b*N tasks with b 0 (batched) or 1 (per
+            sample). The `stub:` blocks of the processes only create their
+            output files, so a run takes seconds; SAMPLESHEET_CHECK has no
+            stub and parses the samplesheet for real.
+  check     checks the trace of a single run made by hand.
+
+Only tasks that completed (or were cached) are counted; failed attempts that
+were retried are not.
+
+Usage:
+  python3 benchmarks/task_counts.py stub-run --scales 2 4 8 --workdir bench/task_counts
+  python3 benchmarks/synthetic_cohort.py --samples 3 --outdir bench/3 --seed 1
+  nextflow run main.nf --design bench/3/samplesheet.csv -with-trace trace.txt
+  python3 benchmarks/task_counts.py check trace.txt --samples 3 --expect MARKER_MAP=1 SCORE_TABLE=1
+"""
+import argparse
+import csv
+import os
+import subprocess
+import sys
+from collections import Counter
+
+COUNTED = {'COMPLETED', 'CACHED'}
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# batched steps of a default run (one task per cohort)
+STUB_EXPECT = ['MARKER_MAP=1', 'SCORE_TABLE=1', 'PLOT_SCORES=1']
+
+
+def process_name(task_name):
+    """Process of a trace task name, e.g. 'FINAL_REPORT:MARKER_MAP (tag)' -> 'MARKER_MAP'."""
+    return task_name.split(' (', 1)[0].rsplit(':', 1)[-1]
+
+
+def count_tasks(trace):
+    """Completed or cached tasks per process in a Nextflow trace file."""
+    with open(trace, newline='') as handle:
+        rows = csv.DictReader(handle, delimiter='\t')
+        if 'name' not in (rows.fieldnames or []):
+            sys.exit(f"ERROR: {trace} has no 'name' column; is it a Nextflow trace file?")
+        return Counter(process_name(row['name']) for row in rows
+                       if row.get('status', 'COMPLETED') in COUNTED)
+
+
+def parse_expect(items):
+    expect = {}
+    for item in items:
+        name, sep, count = item.partition('=')
+        if not sep or not count.isdigit():
+            sys.exit(f"ERROR: --expect takes PROCESS=COUNT, got '{item}'")
+        expect[name] = int(count)
+    return expect
+
+
+def count_errors(counts, samples, expect):
+    """Processes of one run above one task per sample or off their expected count."""
+    errors = []
+    for name in sorted(set(counts) | set(expect)):
+        count = counts.get(name, 0)
+        if count > samples:
+            errors.append(f"{name} ran {count} tasks for {samples} samples")
+        if name in expect and count != expect[name]:
+            errors.append(f"{name} ran {count} tasks for {samples} samples, expected {expect[name]}")
+    return errors
+
+
+def growth_errors(runs):
+    """Processes whose task counts across the runs ({samples: counts}) are not a + b*N with b 0 or 1."""
+    errors = []
+    scales = sorted(runs)
+    for name in sorted(set().union(*runs.values())):
+        counts = [runs[n].get(name, 0) for n in scales]
+        slope = (counts[-1] - counts[0]) / (scales[-1] - scales[0])
+        if slope not in (0, 1) or any(c != counts[0] + slope * (n - scales[0]) for n, c in zip(scales, counts)):
+            errors.append(f"{name} ran {', '.join(map(str, counts))} tasks for {', '.join(map(str, scales))} samples")
+    return errors
+
+
+def stub_database(root):
+    """Empty database_location layout; the stubbed tasks only need the paths they stage to exist."""
+    for sub in ['metaphlan-databases', 'genome-databases/GRCh38_noalt_as', 'marker-databases']:
+        os.makedirs(os.path.join(root, sub), exist_ok=True)
+    open(os.path.join(root, 'marker-databases', 'gmrepo_254_unique.csv'), 'a').close()
+    return root
+
+
+def stub_run(samples, workdir, database, nextflow):
+    """Counts of a -stub-run of the pipeline on a generated cohort of the given size."""
+    cohort = os.path.join(workdir, f"cohort_{samples}")
+    samplesheet = os.path.join(cohort, 'samplesheet.csv')
+    if not os.path.isfile(samplesheet):
+        subprocess.run([sys.executable, os.path.join(REPO, 'benchmarks', 'synthetic_cohort.py'),
+                        '--samples', str(samples), '--outdir', cohort, '--seed', '1', '--fastq-reads', '4'],
+                       check=True, stdout=subprocess.DEVNULL)
+    trace = os.path.join(workdir, f"trace_{samples}.txt")
+    if os.path.exists(trace):
+        os.remove(trace)
+    subprocess.run([nextflow, 'run', os.path.join(REPO, 'main.nf'), '-stub-run', '-ansi-log', 'false',
+                    '--design', samplesheet,
+                    '--database_location', database,
+                    '--outdir', os.path.join(workdir, f"results_{samples}"),
+                    '-work-dir', os.path.join(workdir, 'work'),
+                    '-with-trace', trace],
+                   check=True, cwd=workdir)
+    return count_tasks(trace)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Check that no process of a pipeline run ran more than once per sample.")
+    sub = p.add_subparsers(dest='command', required=True)
+
+    s = sub.add_parser('stub-run', help="Stub-run the pipeline on synthetic cohorts and check the task counts")
+    s.add_argument('--scales',   type=int, nargs='+', default=[2, 4, 8], help="Cohort sizes (default: 2 4 8)")
+    s.add_argument('--workdir',  default='task_counts', help="Directory for the cohorts, traces and work dir")
+    s.add_argument('--nextflow', default='nextflow', help="Nextflow executable (default: nextflow)")
+    s.add_argument('--expect',   nargs='*', default=STUB_EXPECT,
+                   help=f"Exact task counts at every scale, as PROCESS=COUNT (default: {' '.join(STUB_EXPECT)})")
+
+    c = sub.add_parser('check', help="Check the trace of one run")
+    c.add_argument('trace',               help="Nextflow trace file of the run (-with-trace)")
+    c.add_argument('--samples', type=int, required=True, help="Number of samples in the run")
+    c.add_argument('--expect',  nargs='*', default=[], help="Exact task counts, as PROCESS=COUNT")
+    args = p.parse_args()
+
+    expect = parse_expect(args.expect)
+    if args.command == 'check':
+        counts = count_tasks(args.trace)
+        for name in sorted(counts):
+            print(f"{name}\t{counts[name]}")
+        errors = count_errors(counts, args.samples, expect)
+        if errors:
+            sys.exit("ERROR: " + "; ".join(errors))
+        print(f"OK: {sum(counts.values())} tasks, no process above one task per sample ({args.samples})", file=sys.stderr)
+        return
+
+    scales = sorted(set(args.scales))
+    if len(scales) < 2 or scales[0] < 2:
+        sys.exit("ERROR: --scales needs at least two cohort sizes of 2 samples or more")
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    database = stub_database(os.path.join(workdir, 'databases'))
+    runs = {n: stub_run(n, workdir, database, args.nextflow) for n in scales}
+
+    print('process\t' + '\t'.join(f"N={n}" for n in scales))
+    for name in sorted(set().union(*runs.values())):
+        print(name + '\t' + '\t'.join(str(runs[n].get(name, 0)) for n in scales))
+    errors = [e for n in scales for e in count_errors(runs[n], n, expect)] + growth_errors(runs)
+    if errors:
+        sys.exit("ERROR: " + "; ".join(errors))
+    print(f"OK: task counts grow linearly with N ({', '.join(map(str, scales))} samples)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import argparse
 import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 
+# Decompressed bytes read per chunk during the pre-flight scan
+CHUNK_SIZE = 1 << 20
+
 def parse_args(args=None):
     Description = "Reformat aladdin-shotgun samplesheet file and check its contents."
 
@@ -13,6 +19,10 @@ def parse_args(args=None):
     parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
     parser.add_argument("FILE_IN", help="Input samplesheet file.")
     parser.add_argument("FILE_OUT", help="Output file.")
+    parser.add_argument("--preflight", action="store_true",
+                        help="Decompress every FASTQ to validate its gzip stream and count reads, checking R1/R2 parity.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of FASTQ files scanned in parallel during the pre-flight.")
+    parser.add_argument("--read-counts", default="read_counts.tsv", help="Per-sample read counts written by the pre-flight.")
     return parser.parse_args(args)
 
 def print_error(error, context="Line", context_str=""):
@@ -47,11 +57,102 @@ def check_fastq_suffix(filename):
         print_error("FASTQ path has invalid extension", "Path", filename)
     return True
 
+def scan_fastq(path):
+    '''Stream a gzipped FASTQ in constant memory and count its reads.
+
+    Returns (path, reads, error); error is None when the file is a complete gzip
+    stream (all members) holding a whole number of 4-line records.
+    '''
+    if not os.path.isfile(path):
+        return path, None, "file does not exist"
+    lines = 0
+    last = b"\n"
+    pending = False  # inside a gzip member whose end has not been seen yet
+    try:
+        with open(path, "rb") as fh:
+            inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            while True:
+                raw = inflater.unconsumed_tail or fh.read(CHUNK_SIZE)
+                if not raw:
+                    break
+                pending = True
+                data = inflater.decompress(raw, CHUNK_SIZE)
+                while inflater.eof:
+                    # concatenated gzip members: carry on with whatever follows this one
+                    rest = inflater.unused_data
+                    inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                    pending = bool(rest)
+                    if not rest:
+                        break
+                    data += inflater.decompress(rest, CHUNK_SIZE)
+                if data:
+                    lines += data.count(b"\n")
+                    last = data[-1:]
+            if pending:
+                return path, None, "truncated gzip stream"
+    except zlib.error as e:
+        return path, None, "corrupt gzip stream ({})".format(e)
+    except OSError as e:
+        return path, None, "unreadable ({})".format(e)
+    if last != b"\n":
+        lines += 1
+    if lines == 0:
+        return path, None, "contains no reads"
+    if lines % 4:
+        return path, None, "{} lines is not a whole number of FASTQ records".format(lines)
+    return path, lines // 4, None
+
+def scan_fastqs(paths, jobs):
+    '''Scan every FASTQ once, jobs files at a time, keeping input order.'''
+    if jobs <= 1 or len(paths) <= 1:
+        return [scan_fastq(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(scan_fastq, paths))
+
+def preflight(design, jobs, counts_out):
+    '''
+    Validate every FASTQ of the samplesheet in one pass and report all bad rows together.
+
+    Remote (URI) paths are left to Nextflow to stage and are not scanned.
+    Returns the number of reads per row (R1 reads, i.e. read pairs for paired-end).
+    '''
+    paths = pd.concat([design["read_1"], design["read_2"].dropna()])
+    local = [p for p in paths.unique() if "://" not in p]
+    scanned = {path: (reads, error) for path, reads, error in scan_fastqs(local, jobs)}
+
+    errors = []
+    rows = []
+    for _, row in design.iterrows():
+        run = row.get("run_accession")
+        label = "{}_{}".format(row["sample"], run) if isinstance(run, str) and run else row["sample"]
+        counts = []
+        for column in ["read_1", "read_2"]:
+            path = row[column]
+            if pd.isna(path) or path not in scanned:
+                counts.append(None)
+                continue
+            reads, error = scanned[path]
+            if error:
+                errors.append("{}\t{}\t{}".format(label, path, error))
+            counts.append(reads)
+        if counts[0] is not None and counts[1] is not None and counts[0] != counts[1]:
+            errors.append("{}\t{}\tR1 has {} reads but R2 has {}".format(label, row["read_2"], counts[0], counts[1]))
+        rows.append([label, row["sample"], counts[0], counts[1]])
+
+    if errors:
+        print("\n".join(["sample\tpath\terror"] + errors))
+        print_error("{} FASTQ problem(s) found by the pre-flight, see above".format(len(errors)))
+
+    counts = pd.DataFrame(rows, columns=["prefix", "sample", "read_1_count", "read_2_count"])
+    counts = counts.astype({"read_1_count": "Int64", "read_2_count": "Int64"})
+    counts.to_csv(counts_out, sep="\t", index=False)
+    return counts["read_1_count"].tolist()
+
 def check_all_se_or_all_pe(group):
     '''Helper function to check if all runs of same sample are either all single-ended or all paired-ended'''
     return group['read_2'].count() == 0 or group['read_2'].count() == group['read_1'].count()
 
-def check_samplesheet(file_in, file_out):
+def check_samplesheet(file_in, file_out, run_preflight=False, jobs=1, counts_out="read_counts.tsv"):
     """
     This function checks that the samplesheet follows the following structure:
 
@@ -117,6 +218,10 @@ def check_samplesheet(file_in, file_out):
             if row["size"]>1 and row["size"] != row["nunique"]:
                 print_error("run_accession missing or not unique for the same sample", "Sample", idx)
 
+    # Optionally decompress every FASTQ now rather than failing hours into GMWI2
+    if run_preflight:
+        design["read_count"] = preflight(design, jobs, counts_out)
+
     ###################################################
     # PREPARE for OUTPUT
     # Add a "run_accession" column if one doesn't exist
@@ -151,7 +256,7 @@ def check_samplesheet(file_in, file_out):
 
 def main(args=None):
     args = parse_args(args)
-    check_samplesheet(args.FILE_IN, args.FILE_OUT)
+    check_samplesheet(args.FILE_IN, args.FILE_OUT, args.preflight, args.jobs, args.read_counts)
 
 if __name__ == "__main__":
     sys.exit(main())
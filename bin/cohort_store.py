@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Script: cohort_store.py
+
+Consolidate per-sample GMWI2 results into one indexed SQLite cohort store, and
+query it from Python or the command line.
+
+Tables (one row per sample / sample x taxon):
+  scores             sample, gmwi2_score
+  taxa_coefficients  sample, taxa_name, species, coefficient
+  species_abundance  sample, taxid, clade_name, rank, species, relative_abundance, estimated_reads
+  marker_map         sample, species, user_abundance, db_median, db_mean
+
+species_abundance holds every rank of the MetaPhlAn profile ('rank' is the
+k/p/c/o/f/g/s/t letter) and is indexed on (taxid, relative_abundance) and
+(species, relative_abundance), so "samples where species X > 1%" is an index
+range scan. Every table is indexed on sample. Loading a sample replaces its
+previous rows, so a store can be extended run after run.
+
+Usage:
+  python3 cohort_store.py build --db cohort.sqlite \
+    --scores *_GMWI2.txt --taxa *_GMWI2_taxa.txt --metaphlan *_metaphlan.txt \
+    --marker-map all_marker_map.tsv
+  python3 cohort_store.py query --db cohort.sqlite --species Faecalibacterium_prausnitzii --min-abundance 1
+
+  from cohort_store import CohortStore
+  with CohortStore('cohort.sqlite') as store:
+      store.samples_with_species('Faecalibacterium_prausnitzii', min_abundance=1.0)
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import perf_metrics
+import pandas as pd
+from metaphlan_profile import annotate_clades, read_profile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    sample TEXT PRIMARY KEY,
+    gmwi2_score REAL
+);
+CREATE TABLE IF NOT EXISTS taxa_coefficients (
+    sample TEXT NOT NULL,
+    taxa_name TEXT,
+    species TEXT,
+    coefficient REAL
+);
+CREATE TABLE IF NOT EXISTS species_abundance (
+    sample TEXT NOT NULL,
+    taxid INTEGER,
+    clade_name TEXT,
+    rank TEXT,
+    species TEXT,
+    relative_abundance REAL,
+    estimated_reads REAL
+);
+CREATE TABLE IF NOT EXISTS marker_map (
+    sample TEXT NOT NULL,
+    species TEXT,
+    user_abundance REAL,
+    db_median REAL,
+    db_mean REAL
+);
+CREATE INDEX IF NOT EXISTS taxa_coefficients_sample ON taxa_coefficients (sample);
+CREATE INDEX IF NOT EXISTS species_abundance_sample ON species_abundance (sample);
+CREATE INDEX IF NOT EXISTS species_abundance_taxid ON species_abundance (taxid, relative_abundance);
+CREATE INDEX IF NOT EXISTS species_abundance_species ON species_abundance (species, relative_abundance);
+CREATE INDEX IF NOT EXISTS marker_map_sample ON marker_map (sample);
+CREATE INDEX IF NOT EXISTS marker_map_species ON marker_map (species);
+"""
+
+
+def sample_name(path, suffix):
+    name = os.path.basename(path)
+    return name[:-len(suffix)] if name.endswith(suffix) else name
+
+
+class CohortStore:
+    """Indexed SQLite store of cohort results with a small query API."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    # ───────────── loading ─────────────
+
+    def _replace(self, table, frame):
+        """Replace the rows of every sample in frame with frame's rows."""
+        samples = frame['sample'].unique().tolist()
+        self.conn.executemany(f"DELETE FROM {table} WHERE sample = ?", [(s,) for s in samples])
+        frame.to_sql(table, self.conn, if_exists='append', index=False)
+
+    def load_scores(self, paths):
+        rows = []
+        for path in paths:
+            with open(path) as fh:
+                rows.append((sample_name(path, '_GMWI2.txt'), float(fh.read().strip())))
+        self._replace('scores', pd.DataFrame(rows, columns=['sample', 'gmwi2_score']))
+
+    def load_score_table(self, path, score_column='gmwi2_score'):
+        table = pd.read_csv(path, sep='\t')
+        self._replace('scores', table[['sample', score_column]].rename(columns={score_column: 'gmwi2_score'}))
+
+    def load_taxa_coefficients(self, paths):
+        frames = []
+        for path in paths:
+            coef = pd.read_csv(path, sep='\t')
+            frames.append(pd.DataFrame({
+                'sample': sample_name(path, '_GMWI2_taxa.txt'),
+                'taxa_name': coef['taxa_name'],
+                'species': annotate_clades(coef['taxa_name'])['species'],
+                'coefficient': coef['coefficient'],
+            }))
+        if frames:
+            self._replace('taxa_coefficients', pd.concat(frames, ignore_index=True))
+
+    def load_metaphlan(self, paths):
+        for path in paths:
+            # one profile per transaction keeps memory flat for large cohorts
+            profile = read_profile(path)
+            self._replace('species_abundance', pd.DataFrame({
+                'sample': sample_name(path, '_metaphlan.txt'),
+                'taxid': profile['taxid'],
+                'clade_name': profile['clade_name'],
+                'rank': profile['rank'],
+                'species': profile['species'],
+                'relative_abundance': profile['relative_abundance'],
+                'estimated_reads': profile['estimated_number_of_reads_from_the_clade'],
+            }))
+
+    def load_marker_map(self, path):
+        self._replace('marker_map', pd.read_csv(path, sep='\t', na_values=['NA']))
+
+    def commit(self):
+        self.conn.commit()
+        self.conn.execute('ANALYZE')
+
+    # ───────────── queries ─────────────
+
+    def query(self, sql, params=()):
+        """Run any SQL against the store and return a DataFrame."""
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def samples_with_species(self, species, min_abundance=0.0):
+        """
+        Samples whose relative abundance (%) of a species is above min_abundance.
+
+        species is a species name as in the profile (e.g. 'Escherichia_coli') or an NCBI taxid.
+        """
+        column = 'taxid' if str(species).lstrip('-').isdigit() else 'species'
+        return self.query(
+            f"SELECT sample, species, taxid, relative_abundance FROM species_abundance "
+            f"WHERE {column} = ? AND rank = 's' AND relative_abundance > ? ORDER BY relative_abundance DESC",
+            (int(species) if column == 'taxid' else species, min_abundance))
+
+    def profile(self, sample, rank='s'):
+        """The MetaPhlAn profile of one sample at one rank."""
+        return self.query(
+            "SELECT taxid, clade_name, species, relative_abundance, estimated_reads FROM species_abundance "
+            "WHERE sample = ? AND rank = ? ORDER BY relative_abundance DESC", (sample, rank))
+
+    def scores(self, samples=None):
+        if samples is None:
+            return self.query("SELECT sample, gmwi2_score FROM scores ORDER BY sample")
+        marks = ','.join('?' * len(samples))
+        return self.query(f"SELECT sample, gmwi2_score FROM scores WHERE sample IN ({marks}) ORDER BY sample", tuple(samples))
+
+    def taxa_coefficients(self, sample):
+        return self.query("SELECT taxa_name, species, coefficient FROM taxa_coefficients WHERE sample = ?", (sample,))
+
+    def marker_map(self, sample):
+        return self.query("SELECT species, user_abundance, db_median, db_mean FROM marker_map WHERE sample = ?", (sample,))
+
+
+def main():
+    p = argparse.ArgumentParser(description="Build or query the SQLite cohort result store.")
+    sub = p.add_subparsers(dest='command', required=True)
+
+    b = sub.add_parser('build', help="Load per-sample results into the store (creating or extending it)")
+    b.add_argument('--db',          required=True, help="SQLite store path")
+    b.add_argument('--scores',      nargs='*', default=[], help="<sample>_GMWI2.txt score files")
+    b.add_argument('--score-table', default=None, help="Score table (sample, gmwi2_score) instead of --scores")
+    b.add_argument('--taxa',        nargs='*', default=[], help="<sample>_GMWI2_taxa.txt coefficient files")
+    b.add_argument('--metaphlan',   nargs='*', default=[], help="<sample>_metaphlan.txt profiles")
+    b.add_argument('--marker-map',  default=None, help="all_marker_map.tsv")
+    perf_metrics.add_argument(b)
+
+    q = sub.add_parser('query', help="Query the store; prints a TSV")
+    q.add_argument('--db',            required=True, help="SQLite store path")
+    q.add_argument('--species',       default=None, help="Species name or NCBI taxid to filter samples on")
+    q.add_argument('--min-abundance', type=float, default=0.0, help="Relative abundance (%%) threshold for --species")
+    q.add_argument('--sample',        default=None, help="Print this sample's species profile")
+    q.add_argument('--sql',           default=None, help="Arbitrary SQL")
+    args = p.parse_args()
+
+    if args.command == 'build':
+        with perf_metrics.record('cohort_store', args.perf_metrics), CohortStore(args.db) as store:
+            perf_metrics.count('samples', len(args.scores))
+            with perf_metrics.phase('write'):
+                if args.score_table:
+                    store.load_score_table(args.score_table)
+                store.load_scores(args.scores)
+                store.load_taxa_coefficients(args.taxa)
+                store.load_metaphlan(args.metaphlan)
+                if args.marker_map:
+                    store.load_marker_map(args.marker_map)
+            with perf_metrics.phase('index'):
+                store.commit()
+            n = store.query("SELECT COUNT(DISTINCT sample) AS n FROM scores")['n'].iloc[0]
+        print(f"Cohort store {args.db} holds {n} scored samples", file=sys.stderr)
+
+    elif args.command == 'query':
+        with CohortStore(args.db) as store:
+            if args.sql:
+                result = store.query(args.sql)
+            elif args.species:
+                result = store.samples_with_species(args.species, args.min_abundance)
+            elif args.sample:
+                result = store.profile(args.sample)
+            else:
+                result = store.scores()
+        result.to_csv(sys.stdout, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
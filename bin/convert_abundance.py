@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 import argparse
+import perf_metrics
 import pandas as pd
 
 def convert_to_relative_abundance(input_file):
     # Skip the first row (metadata)
-    df = pd.read_csv(input_file, sep='\t', skiprows=1)
+    with perf_metrics.phase('read') as step:
+        df = pd.read_csv(input_file, sep='\t', skiprows=1)
+        step.rows += len(df)
 
     first_col = df.columns[0]
     df.rename(columns={first_col: "NCBI_ID"}, inplace=True)
@@ -14,12 +17,16 @@ def convert_to_relative_abundance(input_file):
 
     # Save to a fixed output filename
     output_file = "total_relative_abundance.tsv"
-    df.to_csv(output_file, sep='\t', index=False)
+    with perf_metrics.phase('write') as step:
+        df.to_csv(output_file, sep='\t', index=False)
+        step.rows += len(df)
     print(f"Converted file saved as: {output_file}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert percent abundance to relative abundance (0–1).")
     parser.add_argument("-i", "--input", required=True, help="Input TSV file with percent abundance values.")
+    perf_metrics.add_argument(parser)
     args = parser.parse_args()
 
-    convert_to_relative_abundance(args.input)
+    with perf_metrics.record("convert_abundance", args.perf_metrics):
+        convert_to_relative_abundance(args.input)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Script: db_cache.py
+
+Stage the MetaPhlAn and GRCh38 databases into the database cache of the node
+a task runs on, and link them into the task directory in the
+database_location layout:
+  <output>/metaphlan-databases              -> <cache>/metaphlan/<key>
+  <output>/genome-databases/GRCh38_noalt_as -> <cache>/genome/<key>
+
+It is run by the tasks that read the databases (GMWI2, taxonomy index), so the
+links only ever point into the cache of their own node.
+
+Entries are content-addressed: when an entry is filled, every file is hashed
+(SHA-256) and the key is the hash of that list, so changed files always give a
+new entry. A source is looked up by its file listing (path, size, mtime; `aws
+s3 ls` for s3:// sources), and is only fetched and hashed again when that
+listing changes. The GRCh38 fill is also checked against the md5 list that
+ships with gmwi2 (GRCh38_md5sum.txt) when it is found.
+
+Warm entries are checked before they are used: --verify size compares the
+file sizes with those recorded at fill time, --verify checksum hashes every
+file again and compares it with the recorded SHA-256. An entry that fails the
+check is fetched again.
+
+Cache layout:
+  <cache>/<kind>/<key>/            database files
+  <cache>/<kind>/<key>.sha256      path and SHA-256 of every file, recorded at fill
+  <cache>/<kind>/<key>.sizes       path and size of every file, recorded at fill
+  <cache>/<kind>/<key>.complete    written last, once the entry is in place
+  <cache>/<kind>/listings/<hash>   key of the entry filled from a source listing
+  <cache>/manifest.tsv             key, kind, source and time of every fill
+  <cache>/.lock                    one task at a time fills or verifies the cache
+
+Usage:
+  db_cache.py --cache-dir /tmp/io-gmwi2-db-cache --verify size --output databases \
+    --metaphlan /refs/metaphlan-databases/ --genome /refs/genome-databases/GRCh38_noalt_as/
+"""
+import argparse
+import fcntl
+import glob
+import hashlib
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from result_cache import file_sha256
+
+CHUNK_SIZE = 1 << 20
+
+
+def is_s3(source):
+    return source.startswith('s3://')
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def walk_files(root):
+    """Relative paths of the files under root, following symlinks like `find -L`."""
+    for dirpath, _, names in os.walk(root, followlinks=True):
+        for name in names:
+            yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def file_table(root, value):
+    """One sorted 'path<TAB>value' line per file under root."""
+    return ''.join(sorted(f"{rel}\t{value(os.path.join(root, rel))}\n" for rel in walk_files(root)))
+
+
+def listing(source):
+    """File listing of a source (path, size, modification time) that its lookup is keyed on."""
+    if is_s3(source):
+        out = subprocess.run(['aws', 's3', 'ls', '--recursive', source],
+                             check=True, capture_output=True, text=True).stdout
+        return ''.join(sorted(out.splitlines(keepends=True)))
+    return file_table(source, lambda path: f"{os.path.getsize(path)}\t{os.stat(path).st_mtime_ns}")
+
+
+def fetch(source, dest):
+    if is_s3(source):
+        subprocess.run(['aws', 's3', 'sync', source, dest], check=True)
+    else:
+        shutil.copytree(source, dest)
+
+
+def shipped_genome_md5():
+    """GRCh38_md5sum.txt of the gmwi2 install, or None if it cannot be found."""
+    roots = []
+    spec = importlib.util.find_spec('gmwi2')
+    if spec is not None:
+        roots += list(spec.submodule_search_locations or [os.path.dirname(spec.origin)])
+    if os.environ.get('CONDA_PREFIX'):
+        roots.append(os.path.join(os.environ['CONDA_PREFIX'], 'share'))
+    for root in roots:
+        found = glob.glob(os.path.join(root, '**', 'GRCh38_md5sum.txt'), recursive=True)
+        if found:
+            return found[0]
+    return None
+
+
+def check_md5(root, md5_list):
+    """Files of root that do not match md5_list; names may carry the GRCh38_noalt_as/ prefix."""
+    bad = []
+    with open(md5_list) as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            expected, name = line.split(None, 1)
+            name = name.strip().lstrip('*')
+            name = name.split('GRCh38_noalt_as/', 1)[-1]
+            path = os.path.join(root, name)
+            if not os.path.isfile(path) or file_md5(path) != expected:
+                bad.append(name)
+    return bad
+
+
+class DatabaseCache:
+    """Content-addressed database cache in a node-local directory."""
+
+    def __init__(self, root, verify):
+        self.root = os.path.abspath(root)
+        self.verify = verify
+        os.makedirs(root, exist_ok=True)
+        self.manifest = os.path.join(root, 'manifest.tsv')
+        if not os.path.isfile(self.manifest):
+            with open(self.manifest, 'w') as fh:
+                fh.write('key\tkind\tsource\tcreated\n')
+
+    @contextmanager
+    def lock(self):
+        with open(os.path.join(self.root, '.lock'), 'w') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def verified(self, entry):
+        """True if a complete entry still matches its fill record."""
+        if not (os.path.isfile(f"{entry}.complete") and os.path.isfile(f"{entry}.sizes")):
+            return False
+        with open(f"{entry}.sizes") as fh:
+            if file_table(entry, os.path.getsize) != fh.read():
+                return False
+        if self.verify != 'checksum':
+            return True
+        with open(f"{entry}.sha256") as fh:
+            return file_table(entry, file_sha256) == fh.read()
+
+    def stage(self, kind, source, md5_list=None):
+        """Path of the verified entry holding source, filled first if needed."""
+        base = os.path.join(self.root, kind)
+        os.makedirs(os.path.join(base, 'listings'), exist_ok=True)
+        listed = listing(source)
+        if not listed:
+            sys.exit(f"ERROR: no {kind} database files found in {source}")
+        alias = os.path.join(base, 'listings', text_sha256(listed))
+        if os.path.isfile(alias):
+            with open(alias) as fh:
+                key = fh.read().strip()
+            if self.verified(os.path.join(base, key)):
+                print(f"Cache hit: {kind} {key}", file=sys.stderr)
+                return os.path.join(base, key)
+            print(f"Cache entry {kind} {key} failed verification, staging it again from {source}", file=sys.stderr)
+        else:
+            print(f"Cache miss: {kind}, staging from {source}", file=sys.stderr)
+        return self.fill(kind, source, md5_list, alias)
+
+    def fill(self, kind, source, md5_list, alias):
+        base = os.path.join(self.root, kind)
+        # leftovers of fills that were killed; no other fill runs while the lock is held
+        for stale in glob.glob(os.path.join(base, '.tmp.*')):
+            shutil.rmtree(stale, ignore_errors=True)
+        tmp = os.path.join(base, f".tmp.{os.getpid()}")
+        fetch(source, tmp)
+        if md5_list:
+            bad = check_md5(tmp, md5_list)
+            if bad:
+                shutil.rmtree(tmp, ignore_errors=True)
+                sys.exit(f"ERROR: checksum mismatch for {source}: {', '.join(bad)}")
+        sums = file_table(tmp, file_sha256)
+        key = text_sha256(sums)
+        entry = os.path.join(base, key)
+        if self.verified(entry):
+            # the same files are already cached, filled from a source with another listing
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            for path in [f"{entry}.complete", f"{entry}.sizes", f"{entry}.sha256"]:
+                if os.path.exists(path):
+                    os.remove(path)
+            shutil.rmtree(entry, ignore_errors=True)
+            with open(f"{entry}.sha256", 'w') as fh:
+                fh.write(sums)
+            with open(f"{entry}.sizes", 'w') as fh:
+                fh.write(file_table(tmp, os.path.getsize))
+            os.rename(tmp, entry)
+            open(f"{entry}.complete", 'w').close()
+            with open(self.manifest, 'a') as fh:
+                fh.write(f"{key}\t{kind}\t{source}\t{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}\n")
+        with open(f"{alias}.tmp", 'w') as fh:
+            fh.write(key)
+        os.replace(f"{alias}.tmp", alias)
+        return entry
+
+
+def link(target, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if os.path.lexists(path):
+        os.remove(path)
+    os.symlink(target, path)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Stage databases through the node-local database cache.")
+    p.add_argument('--cache-dir', required=True, help="Node-local cache directory")
+    p.add_argument('--verify',    choices=['size', 'checksum'], default='size',
+                   help="Check of warm entries: recorded file sizes, or also SHA-256 of every file")
+    p.add_argument('--metaphlan', required=True, help="MetaPhlAn database directory (local or s3://)")
+    p.add_argument('--genome',    default=None, help="GRCh38 Bowtie2 index directory (local or s3://); optional")
+    p.add_argument('--output',    default='databases', help="Directory the entries are linked into (default: databases)")
+    args = p.parse_args()
+
+    cache = DatabaseCache(args.cache_dir, args.verify)
+    with cache.lock():
+        metaphlan = cache.stage('metaphlan', args.metaphlan)
+        genome = None
+        if args.genome:
+            md5_list = shipped_genome_md5()
+            if md5_list is None:
+                print("WARNING: GRCh38_md5sum.txt of gmwi2 not found; the GRCh38 fill is not checked against it",
+                      file=sys.stderr)
+            genome = cache.stage('genome', args.genome, md5_list)
+
+    link(metaphlan, os.path.join(args.output, 'metaphlan-databases'))
+    if genome:
+        link(genome, os.path.join(args.output, 'genome-databases', 'GRCh38_noalt_as'))
+
+
+if __name__ == '__main__':
+    main()
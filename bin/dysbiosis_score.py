@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Script: dysbiosis_score.py
+
+Score gut dysbiosis for a whole cohort from HUMAnN outputs in one pass.
+
+All `<sample>_pathabundance.tsv` files are gathered into one pathway x sample
+matrix (community totals only, UNMAPPED/UNINTEGRATED excluded), converted to
+relative abundance, and every index is computed column-wise for all samples
+at once:
+
+  - pathway_richness / pathway_shannon: number and Shannon diversity of pathways.
+  - signature_index: GMHI-style log10 ratio of the health- vs dysbiosis-associated
+    pathway signatures (--signature TSV with columns 'feature', 'group' in
+    {health, dysbiosis}); for each set S with present members P (rel. abundance
+    above --threshold), psi_S = |P| / |S| * sum_{i in P} |p_i ln p_i|.
+  - genefamily_richness / genefamily_shannon: from `<sample>_genefamilies.tsv`,
+    computed per file without building the (very large) gene-family matrix.
+
+dysbiosis_score (the signature index) leads the output
+`sample, dysbiosis_score, ...` table, which plot_scores.py draws with
+--score-column dysbiosis_score.
+
+Usage:
+  python3 dysbiosis_score.py \
+    --pathabundance *_pathabundance.tsv \
+    --genefamilies *_genefamilies.tsv \
+    --signature dysbiosis_signature.tsv \
+    --output dysbiosis_scores_table.tsv
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import perf_metrics
+import numpy as np
+import pandas as pd
+
+UNCLASSIFIED_FEATURES = ['UNMAPPED', 'UNINTEGRATED', 'UNGROUPED']
+
+
+def sample_name(path, suffix):
+    name = os.path.basename(path)
+    return name[:-len(suffix)] if name.endswith(suffix) else name
+
+
+def read_humann_table(path):
+    """Read the community-level (unstratified) rows of a HUMAnN table as a Series."""
+    table = pd.read_csv(path, sep='\t', index_col=0, usecols=[0, 1])
+    table = table[~table.index.str.contains('|', regex=False)]
+    table = table[~table.index.isin(UNCLASSIFIED_FEATURES)]
+    return table.iloc[:, 0]
+
+
+def read_pathabundance(path):
+    return sample_name(path, '_pathabundance.tsv'), read_humann_table(path)
+
+
+def genefamily_stats(path):
+    """Richness and Shannon diversity of one gene-family table."""
+    values = read_humann_table(path).to_numpy(dtype=np.float64)
+    values = values[values > 0]
+    p = values / values.sum() if values.size else values
+    return sample_name(path, '_genefamilies.tsv'), values.size, float(-(p * np.log(p)).sum())
+
+
+def pool_map(func, paths, jobs):
+    """Map func over paths with `jobs` worker processes, keeping input order."""
+    if jobs <= 1 or len(paths) <= 1:
+        return [func(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(func, paths, chunksize=max(1, len(paths) // (jobs * 4))))
+
+
+def shannon(rel):
+    """Column-wise Shannon diversity of a features x samples relative abundance array."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(rel > 0, rel * np.log(rel), 0.0)
+    return -terms.sum(axis=0)
+
+
+def read_signature(path):
+    """Signature table; exits with an error unless it names health and dysbiosis features."""
+    signature = pd.read_csv(path, sep='\t')
+    if not {'feature', 'group'} <= set(signature.columns):
+        sys.exit(f"ERROR: {path} must have 'feature' and 'group' columns")
+    missing = {'health', 'dysbiosis'} - set(signature['group'])
+    if missing:
+        sys.exit(f"ERROR: {path} has no features in group(s): {', '.join(sorted(missing))}")
+    return signature
+
+
+def signature_index(rel, features, signature, threshold):
+    """GMHI-style log10(psi_health / psi_dysbiosis) for every sample (column of rel)."""
+    psi = {}
+    for group in ['health', 'dysbiosis']:
+        members = signature.loc[signature['group'] == group, 'feature']
+        rows = features.get_indexer(members)
+        block = rel[rows[rows >= 0]]
+        present = block > threshold
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropy = np.abs(np.where(present, block * np.log(block), 0.0)).sum(axis=0)
+        psi[group] = present.sum(axis=0) / max(len(members), 1) * entropy
+    # same floor as GMHI so samples lacking one signature still get a finite score
+    floor = 1e-5
+    return np.log10(np.maximum(psi['health'], floor) / np.maximum(psi['dysbiosis'], floor))
+
+
+def main():
+    p = argparse.ArgumentParser(description="Batch dysbiosis scoring from HUMAnN outputs.")
+    p.add_argument('--pathabundance', nargs='+', required=True, help="HUMAnN <sample>_pathabundance.tsv files")
+    p.add_argument('--genefamilies',  nargs='*', default=[], help="HUMAnN <sample>_genefamilies.tsv files")
+    p.add_argument('--signature',     required=True, help="TSV with 'feature' and 'group' (health|dysbiosis) columns")
+    p.add_argument('--threshold',     type=float, default=0.00001, help="Presence threshold on relative abundance (default: 0.00001)")
+    p.add_argument('-j', '--jobs',    type=int, default=1, help="Number of worker processes used to read the inputs")
+    p.add_argument('--matrix',        default=None, help="Optional output of the pathway x sample abundance matrix")
+    p.add_argument('-o', '--output',  default='dysbiosis_scores_table.tsv', help="Output score table")
+    perf_metrics.add_argument(p)
+    args = p.parse_args()
+
+    with perf_metrics.record('dysbiosis_score', args.perf_metrics):
+        perf_metrics.count('samples', len(args.pathabundance))
+        # one cohort matrix, built with a single concat rather than per-column inserts
+        with perf_metrics.phase('read') as step:
+            parsed = pool_map(read_pathabundance, args.pathabundance, args.jobs)
+            step.rows += sum(len(series) for _, series in parsed)
+        with perf_metrics.phase('join') as step:
+            matrix = pd.concat({name: series for name, series in parsed}, axis=1).fillna(0)
+            step.rows += len(matrix)
+        if args.matrix:
+            with perf_metrics.phase('write'):
+                matrix.rename_axis('pathway').to_csv(args.matrix, sep='\t')
+
+        values = matrix.to_numpy(dtype=np.float64)
+        totals = values.sum(axis=0)
+        rel = np.divide(values, totals, out=np.zeros_like(values), where=totals > 0)
+
+        scores = pd.DataFrame({
+            'pathway_richness': (values > 0).sum(axis=0),
+            'pathway_shannon':  shannon(rel).round(6),
+        }, index=matrix.columns)
+
+        signature = read_signature(args.signature)
+        scores['signature_index'] = signature_index(rel, matrix.index, signature, args.threshold).round(6)
+        scores.insert(0, 'dysbiosis_score', scores['signature_index'])
+
+        if args.genefamilies:
+            with perf_metrics.phase('read_genefamilies'):
+                gf = pd.DataFrame(pool_map(genefamily_stats, args.genefamilies, args.jobs),
+                                  columns=['sample', 'genefamily_richness', 'genefamily_shannon']).set_index('sample')
+            scores = scores.join(gf.round(6), how='left')
+
+        with perf_metrics.phase('write') as step:
+            scores.rename_axis('sample').reset_index().to_csv(args.output, sep='\t', index=False)
+            step.rows += len(scores)
+        print(f"Scored {len(scores)} samples -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
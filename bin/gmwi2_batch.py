@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Script: gmwi2_batch.py
+
+Run GMWI2 on a chunk of samples inside one task, so the host (GRCh38) and
+MetaPhlAn Bowtie2 indexes are read from (network) storage once per chunk
+rather than once per sample.
+
+`gmwi2` is a command-line tool that starts Bowtie2 per sample. Those Bowtie2
+runs get --mm through a `bowtie2` shim placed ahead of the real one on PATH,
+so they memory-map the index files instead of reading them into private
+memory: concurrent samples share one copy of each index, and later samples
+map pages that are already resident. The index files gmwi2 reads (the
+MetaPhlAn index named by mpa_latest with its .pkl, and the GRCh38 .bt2 files)
+are read once up front to make them resident. Samples run one after another,
+or --concurrency at a time with the task's CPUs split between them. Outputs
+keep the per-sample <prefix>_GMWI2.txt, <prefix>_GMWI2_taxa.txt and
+<prefix>_metaphlan.txt names.
+
+Every sample gets a row (prefix, status, seconds) in the --status TSV and the
+outputs of failed samples are removed. The script exits 1 when any sample
+failed, so the task is retried (with more memory) by the errorStrategy rather
+than dropping samples; with --result-cache the retry restores the samples
+that already succeeded instead of running them again.
+
+With --result-cache, each sample is first looked up in the cross-run result
+store (see result_cache.py) and only misses are run.
+
+The manifest is a TSV with columns: prefix, read1, read2 (empty for single-end).
+
+Usage:
+  python3 gmwi2_batch.py --manifest chunk.tsv --db-location refs/ --cpus 16 --concurrency 2
+"""
+import argparse
+import glob
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from result_cache import FilesystemStore, file_names, result_key
+
+OUTPUT_SUFFIXES = ['_GMWI2.txt', '_GMWI2_taxa.txt', '_metaphlan.txt']
+CHUNK_SIZE = 1 << 24
+
+
+def metaphlan_index(metaphlan_db):
+    """Name of the MetaPhlAn index gmwi2 uses: the one mpa_latest names, else the only .pkl; None if unknown."""
+    latest = os.path.join(metaphlan_db, 'mpa_latest')
+    if os.path.isfile(latest):
+        with open(latest) as fh:
+            return fh.read().strip()
+    pkls = glob.glob(os.path.join(metaphlan_db, '*.pkl'))
+    return os.path.basename(pkls[0])[:-len('.pkl')] if len(pkls) == 1 else None
+
+
+def index_files(metaphlan_db, genome_db):
+    """The index files a gmwi2 run reads; archives, checksums and other database versions are left out."""
+    files = []
+    index = metaphlan_index(metaphlan_db)
+    if index:
+        files.append(os.path.join(metaphlan_db, f"{index}.pkl"))
+        files += glob.glob(os.path.join(metaphlan_db, f"{index}.*.bt2")) + glob.glob(os.path.join(metaphlan_db, f"{index}.*.bt2l"))
+    else:
+        print(f"WARNING: no mpa_latest or single .pkl in {metaphlan_db}; MetaPhlAn index not preloaded", file=sys.stderr)
+    files += glob.glob(os.path.join(genome_db, '*.bt2')) + glob.glob(os.path.join(genome_db, '*.bt2l'))
+    return sorted(f for f in files if os.path.isfile(f))
+
+
+def warm_indexes(files):
+    """Read the index files once so the Bowtie2 loads of every sample are served from the page cache."""
+    start = time.time()
+    total = 0
+    for path in files:
+        with open(path, 'rb') as fh:
+            while True:
+                chunk = fh.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+    print(f"Read {total / 1e9:.1f} GB of indexes ({len(files)} files) into the page cache in {time.time() - start:.0f}s",
+          file=sys.stderr)
+
+
+def mmap_environment(shim_dir):
+    """Environment whose PATH starts with a `bowtie2` that adds --mm; the current one if Bowtie2 is not found."""
+    bowtie2 = shutil.which('bowtie2')
+    if bowtie2 is None:
+        print("WARNING: bowtie2 not found on PATH; indexes are not memory-mapped", file=sys.stderr)
+        return None
+    os.makedirs(shim_dir, exist_ok=True)
+    shim = os.path.join(shim_dir, 'bowtie2')
+    with open(shim, 'w') as fh:
+        fh.write('#!/bin/sh\n'
+                 f'case "$1" in -h|--help|--version) exec {shlex.quote(bowtie2)} "$@" ;; esac\n'
+                 f'exec {shlex.quote(bowtie2)} --mm "$@"\n')
+    os.chmod(shim, 0o755)
+    return dict(os.environ, PATH=os.path.abspath(shim_dir) + os.pathsep + os.environ.get('PATH', ''))
+
+
+def gmwi2_command(row, threads, metaphlan_db, genome_db):
+    reads = ['-f', row.read1, '--single'] if not row.read2 else ['-f', row.read1, '-r', row.read2]
+    return ['gmwi2'] + reads + ['-n', str(threads), '-o', row.prefix, '-m', metaphlan_db, '-g', genome_db]
+
+
+def run_sample(row, threads, metaphlan_db, genome_db, cache, env):
+    """Run (or restore) one sample; returns (prefix, status, seconds)."""
+    start = time.time()
+    names = file_names(row.prefix, OUTPUT_SUFFIXES)
+    if cache is not None:
+        store, key = cache[0], cache[1][row.prefix]
+        if store.get(key, names, '.'):
+            return row.prefix, 'cached', time.time() - start
+    with open(f"{row.prefix}_gmwi2.log", 'w') as log:
+        rc = subprocess.call(gmwi2_command(row, threads, metaphlan_db, genome_db), stdout=log, stderr=subprocess.STDOUT, env=env)
+    if rc != 0:
+        # partial outputs of a failed run must not reach the per-sample channels
+        for name in names:
+            if os.path.exists(name):
+                os.remove(name)
+        return row.prefix, f"failed (exit {rc}, see {row.prefix}_gmwi2.log)", time.time() - start
+    if cache is not None:
+        cache[0].put(cache[1][row.prefix], names, '.', {'prefix': row.prefix, 'salt': cache[2]})
+    return row.prefix, 'ok', time.time() - start
+
+
+def main():
+    p = argparse.ArgumentParser(description="Run GMWI2 on a chunk of samples with the indexes loaded once.")
+    p.add_argument('--manifest',     required=True, help="TSV with columns prefix, read1, read2 (empty for single-end)")
+    p.add_argument('--db-location',  required=True, help="Directory holding metaphlan-databases/ and genome-databases/")
+    p.add_argument('--cpus',         type=int, default=8, help="CPUs of the task, split across concurrent samples")
+    p.add_argument('--concurrency',  type=int, default=1, help="Samples run at the same time (default: 1)")
+    p.add_argument('--result-cache', default=None, help="Cross-run result store directory (optional)")
+    p.add_argument('--cache-salt',   nargs='*', default=[], help="Database locations and tool version for the cache key")
+    p.add_argument('--status',       default='gmwi2_batch_status.tsv', help="Per-sample status TSV (prefix, status, seconds)")
+    args = p.parse_args()
+
+    manifest = pd.read_csv(args.manifest, sep='\t', dtype=str, keep_default_na=False)
+    metaphlan_db = os.path.join(args.db_location, 'metaphlan-databases/')
+    genome_db = os.path.join(args.db_location, 'genome-databases/GRCh38_noalt_as/')
+
+    cache = None
+    todo = manifest
+    if args.result_cache:
+        store = FilesystemStore(args.result_cache)
+        keys = {}
+        for row in manifest.itertuples():
+            key_args = argparse.Namespace(reads=[r for r in [row.read1, row.read2] if r], extra=[], salt=['gmwi2'] + args.cache_salt)
+            keys[row.prefix] = result_key(store, key_args)
+        cache = (store, keys, ['gmwi2'] + args.cache_salt)
+        todo = manifest[[not os.path.isfile(os.path.join(store.entry(keys[p]), 'meta.json')) for p in manifest['prefix']]]
+
+    # nothing to load when every sample is restored from the result cache
+    env = None
+    if len(todo):
+        warm_indexes(index_files(metaphlan_db, genome_db))
+        env = mmap_environment('bowtie2_mm')
+
+    concurrency = max(1, min(args.concurrency, len(manifest)))
+    threads = max(1, args.cpus // concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda row: run_sample(row, threads, metaphlan_db, genome_db, cache, env),
+                                manifest.itertuples()))
+
+    failed = 0
+    with open(args.status, 'w') as out:
+        out.write('prefix\tstatus\tseconds\n')
+        for prefix, status, seconds in results:
+            out.write(f"{prefix}\t{status}\t{seconds:.0f}\n")
+            print(f"{prefix}\t{status}\t{seconds:.0f}s", file=sys.stderr)
+            failed += not (status == 'ok' or status == 'cached')
+    if failed:
+        sys.exit(f"ERROR: {failed} of {len(results)} samples failed; see {args.status}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Script: gmwi2_rescore.py
+
+Rescore a whole cohort with GMWI2 from its MetaPhlAn reports instead of
+rerunning `gmwi2` per sample. As in GMWI2, a model taxon is present in a
+sample when its `relative_abundance` in the report (a percentage, divided by
+100) is above the presence threshold, and
+
+    GMWI2(sample) = intercept + sum_i coefficient_i * present_i(sample)
+
+is computed for every sample at once as a presence-matrix x coefficient-vector
+product. Per-taxon contributions (the coefficients of the present taxa, like
+`<sample>_GMWI2_taxa.txt`) can be written as a long table.
+
+Model taxa are MetaPhlAn clade names of any rank, matched exactly to the rows
+of the reports. The coefficient table has 'taxa_name' and 'coefficient'
+columns; a row named 'intercept' or '(Intercept)' sets the intercept unless
+--intercept is given. Without --coefficients the default GMWI2 model is taken
+from earlier runs: the coefficient of every taxon listed in their
+`<sample>_GMWI2_taxa.txt` files, and the intercept as a run's score minus the
+sum of its listed coefficients (--gmwi2-taxa with --gmwi2-scores).
+
+Given --gmwi2-scores, the rescored samples are checked against their
+`<sample>_GMWI2.txt` scores, and the script exits 1 if any differs by more
+than --tolerance; rescoring runs with the default model must reproduce them.
+
+Usage:
+  python3 gmwi2_rescore.py \
+    --profiles *_profile.txt \
+    --coefficients gmwi2_coefficients.tsv \
+    --output gmwi2_rescored_table.tsv \
+    --contributions gmwi2_rescored_taxa.tsv
+
+  python3 gmwi2_rescore.py --profiles *_metaphlan.txt \
+    --gmwi2-taxa *_GMWI2_taxa.txt --gmwi2-scores *_GMWI2.txt
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from metaphlan_profile import read_report
+
+INTERCEPT_NAMES = ['intercept', '(intercept)']
+PROFILE_SUFFIXES = ['_metaphlan.txt', '_profile.txt']
+
+
+def sample_name(path, suffixes):
+    name = os.path.basename(path)
+    for suffix in suffixes:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def load_coefficients(coef_path, intercept=None):
+    """
+    Load model coefficients keyed by clade name.
+
+    Returns:
+        (coef, intercept): coef is a Series of coefficients indexed by taxa_name;
+        intercept is a float.
+    """
+    coef = pd.read_csv(coef_path, sep='\t')
+    missing = {'taxa_name', 'coefficient'} - set(coef.columns)
+    if missing:
+        raise KeyError(f"Coefficient table is missing column(s): {', '.join(sorted(missing))}")
+
+    is_intercept = coef['taxa_name'].str.lower().isin(INTERCEPT_NAMES)
+    if intercept is None:
+        intercept = float(coef.loc[is_intercept, 'coefficient'].sum())
+    return coef[~is_intercept].groupby('taxa_name', sort=False)['coefficient'].sum(), intercept
+
+
+def read_scores(paths):
+    """GMWI2 scores of `<sample>_GMWI2.txt` files as a Series indexed by sample."""
+    scores = {}
+    for path in paths:
+        with open(path) as handle:
+            scores[sample_name(path, ['_GMWI2.txt'])] = float(handle.read().strip())
+    return pd.Series(scores, dtype=np.float64)
+
+
+def run_coefficients(taxa_paths, scores):
+    """
+    Recover the GMWI2 model of earlier runs from their taxa files and scores.
+
+    Only taxa present in some run are recovered; the others cannot change the
+    score of these samples.
+
+    Returns:
+        (coef, intercept) as in load_coefficients().
+    """
+    taxa = {sample_name(path, ['_GMWI2_taxa.txt']): pd.read_csv(path, sep='\t') for path in taxa_paths}
+    listed = pd.concat(list(taxa.values()), ignore_index=True)
+    coef = listed.groupby('taxa_name', sort=False)['coefficient']
+    conflicting = coef.nunique() > 1
+    if conflicting.any():
+        raise ValueError(f"{int(conflicting.sum())} taxa have different coefficients across runs, "
+                         f"e.g. {conflicting[conflicting].index[0]}")
+    intercepts = pd.Series({sample: scores[sample] - table['coefficient'].sum()
+                            for sample, table in taxa.items() if sample in scores.index}, dtype=np.float64)
+    if intercepts.empty:
+        raise ValueError("No sample has both a _GMWI2_taxa.txt and a _GMWI2.txt file")
+    return coef.first(), float(intercepts.median())
+
+
+def read_abundance(path, clades):
+    """Relative abundance (fraction) of the given clades in one MetaPhlAn report, 0 where absent."""
+    report = read_report(path).drop_duplicates('clade_name').set_index('clade_name')
+    rel = report['relative_abundance'].reindex(clades).fillna(0).to_numpy() / 100
+    return sample_name(path, PROFILE_SUFFIXES), rel
+
+
+def read_abundances(paths, clades, jobs=1):
+    """Clades x samples relative abundance table of the reports, read over `jobs` workers."""
+    read = partial(read_abundance, clades=pd.Index(clades))
+    if jobs <= 1 or len(paths) <= 1:
+        parsed = [read(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            parsed = list(pool.map(read, paths, chunksize=max(1, len(paths) // (jobs * 4))))
+    # a sample given twice keeps its last report
+    columns = dict(parsed)
+    values = np.column_stack(list(columns.values())) if columns else np.empty((len(clades), 0))
+    return pd.DataFrame(values, index=clades, columns=list(columns))
+
+
+def rescore(abundance, coef, intercept, threshold):
+    """
+    Score every sample of an abundance table in one pass.
+
+    Args:
+        abundance (pd.DataFrame): model taxa x samples relative abundance (fraction),
+            rows aligned with coef.
+        coef (pd.Series): coefficients indexed by taxa_name.
+        intercept (float): model intercept.
+        threshold (float): presence threshold on relative abundance.
+
+    Returns:
+        (scores, presence): scores is a Series indexed by sample; presence is a
+        boolean taxa x samples array aligned with coef.index.
+    """
+    presence = abundance.to_numpy(dtype=np.float64) > threshold
+    scores = intercept + coef.to_numpy() @ presence
+    return pd.Series(scores, index=abundance.columns), presence
+
+
+def check_scores(scores, expected, tolerance):
+    """Number of samples whose rescored and GMWI2 scores differ by more than tolerance."""
+    missing = expected.index.difference(scores.index)
+    if len(missing):
+        print(f"WARNING: {len(missing)} GMWI2 scores have no report to rescore, e.g. {missing[0]}", file=sys.stderr)
+    common = expected.index.intersection(scores.index)
+    diff = (scores[common] - expected[common]).abs()
+    mismatched = diff[diff > tolerance]
+    for sample, delta in mismatched.head(10).items():
+        print(f"MISMATCH {sample}: rescored {scores[sample]:.6f}, GMWI2 {expected[sample]:.6f} (diff {delta:.6g})",
+              file=sys.stderr)
+    print(f"Checked {len(common)} samples against their GMWI2 scores: {len(mismatched)} differ by more than "
+          f"{tolerance:g} (max diff {diff.max() if len(diff) else 0:.3g})", file=sys.stderr)
+    return len(mismatched)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Vectorized GMWI2 rescoring of MetaPhlAn reports.")
+    p.add_argument('--profiles',      nargs='+', required=True, help="MetaPhlAn reports (<sample>_metaphlan.txt or <sample>_profile.txt)")
+    p.add_argument('--coefficients',  default=None, help="TSV with 'taxa_name' and 'coefficient' columns (default: recovered from --gmwi2-taxa)")
+    p.add_argument('--gmwi2-taxa',    nargs='*', default=[], help="<sample>_GMWI2_taxa.txt files of GMWI2 runs to recover the default model from")
+    p.add_argument('--gmwi2-scores',  nargs='*', default=[], help="<sample>_GMWI2.txt files of GMWI2 runs to check the rescored samples against")
+    p.add_argument('--intercept',     type=float, default=None, help="Model intercept (default: 'intercept' row of the coefficients, else 0)")
+    p.add_argument('--threshold',     type=float, default=0.00001, help="Presence threshold on relative abundance as a fraction (default: 0.00001)")
+    p.add_argument('--tolerance',     type=float, default=0.00001, help="Largest score difference accepted by the --gmwi2-scores check (default: 0.00001)")
+    p.add_argument('-j', '--jobs',    type=int, default=1, help="Number of worker processes used to read the reports (default: 1)")
+    p.add_argument('--output',        default='gmwi2_rescored_table.tsv', help="Output score table (sample, gmwi2_score)")
+    p.add_argument('--contributions', default=None, help="Optional long table of per-taxon contributions (sample, taxa_name, coefficient)")
+    args = p.parse_args()
+
+    expected = read_scores(args.gmwi2_scores)
+    if args.coefficients:
+        coef, intercept = load_coefficients(args.coefficients, args.intercept)
+    elif args.gmwi2_taxa and args.gmwi2_scores:
+        coef, intercept = run_coefficients(args.gmwi2_taxa, expected)
+        if args.intercept is not None:
+            intercept = args.intercept
+    else:
+        p.error("give --coefficients, or --gmwi2-taxa and --gmwi2-scores to use the model of earlier GMWI2 runs")
+
+    abundance = read_abundances(args.profiles, coef.index, args.jobs)
+    scores, presence = rescore(abundance, coef, intercept, args.threshold)
+
+    scores.round(6).rename_axis('sample').rename('gmwi2_score').reset_index().to_csv(args.output, sep='\t', index=False)
+    print(f"Scored {len(scores)} samples with {len(coef)} taxa -> {args.output}", file=sys.stderr)
+
+    if args.contributions:
+        taxa, samples = np.nonzero(presence)
+        contrib = pd.DataFrame({
+            'sample':      abundance.columns.to_numpy()[samples],
+            'taxa_name':   coef.index.to_numpy()[taxa],
+            'coefficient': coef.to_numpy()[taxa]
+        }).sort_values(['sample', 'coefficient'], kind='stable')
+        contrib.to_csv(args.contributions, sep='\t', index=False)
+
+    if args.gmwi2_scores and check_scores(scores, expected, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
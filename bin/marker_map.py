@@ -2,11 +2,20 @@
 """
 Script: marker_map.py
 
-For each sample, pick the top 10 species-level taxa present in both MetaPhlAn report and the reference
+For each sample, pick the top N (default 10) species-level taxa present in both MetaPhlAn report and the reference
 database (skipping any missing) and then any extra species-level taxa from the GMWI2 coefficient file
 only if they exist in the database. Finally, retrieve median and mean for each species from the db CSV,
 filter to those shared by both user & db, round all numeric values to 1 decimal, and output a TSV.
 
+Several samples can be processed in one invocation (repeat --mpa/--coef/--sample, or pass a
+--manifest TSV with columns sample, mpa, coef). The database is loaded and indexed once and every
+sample's rows are appended to the same output file, labelled with the sample identifier as given.
+
+With --taxonomy-index (see taxonomy_index.py) taxa are joined on NCBI species taxids instead of
+species-name strings: the database by its ncbi_taxon_id column (or its normalised names), the
+profiles and coefficient files by their lineages. Database taxa the index cannot resolve are
+reported instead of silently never matching.
+
 Usage:
   python3 marker_map.py \
     --mpa <sample>_metaphlan.txt \
@@ -14,109 +23,218 @@ Usage:
     --db gmrepo_254.csv \
     --sample SAMPLE_ID \
     --output <sample>_marker_map.tsv
+
+  python3 marker_map.py \
+    --manifest marker_map_manifest.tsv \
+    --db gmrepo_254.csv \
+    --output all_marker_map.tsv
 """
 import argparse
+import sys
+import perf_metrics
+import numpy as np
 import pandas as pd
+import taxonomy_index
+from metaphlan_profile import annotate_clades, is_unknown_only, read_profile, read_report
 
-def main():
-    p = argparse.ArgumentParser(description="Compute taxon stats for a sample.")
-    p.add_argument('--mpa',    required=True, help="MetaPhlAn output (.txt)")
-    p.add_argument('--coef',   required=True, help="GMWI2 taxa coefficient file (.txt)")
-    p.add_argument('--db',     required=True, help="GMrepo database CSV with 'Taxon','mean','median'")
-    p.add_argument('--sample', required=True, help="Sample identifier")
-    p.add_argument('--output', required=True, help="Output TSV filename")
-    args = p.parse_args()
+COLUMNS = ['sample','species','user_abundance','db_median','db_mean']
 
-    # helper to extract species name
-    def species_name(full):
-        if '|s__' in full:
-            return full.split('|')[-1].replace('s__','')
-        else:
-            return full
 
+def load_db(db_path, index=None):
+    """Load the GMrepo database CSV indexed by 'Taxon', or by NCBI taxid given a TaxonomyIndex."""
+    db = pd.read_csv(db_path)
+    if 'Taxon' not in db.columns:
+        raise KeyError("Expected 'Taxon' column in database CSV")
+    if index is None:
+        return db.set_index('Taxon')
+
+    # the database's own taxids where the index knows them, its names otherwise
+    taxids = index.taxid_of_names(db['Taxon'])
+    if 'ncbi_taxon_id' in db.columns:
+        ids = pd.to_numeric(db['ncbi_taxon_id'], errors='coerce').fillna(-1).astype(np.int64).to_numpy()
+        taxids = np.where(index.contains(ids), ids, taxids)
+    missing = taxids < 0
+    if missing.any():
+        examples = ', '.join(db.loc[missing, 'Taxon'].astype(str).head(5))
+        print(f"WARNING: {missing.sum()} of {len(db)} database taxa are not in the taxonomy index "
+              f"({index.database or 'unversioned'}) and cannot be matched: {examples}", file=sys.stderr)
+    db = db[~missing].set_index(pd.Index(taxids[~missing], name='taxid'))
+    return db[~db.index.duplicated()]
+
+
+def load_manifest(manifest_path):
+    """Read a TSV manifest with columns sample, mpa, coef into (sample, mpa, coef) tuples."""
+    manifest = pd.read_csv(manifest_path, sep='\t', dtype=str)
+    missing = {'sample', 'mpa', 'coef'} - set(manifest.columns)
+    if missing:
+        raise KeyError(f"Manifest is missing column(s): {', '.join(sorted(missing))}")
+    return list(manifest[['sample', 'mpa', 'coef']].itertuples(index=False, name=None))
+
+
+def species_rows(mp, index=None):
+    """Species rows of a profile with their join 'key': the species name, or the taxid given an index."""
+    if index is None:
+        sp = mp[ mp['rank'] == 's' ]
+        return sp.assign(key=sp['species'])
+    taxids = index.species_taxids(mp['clade_name'])
+    found = taxids >= 0
+    return mp[found].assign(species=index.name_of(taxids[found]), key=taxids[found])
+
+
+def coef_species(coef, index=None):
+    """Species-level coefficient rows with their 'species' name and join 'key'."""
+    if index is None:
+        coef_ranks = annotate_clades(coef['taxa_name'])
+        return coef.assign(species=coef_ranks['species'], key=coef_ranks['species'])[ coef_ranks['rank'] == 's' ]
+    taxids = index.species_taxids(coef['taxa_name'])
+    found = taxids >= 0
+    return coef[found].assign(species=index.name_of(taxids[found]), key=taxids[found])
+
+
+def marker_map(mpa_path, coef_path, db, sample, top_n=10, debug=False, index=None):
+    """
+    Build the marker-map table of one sample against an already loaded database.
+
+    Args:
+        mpa_path (str): MetaPhlAn report for the sample.
+        coef_path (str): GMWI2 taxa coefficient file for the sample.
+        db (pd.DataFrame): Database returned by load_db().
+        sample (str): Sample identifier, written to the 'sample' column and used to name the debug files.
+        top_n (int): Number of most abundant database species to keep.
+        debug (bool): Also write the intermediate _mpa_full/_top_species/_coef_species tables.
+        index (TaxonomyIndex): Join on taxids through this index (db must be loaded with it).
+
+    Returns:
+        pd.DataFrame with the COLUMNS layout.
+    """
     # 1) load MetaPhlAn, species-level
-    mp = pd.read_csv(args.mpa, sep='\t', comment='#', header=None,
-                     names=['clade_name','tax_id','rel_abundance','coverage','read_count'])
-    
-    # Export mp DataFrame to a TSV file for inspection
-    mp.to_csv(f"{args.sample}_mpa_full.tsv", sep='\t', index=False)
-    
+    with perf_metrics.phase('read') as step:
+        # the index resolves ranks itself, so the clade names need not be split
+        mp = read_profile(mpa_path) if index is None else read_report(mpa_path)
+        step.rows += len(mp)
+
+    if debug:
+        # Export mp DataFrame to a TSV file for inspection
+        mp.to_csv(f"{sample}_mpa_full.tsv", sep='\t', index=False)
+
     # Detect the single-row UNKNOWN or unclassified case:
-    if mp.shape[0] == 1 and mp.iloc[0]['clade_name'] in ['UNKNOWN', 'unclassified']:
+    if is_unknown_only(mp):
         unk = mp.iloc[0]
-        df = pd.DataFrame([{
-            'sample':         args.sample,
-            'species':        mp.iloc[0]['clade_name'],
-            'user_abundance': unk['rel_abundance'],
+        return pd.DataFrame([{
+            'sample':         sample,
+            'species':        unk['clade_name'],
+            'user_abundance': unk['relative_abundance'],
             'db_median':      pd.NA,
             'db_mean':        pd.NA
-        }])
-        # write NAs as the literal string "NA"
-        df.to_csv(
-            args.output,
-            sep='\t',
-            index=False,
-            na_rep='NA'
-        )
-        return
-
-    sp = mp[ mp['clade_name'].astype(str).str.contains(r"\|s__") ]
-    sp = sp.assign(species=sp['clade_name'].map(species_name))
-
-    # 2) load database
-    db = pd.read_csv(args.db)
-    if 'Taxon' not in db.columns:
-        raise KeyError("Expected 'Taxon' column in database CSV")
-    db = db.set_index('Taxon')
-
-    # 3) build top10: take from sp sorted, but only those present in db
-    top_list = []
-    for _, row in sp.sort_values('rel_abundance', ascending=False).iterrows():
-        if row['species'] in db.index:
-            top_list.append({'taxon': row['clade_name'], 'user_abundance': row['rel_abundance'], 'species': row['species']})
-            if len(top_list) >= 10:
-                break
-    top_df = pd.DataFrame(top_list)
-    top_df.to_csv(f"{args.sample}_top_species.tsv", sep='\t', index=False)
+        }], columns=COLUMNS)
 
-    # 4) extras from coef
-    coef = pd.read_csv(args.coef, sep='\t')
-    coef_sp = coef[ coef['taxa_name'].str.contains(r"\|s__") ]
-    coef_sp = coef_sp.assign(species=coef_sp['taxa_name'].map(species_name))
+    with perf_metrics.phase('filter') as step:
+        sp = species_rows(mp, index)
 
-    # Export coef_sp to a TSV file for inspection
-    coef_sp.to_csv(f"{args.sample}_coef_species.tsv", sep='\t', index=False)
+        # 3) build topN: the N most abundant species that are present in db
+        top_df = (sp[ sp['key'].isin(db.index) ]
+                  .nlargest(top_n, 'relative_abundance')
+                  .rename(columns={'clade_name':'taxon', 'relative_abundance':'user_abundance'})
+                  [['taxon', 'user_abundance', 'species', 'key']])
+        step.rows += len(top_df)
+    if debug:
+        top_df.drop(columns='key').to_csv(f"{sample}_top_species.tsv", sep='\t', index=False)
+
+    # 4) extras from coef
+    with perf_metrics.phase('read') as step:
+        coef = pd.read_csv(coef_path, sep='\t')
+        step.rows += len(coef)
+    with perf_metrics.phase('filter'):
+        coef_sp = coef_species(coef, index)
+
+    if debug:
+        # Export coef_sp to a TSV file for inspection
+        coef_sp.drop(columns='key').to_csv(f"{sample}_coef_species.tsv", sep='\t', index=False)
     # drop those in top and only keep those present in db
-    extra_df = coef_sp[ ~coef_sp['species'].isin(top_df['species']) & coef_sp['species'].isin(db.index) ]
+    with perf_metrics.phase('filter') as step:
+        extra_df = coef_sp[ ~coef_sp['key'].isin(top_df['key']) & coef_sp['key'].isin(db.index) ]
 
-    extra_df = extra_df.rename(columns={'taxa_name':'taxon'})[['taxon']]
-    extra_df = extra_df.assign(user_abundance=pd.NA, species=extra_df['taxon'].map(species_name))
+        extra_df = extra_df.rename(columns={'taxa_name':'taxon'})[['taxon', 'species', 'key']]
+        extra_df = extra_df.assign(user_abundance=pd.NA)
+        step.rows += len(extra_df)
 
-    # 5) combine
-    all_df = pd.concat([top_df, extra_df], ignore_index=True)
+    with perf_metrics.phase('join') as step:
+        # 5) combine
+        all_df = pd.concat([top_df, extra_df], ignore_index=True)
 
-    # 6) merge with db stats
-    stats = db[['mean','median']].rename(columns={'mean':'db_mean','median':'db_median'})
-    result = all_df.set_index('species').join(stats, how='left').reset_index()
+        # 6) merge with db stats
+        stats = db[['mean','median']].rename(columns={'mean':'db_mean','median':'db_median'})
+        result = all_df.set_index('key').join(stats, how='left').reset_index()
+        step.rows += len(result)
 
-    # 7) format sample prefix
-    sample_prefix = args.sample.split('_')[0]
-    result.insert(0, 'sample', sample_prefix)
+    # 7) label rows with the sample identifier
+    result.insert(0, 'sample', sample)
 
     # 8) reorder cols
-    cols = ['sample','species','user_abundance','db_median','db_mean']
-    result = result.loc[:, cols]
+    result = result.loc[:, COLUMNS]
 
     # 9) filter to those with both user and db values
     result = result.dropna(subset=['user_abundance','db_median','db_mean'])
 
     # 10) round numeric columns to 3 decimal
-    result['user_abundance'] = result['user_abundance'].round(3)
+    result['user_abundance'] = result['user_abundance'].astype(float).round(3)
     result['db_median']      = result['db_median'].round(3)
     result['db_mean']        = result['db_mean'].round(3)
 
-    # write final file
-    result.to_csv(args.output, sep='\t', index=False)
+    return result
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compute taxon stats for one or many samples.")
+    p.add_argument('--mpa',      action='append', default=[], help="MetaPhlAn output (.txt); repeat for batch mode")
+    p.add_argument('--coef',     action='append', default=[], help="GMWI2 taxa coefficient file (.txt); repeat for batch mode")
+    p.add_argument('--sample',   action='append', default=[], help="Sample identifier; repeat for batch mode")
+    p.add_argument('--manifest', help="TSV with columns sample, mpa, coef (alternative to --mpa/--coef/--sample)")
+    p.add_argument('--db',       required=True, help="GMrepo database CSV with 'Taxon','mean','median'")
+    p.add_argument('--output',   required=True, help="Output TSV filename")
+    p.add_argument('--top-n',    type=int, default=10, help="Number of most abundant species to report per sample (default: 10)")
+    p.add_argument('--base',     default=None, help="Marker map of a previous run to append to; its rows for re-run samples are replaced")
+    p.add_argument('--taxonomy-index', default=None, help="Taxonomy index (.npz from taxonomy_index.py) to join on NCBI taxids instead of species names")
+    p.add_argument('--debug',    action='store_true', help="Write per-sample intermediate tables for inspection")
+    perf_metrics.add_argument(p)
+    args = p.parse_args()
+
+    with perf_metrics.record('marker_map', args.perf_metrics):
+        if args.manifest:
+            jobs = load_manifest(args.manifest)
+        else:
+            if not (len(args.mpa) == len(args.coef) == len(args.sample)) or not args.mpa:
+                p.error("--mpa, --coef and --sample must be given the same (non-zero) number of times")
+            jobs = list(zip(args.sample, args.mpa, args.coef))
+
+        # 2) load database once for every sample
+        with perf_metrics.phase('read') as step:
+            index = taxonomy_index.load(args.taxonomy_index)
+            db = load_db(args.db, index)
+            step.rows += len(db)
+        perf_metrics.count('samples', len(jobs))
+
+        with open(args.output, 'w') as out:
+            pd.DataFrame(columns=COLUMNS).to_csv(out, sep='\t', index=False)
+            if args.base:
+                # incremental mode: keep the previous rows as text, minus the samples run again
+                rerun = {sample for sample, _, _ in jobs}
+                with perf_metrics.phase('write') as step, open(args.base) as base:
+                    next(base)
+                    for line in base:
+                        if line.split('\t', 1)[0] not in rerun:
+                            out.write(line)
+                            step.rows += 1
+            for sample, mpa_path, coef_path in jobs:
+                result = marker_map(mpa_path, coef_path, db, sample,
+                                    top_n=args.top_n, debug=args.debug, index=index)
+                # write NAs as the literal string "NA"
+                with perf_metrics.phase('write') as step:
+                    result.to_csv(out, sep='\t', index=False, header=False, na_rep='NA')
+                    step.rows += len(result)
+
+        print(f"Wrote marker map for {len(jobs)} sample(s) to {args.output}", file=sys.stderr)
+
 
 if __name__ == '__main__':
     main()
@@ -1,66 +1,197 @@
 #!/usr/bin/env python
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import perf_metrics
+import numpy as np
 import pandas as pd
 import os
+import metaphlan_profile
 
-def extract_ncbi_id(clade_taxid):
-    try:
-        parts = str(clade_taxid).split('|')
-        # Get last non-empty numeric part
-        for part in reversed(parts):
-            if part.strip().isdigit():
-                return int(part)
-        return -1
-    except Exception:
-        return -1
+def read_profile(path):
+    """Read one MetaPhlAn profile and return (sample_name, reads per NCBI_ID Series)."""
+    sample_name = os.path.basename(path).split('_')[0]
+    df = metaphlan_profile.read_profile(path)
+    # the shared parser reads counts as floats; MetaPhlAn writes whole read counts,
+    # which are summed and written as integers like a plain read_csv would infer them
+    counts = df['estimated_number_of_reads_from_the_clade']
+    integer = bool(np.isfinite(counts).all() and (counts == np.floor(counts)).all())
 
-def parse_input_files(file_paths):
-    result = {}
-    all_taxids = set()
+    # Filter: keep only species/strain rows ("s__") or UNKNOWN/unclassified;
+    # the shared parser already maps UNKNOWN/unclassified to NCBI_ID -1
+    unknown = df['clade_name'].str.lower().isin(['unknown', 'unclassified'])
+    df = df[df['rank'].isin(['s', 't']) | unknown]
 
-    for path in file_paths:
-        sample_name = os.path.basename(path).split('_')[0]
-        df = pd.read_csv(path, sep='\t')
+    # Aggregate by NCBI_ID
+    reads = df.groupby('taxid')['estimated_number_of_reads_from_the_clade'].sum()
+    if integer:
+        reads = reads.astype(np.int64)
+    reads.index.name = 'NCBI_ID'
+    return sample_name, reads
 
-        # Normalize unclassified entries to behave like UNKNOWN
-        df['clade_name'] = df['clade_name'].fillna('')
-        df.loc[df['clade_name'].str.lower() == 'unclassified', 'clade_taxid'] = -1
-        df.loc[df['clade_name'].str.lower() == 'unclassified', 'clade_name'] = 'UNKNOWN'
+def read_profiles(file_paths, jobs=1):
+    """Parse and pre-filter profiles over a pool of `jobs` workers, preserving input order."""
+    if jobs <= 1 or len(file_paths) <= 1:
+        return [read_profile(path) for path in file_paths]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(read_profile, file_paths, chunksize=max(1, len(file_paths) // (jobs * 4))))
 
-        # Filter: keep only rows with "s__" or "UNKNOWN"
-        df = df[df['clade_name'].str.contains("s__") | (df['clade_name'] == "UNKNOWN")]
+def collect_triplets(file_paths, jobs=1):
+    """
+    Read every profile and collect its cells as (taxid, sample, reads) triplets,
+    so the merged table is held as the profiles' own entries rather than a dense
+    samples x taxa matrix.
 
-        # Extract standardized NCBI_ID
-        df['NCBI_ID'] = df['clade_taxid'].apply(extract_ncbi_id)
+    Returns:
+        taxids (np.ndarray): sorted unique NCBI_IDs (row labels).
+        samples (list): sample names in first-seen input order (column labels).
+        rows, cols (np.ndarray): row/column index of every stored entry.
+        values (np.ndarray): read counts of every stored entry; int64 unless
+            a profile has fractional or missing counts, then float64.
+    """
+    per_sample = {}
+    with perf_metrics.phase('read') as step:
+        for sample_name, reads in read_profiles(file_paths, jobs):
+            # a repeated sample name replaces the earlier profile, as before
+            per_sample[sample_name] = reads
+            step.rows += len(reads)
 
-        # Aggregate by NCBI_ID
-        df = df.groupby('NCBI_ID')['estimated_number_of_reads_from_the_clade'].sum().reset_index()
-        df = df.rename(columns={'estimated_number_of_reads_from_the_clade': sample_name})
+    samples = list(per_sample)
+    taxid_parts = [reads.index.to_numpy(dtype=np.int64) for reads in per_sample.values()]
+    integer = all(np.issubdtype(reads.dtype, np.integer) for reads in per_sample.values())
+    value_dtype = np.int64 if integer else np.float64
+    value_parts = [reads.to_numpy(dtype=value_dtype) for reads in per_sample.values()]
+    col_parts = [np.full(len(reads), i, dtype=np.int64) for i, reads in enumerate(per_sample.values())]
 
-        result[sample_name] = df.set_index('NCBI_ID')[sample_name]
-        all_taxids.update(df['NCBI_ID'].values)
+    all_taxids = np.concatenate(taxid_parts) if taxid_parts else np.empty(0, dtype=np.int64)
+    values = np.concatenate(value_parts) if value_parts else np.empty(0, dtype=value_dtype)
+    cols = np.concatenate(col_parts) if col_parts else np.empty(0, dtype=np.int64)
 
-    # Combine all results
-    all_taxids = sorted(all_taxids)
-    combined_df = pd.DataFrame(index=all_taxids)
+    # Map taxids to sorted row indices and order entries row-major for block writing
+    with perf_metrics.phase('join') as step:
+        taxids, rows = np.unique(all_taxids, return_inverse=True)
+        order = np.lexsort((cols, rows))
+        step.rows += len(values)
+    return taxids, samples, rows[order], cols[order], values[order]
 
-    for sample, series in result.items():
-        combined_df[sample] = series
+def write_wide(taxids, samples, rows, cols, values, output, block_size=10000):
+    """
+    Write the dense NCBI_ID x sample table, materialising at most block_size rows at a time.
 
-    combined_df.fillna(0, inplace=True)
-    combined_df.index.name = 'NCBI_ID'
-    return combined_df.reset_index()
+    As in an outer join of the samples, a sample missing some taxa is zero-filled
+    and written as floats ('0.0', '12.0'); a sample with every taxon keeps its
+    integer counts.
+    """
+    as_float = np.bincount(cols, minlength=len(samples)) < len(taxids)
+    if not np.issubdtype(values.dtype, np.integer):
+        as_float[:] = True
+    block_dtype = np.float64 if as_float.all() else np.int64
+    float_columns = {} if as_float.all() else {samples[c]: np.float64 for c in np.flatnonzero(as_float)}
+    with open(output, 'w') as out:
+        out.write('\t'.join(['NCBI_ID'] + samples) + '\n')
+        for start in range(0, len(taxids), block_size):
+            stop = min(start + block_size, len(taxids))
+            lo, hi = np.searchsorted(rows, [start, stop])
+            block = np.zeros((stop - start, len(samples)), dtype=block_dtype)
+            block[rows[lo:hi] - start, cols[lo:hi]] = values[lo:hi]
+            block_df = pd.DataFrame(block, index=pd.Index(taxids[start:stop], name='NCBI_ID'), columns=samples)
+            if float_columns:
+                block_df = block_df.astype(float_columns)
+            block_df.to_csv(out, sep='\t', header=False)
+
+def write_long(taxids, samples, rows, cols, values, output):
+    """Write the sparse long-format table (NCBI_ID, sample, reads) of non-zero entries."""
+    keep = values != 0
+    long_df = pd.DataFrame({
+        'NCBI_ID': taxids[rows[keep]],
+        'sample':  np.asarray(samples, dtype=object)[cols[keep]],
+        'reads':   values[keep]
+    })
+    long_df.to_csv(output, sep='\t', index=False)
+
+def append_to_base(base, taxids, samples, rows, cols, values, output):
+    """
+    Incremental merge: stream a previous wide table and add the new samples to it.
+
+    Base rows are copied as text and only extended with the new columns, so the
+    cost is one pass over the base file rather than re-reading every profile. New
+    taxa are merged in at their sorted position. A new sample that is already a
+    column of the base replaces it in place, as in a full merge. The result is
+    the table a full merge of the base samples followed by the new ones gives,
+    except that new cells are always written as floats, as write_wide() writes
+    every sample that misses some taxa (nearly all of them in a cohort).
+    """
+    # formatted, non-zero cells of the new samples per taxid
+    cells = {}
+    for r, c, v in zip(rows, cols, values):
+        cells.setdefault(int(taxids[r]), {})[c] = str(float(v))
+
+    with open(base) as src, open(output, 'w') as out:
+        base_samples = src.readline().rstrip('\n').split('\t')[1:]
+        position = {name: i for i, name in enumerate(base_samples)}
+        replaced = {c: position[name] for c, name in enumerate(samples) if name in position}
+        appended = [c for c, name in enumerate(samples) if name not in position]
+        out.write('\t'.join(['NCBI_ID'] + base_samples + [samples[c] for c in appended]) + '\n')
+
+        zero = str(0.0)
+        no_new = ''.join('\t' + zero for _ in appended)
+
+        def new_row(taxid, fields):
+            row_cells = cells.get(taxid, {})
+            had_reads = any(float(v) for v in fields[1:])
+            for c, i in replaced.items():
+                fields[i + 1] = row_cells.get(c, zero)
+            fields += [row_cells.get(c, zero) for c in appended]
+            if had_reads and not any(float(v) for v in fields[1:]):
+                # only the replaced samples had this taxon, so a full merge drops it
+                return ''
+            return '\t'.join(fields) + '\n'
+
+        pending = iter(int(t) for t in taxids)
+        next_new = next(pending, None)
+        for line in src:
+            taxid = int(line[:line.index('\t')])
+            while next_new is not None and next_new < taxid:
+                out.write(new_row(next_new, [str(next_new)] + [zero] * len(base_samples)))
+                next_new = next(pending, None)
+            if next_new == taxid:
+                next_new = next(pending, None)
+            elif not replaced:
+                # untouched by the new samples: copy the text and pad the new columns
+                out.write(line.rstrip('\n') + no_new + '\n')
+                continue
+            out.write(new_row(taxid, line.rstrip('\n').split('\t')))
+        while next_new is not None:
+            out.write(new_row(next_new, [str(next_new)] + [zero] * len(base_samples)))
+            next_new = next(pending, None)
 
 def main():
     parser = argparse.ArgumentParser(description='Aggregate species-level absolute abundance from MetaPhlAn outputs.')
     parser.add_argument('-i', '--input', nargs='+', required=True, help='Input files separated by space')
     parser.add_argument('-o', '--output', default='total_absolute_abundance.tsv', help='Output file name')
+    parser.add_argument('--long-output', default=None, help='Optional sparse long-format output (NCBI_ID, sample, reads)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes used to read the inputs (default: 1)')
+    parser.add_argument('--block-size', type=int, default=10000, help='Number of taxa rows written per block (default: 10000)')
+    parser.add_argument('--base', default=None, help='Wide table of a previous run to append the input samples to (incremental mode)')
+    perf_metrics.add_argument(parser)
 
     args = parser.parse_args()
 
-    combined_df = parse_input_files(args.input)
-    combined_df.to_csv(args.output, sep='\t', index=False)
-    print(f"Saved combined table to: {args.output}")
+    with perf_metrics.record('merge_absolute_metaphlan', args.perf_metrics):
+        perf_metrics.count('samples', len(args.input))
+        triplets = collect_triplets(args.input, jobs=args.jobs)
+        with perf_metrics.phase('write') as step:
+            if args.base:
+                append_to_base(args.base, *triplets, args.output)
+            else:
+                write_wide(*triplets, args.output, block_size=args.block_size)
+            step.rows += len(triplets[0])
+        print(f"Saved combined table to: {args.output}")
+
+        if args.long_output:
+            with perf_metrics.phase('write_long') as step:
+                write_long(*triplets, args.long_output)
+                step.rows += len(triplets[4])
+            print(f"Saved sparse long table to: {args.long_output}")
 
 if __name__ == '__main__':
     main()
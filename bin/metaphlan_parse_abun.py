@@ -2,30 +2,41 @@
 """
 Parse a MetaPhlAn3 profile table to extract species-level abundances
 and generate QIIME2-compatible outputs.
+
+With --cohort, many profiles are parsed in one run and written as a single
+cohort-level BIOM 1.0 (JSON, sparse) feature table plus one taxonomy table,
+so no per-sample `biom convert`/`qiime tools import` step is needed.
 """
 
 import argparse
+import json
+from datetime import datetime
+import perf_metrics
+import numpy as np
 import pandas as pd
+from metaphlan_profile import is_unknown_only, read_profile
 
 
-def metaphlan_profileparse(mpa_profiletable, label):
+def species_tables(mpa_profiletable, label, cache=False):
     """
-    Parse a MetaPhlAn3 profile table to extract species-level rel. abundances
-    and generate supplemental taxonomy and abundance tables for QIIME2.
+    Extract the species-level abundance and taxonomy tables of one profile.
 
     Args:
         mpa_profiletable (str): Path to the MetaPhlAn3 profile table (TSV).
-        label (str): Sample label to use for output file naming and abundance.
+        label (str): Sample label used as the abundance column name.
+        cache (bool): Write a parsed .npz sidecar next to the profile for later steps.
 
-    Outputs:
-        - <label>_relabun_parsed_mpaprofile.txt: TSV with Feature ID and abundance.
-        - <label>_profile_taxonomy.txt: TSV with Feature ID and taxonomy.
+    Returns:
+        (abundance, taxonomy): DataFrames with columns ["Feature ID", label]
+        and ["Feature ID", "Taxon"].
     """
-    # Read MetaPhlAn3 profile, dropping comment lines
-    profile = pd.read_csv(mpa_profiletable, sep="\t", comment='#')
+    # Read MetaPhlAn3 profile once through the shared parser
+    with perf_metrics.phase('read') as step:
+        profile = read_profile(mpa_profiletable, cache=cache)
+        step.rows += len(profile)
 
     # Check for 100% UNKNOWN or unclassified case (single row with clade_name UNKNOWN or unclassified)
-    if profile.shape[0] == 1 and profile.iloc[0]['clade_name'] in ['UNKNOWN', 'unclassified']:
+    if is_unknown_only(profile):
         unk = profile.iloc[0]
         tax_id = unk['clade_taxid']
         abundance = unk['relative_abundance']
@@ -36,49 +47,140 @@ def metaphlan_profileparse(mpa_profiletable, label):
             'Feature ID': [str(tax_id)],
             label:        [abundance]
         })
-        zero_abun.to_csv(
-            f"{label}_relabun_parsed_mpaprofile.txt", sep="\t", index=False
-        )
         # Create taxonomy table stub: tax_id and UNKNOWN
         zero_tax = pd.DataFrame({
             'Feature ID': [str(tax_id)],
             'Taxon':      [taxon_name]
         })
-        zero_tax.to_csv(
-            f"{label}_profile_taxonomy.txt", sep="\t", index=False
-        )
-        return
+        return zero_abun, zero_tax
 
     # Standard processing: keep only species-level entries
-    profile = profile[['clade_name', 'relative_abundance', 'clade_taxid']]
-    profile.columns = ['clade_name', 'abundance', 'clade_taxid']
     # select species (s__) but not strain (t__), and include UNKNOWN or unclassified
-    profile = profile[
-        (
-            profile["clade_name"].str.contains('s__') & ~profile["clade_name"].str.contains('t__')
-        ) |
-        (profile["clade_name"].isin(['UNKNOWN', 'unclassified']))
-    ]
-    profile.loc[profile["clade_name"] == "unclassified", "clade_name"] = "UNKNOWN"
-
-    # Output only Feature ID (clade_taxid) and abundance
-    profile_out = pd.DataFrame({
-        "Feature ID": profile["clade_taxid"].str.split("|").str[-1],
-        label: profile["abundance"]
-    })
-    profile_out.to_csv(
-        f"{label}_relabun_parsed_mpaprofile.txt", sep="\t", index=False
-    )
+    with perf_metrics.phase('filter') as step:
+        profile = profile[
+            (profile["rank"] == 's') |
+            (profile["clade_name"].isin(['UNKNOWN', 'unclassified']))
+        ]
+        profile = profile.assign(
+            clade_name=profile["clade_name"].replace("unclassified", "UNKNOWN"),
+            feature_id=profile["clade_taxid"].str.split("|").str[-1]
+        )
 
-    # Formatting supplemental taxonomy table needed by QIIME2
-    # Column names MUST be "Feature ID", "Taxon"
-    taxonomy = pd.DataFrame({
-        "Feature ID": profile["clade_taxid"].str.split('|').str[-1],
-        "Taxon": profile["clade_name"].str.replace("|", ";", regex=False)
-    })
-    taxonomy.to_csv(
-        f"{label}_profile_taxonomy.txt", sep="\t", index=False
-    )
+        # Output only Feature ID (clade_taxid) and abundance
+        profile_out = pd.DataFrame({
+            "Feature ID": profile["feature_id"],
+            label: profile["relative_abundance"]
+        })
+
+        # Formatting supplemental taxonomy table needed by QIIME2
+        # Column names MUST be "Feature ID", "Taxon"
+        taxonomy = pd.DataFrame({
+            "Feature ID": profile["feature_id"],
+            "Taxon": profile["clade_name"].str.replace("|", ";", regex=False)
+        })
+        step.rows += len(profile)
+    return profile_out, taxonomy
+
+
+def metaphlan_profileparse(mpa_profiletable, label, cache=False):
+    """
+    Parse a MetaPhlAn3 profile table to extract species-level rel. abundances
+    and generate supplemental taxonomy and abundance tables for QIIME2.
+
+    Args:
+        mpa_profiletable (str): Path to the MetaPhlAn3 profile table (TSV).
+        label (str): Sample label to use for output file naming and abundance.
+        cache (bool): Write a parsed .npz sidecar next to the profile for later steps.
+
+    Outputs:
+        - <label>_relabun_parsed_mpaprofile.txt: TSV with Feature ID and abundance.
+        - <label>_profile_taxonomy.txt: TSV with Feature ID and taxonomy.
+    """
+    profile_out, taxonomy = species_tables(mpa_profiletable, label, cache)
+    with perf_metrics.phase('write') as step:
+        profile_out.to_csv(
+            f"{label}_relabun_parsed_mpaprofile.txt", sep="\t", index=False
+        )
+        taxonomy.to_csv(
+            f"{label}_profile_taxonomy.txt", sep="\t", index=False
+        )
+        step.rows += len(profile_out)
+
+
+def write_biom_json(features, samples, rows, cols, values, output):
+    """
+    Write a sparse BIOM 1.0 (JSON) OTU table, streaming the data entries.
+
+    Args:
+        features (list): Observation (Feature ID) identifiers.
+        samples (list): Sample identifiers.
+        rows, cols (np.ndarray): Row/column index of each non-zero entry.
+        values (np.ndarray): Value of each non-zero entry.
+        output (str): Output .biom path.
+    """
+    header = {
+        "id": None,
+        "format": "Biological Observation Matrix 1.0.0",
+        "format_url": "http://biom-format.org",
+        "type": "OTU table",
+        "generated_by": "metaphlan_parse_abun.py",
+        "date": datetime.now().isoformat(),
+        "rows": [{"id": str(f), "metadata": None} for f in features],
+        "columns": [{"id": str(s), "metadata": None} for s in samples],
+        "matrix_type": "sparse",
+        "matrix_element_type": "float",
+        "shape": [len(features), len(samples)],
+    }
+    with open(output, "w") as handle:
+        # header fields, then the "data" list written entry by entry
+        handle.write(json.dumps(header)[:-1])
+        handle.write(', "data": [')
+        for i, (r, c, v) in enumerate(zip(rows.tolist(), cols.tolist(), values.tolist())):
+            handle.write("%s[%d, %d, %r]" % (", " if i else "", r, c, v))
+        handle.write("]}")
+
+
+def metaphlan_cohortparse(mpa_profiletables, labels, output_prefix, cache=False):
+    """
+    Parse many MetaPhlAn3 profile tables into cohort-level QIIME2 inputs.
+
+    Args:
+        mpa_profiletables (list): Paths to the MetaPhlAn3 profile tables.
+        labels (list): Sample label for each profile, in the same order.
+        output_prefix (str): Prefix of the cohort output files.
+        cache (bool): Write a parsed .npz sidecar next to each profile.
+
+    Outputs:
+        - <prefix>_relabun_parsed_mpaprofile.biom: sparse BIOM 1.0 table, features x samples.
+        - <prefix>_profile_taxonomy.txt: non-redundant TSV with Feature ID and taxonomy.
+    """
+    feature_parts, col_parts, value_parts, taxonomies = [], [], [], []
+    for col, (table, label) in enumerate(zip(mpa_profiletables, labels)):
+        profile_out, taxonomy = species_tables(table, label, cache)
+        # sum repeated Feature IDs so each (feature, sample) cell is written once
+        abundance = profile_out.groupby("Feature ID", sort=False)[label].sum()
+        abundance = abundance[abundance != 0]
+        feature_parts.append(abundance.index.to_numpy(dtype=str))
+        value_parts.append(abundance.to_numpy(dtype=np.float64))
+        col_parts.append(np.full(len(abundance), col, dtype=np.int64))
+        taxonomies.append(taxonomy)
+
+    with perf_metrics.phase('join') as step:
+        features, rows = np.unique(np.concatenate(feature_parts), return_inverse=True)
+        cols = np.concatenate(col_parts)
+        values = np.concatenate(value_parts)
+        order = np.lexsort((cols, rows))
+        merged_taxonomy = pd.concat(taxonomies).drop_duplicates()
+        step.rows += len(values)
+
+    with perf_metrics.phase('write') as step:
+        write_biom_json(features.tolist(), labels, rows[order], cols[order], values[order],
+                        f"{output_prefix}_relabun_parsed_mpaprofile.biom")
+
+        merged_taxonomy.to_csv(
+            f"{output_prefix}_profile_taxonomy.txt", sep="\t", index=False
+        )
+        step.rows += len(values)
 
 
 if __name__ == "__main__":
@@ -87,11 +189,29 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "-t", "--mpa_table", dest="mpa_profiletable",
-        type=str, help="MetaPhlAn assigned reads"
+        type=str, nargs="+", help="MetaPhlAn assigned reads (several with --cohort)"
     )
     parser.add_argument(
         "-l", "--label", dest="label",
-        type=str, help="Sample label"
+        type=str, nargs="+", help="Sample label (one per table with --cohort)"
+    )
+    parser.add_argument(
+        "--cohort", dest="cohort", type=str, default=None, metavar="PREFIX",
+        help="Write one cohort-level BIOM table and taxonomy named PREFIX_*"
+    )
+    parser.add_argument(
+        "--cache", dest="cache", action="store_true",
+        help="Write a parsed .npz sidecar next to the profile"
     )
+    perf_metrics.add_argument(parser)
     args = parser.parse_args()
-    metaphlan_profileparse(args.mpa_profiletable, args.label)
+    if len(args.mpa_profiletable) != len(args.label):
+        parser.error("-t and -l must be given the same number of values")
+    with perf_metrics.record("metaphlan_parse_abun", args.perf_metrics):
+        perf_metrics.count("samples", len(args.mpa_profiletable))
+        if args.cohort:
+            metaphlan_cohortparse(args.mpa_profiletable, args.label, args.cohort, args.cache)
+        else:
+            if len(args.mpa_profiletable) > 1:
+                parser.error("several tables require --cohort")
+            metaphlan_profileparse(args.mpa_profiletable[0], args.label[0], args.cache)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""
+Shared single-pass reader for MetaPhlAn profile reports.
+
+Reads a profile once with a fixed column schema, whether it is the raw
+`<sample>_metaphlan.txt` (with its `#` header block), the sed-stripped
+`<sample>_profile.txt`, or a headerless table. Clade names are split into
+rank columns with one vectorized regex, and the terminal NCBI taxid and
+rank are extracted. The parsed table can be cached as a compact `.npz`
+sidecar next to the report so later steps skip the text parse entirely.
+
+Usage:
+  python metaphlan_profile.py <sample>_profile.txt [...]   # write sidecars
+"""
+
+import argparse
+import os
+import zlib
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['clade_name', 'clade_taxid', 'relative_abundance', 'coverage',
+           'estimated_number_of_reads_from_the_clade']
+DTYPES = {
+    'clade_name': str,
+    'clade_taxid': str,
+    'relative_abundance': np.float64,
+    'coverage': str,
+    'estimated_number_of_reads_from_the_clade': np.float64,
+}
+RANKS = ['kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species', 'strain']
+RANK_PREFIXES = ['k', 'p', 'c', 'o', 'f', 'g', 's', 't']
+UNKNOWN_CLADES = ['UNKNOWN', 'unclassified']
+
+# One optional named group per rank, e.g. k__Bacteria|p__Firmicutes|...|s__X|t__SGB1
+CLADE_PATTERN = '^' + ''.join(
+    r'(?:\|?{}__(?P<{}>[^|]*))?'.format(prefix, rank) for prefix, rank in zip(RANK_PREFIXES, RANKS)
+) + '$'
+
+SIDECAR_SUFFIX = '.npz'
+SIDECAR_VERSION = 2
+
+
+def sidecar_path(path):
+    return str(path) + SIDECAR_SUFFIX
+
+
+def _checksum(path):
+    with open(path, 'rb') as handle:
+        return zlib.crc32(handle.read())
+
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _header_rows(path):
+    """Return (rows to skip, has header line) for the comment block at the top of a report."""
+    skip = 0
+    with open(path) as handle:
+        for line in handle:
+            if line.startswith('#clade_name'):
+                return skip, True
+            if line.startswith('clade_name'):
+                return skip, True
+            if not line.startswith('#'):
+                break
+            skip += 1
+    return skip, False
+
+
+def split_clades(clade_names):
+    """
+    Split clade names into one column per rank with a single vectorized regex.
+
+    Args:
+        clade_names (pd.Series): MetaPhlAn clade names.
+
+    Returns:
+        pd.DataFrame with one column per entry of RANKS (NaN where absent).
+    """
+    return clade_names.str.extract(CLADE_PATTERN)
+
+
+def annotate_clades(clade_names):
+    """
+    Split clade names into rank columns and add the single-letter terminal rank.
+
+    Args:
+        clade_names (pd.Series): MetaPhlAn clade names.
+
+    Returns:
+        pd.DataFrame with the RANKS columns plus 'rank' (k, p, ..., s, t; empty if none).
+    """
+    ranks = split_clades(clade_names)
+    # the last populated rank column is the terminal rank of the clade
+    present = ranks.notna().to_numpy()
+    last = np.where(present.any(axis=1), present.shape[1] - 1 - present[:, ::-1].argmax(axis=1), -1)
+    ranks['rank'] = np.where(last >= 0, np.asarray(RANK_PREFIXES)[np.maximum(last, 0)], '')
+    return ranks
+
+
+def read_report(path):
+    """
+    Read the COLUMNS of a MetaPhlAn report as they are, without deriving ranks or taxids.
+
+    Steps that resolve clades through a taxonomy index (see taxonomy_index.py) use
+    this instead of parse_profile() to skip the per-row clade name splitting.
+    """
+    skip, has_header = _header_rows(path)
+    return pd.read_csv(path, sep='\t', skiprows=skip, header=0 if has_header else None,
+                       names=COLUMNS, usecols=range(len(COLUMNS)), dtype=DTYPES,
+                       keep_default_na=False, na_values={'relative_abundance': [''],
+                       'estimated_number_of_reads_from_the_clade': ['', '-']})
+
+
+def parse_profile(path):
+    """
+    Parse a MetaPhlAn report into a DataFrame with the fixed schema plus derived columns.
+
+    Derived columns:
+        RANKS: rank name components of the clade.
+        rank: single-letter terminal rank (k, p, ..., s, t), empty for UNKNOWN.
+        taxid: terminal NCBI taxid as int64, -1 when missing or UNKNOWN.
+    """
+    profile = read_report(path)
+    profile = pd.concat([profile, annotate_clades(profile['clade_name'])], axis=1)
+
+    # terminal numeric taxid; trailing empty fields (strain rows) are ignored
+    taxid = profile['clade_taxid'].str.extract(r'(?:^|\|)(\d+)\|*$', expand=False)
+    profile['taxid'] = pd.to_numeric(taxid, errors='coerce').fillna(-1).astype(np.int64)
+    unknown = profile['clade_name'].str.lower().isin([c.lower() for c in UNKNOWN_CLADES])
+    profile.loc[unknown, 'taxid'] = -1
+    return profile
+
+
+def save_sidecar(profile, path, stat_key, checksum):
+    arrays = {}
+    for column in profile.columns:
+        values = profile[column]
+        if values.dtype == object:
+            arrays[column] = values.fillna('').to_numpy(dtype=str)
+        else:
+            arrays[column] = values.to_numpy()
+    np.savez_compressed(sidecar_path(path), _version=SIDECAR_VERSION, _size=stat_key[0], _mtime_ns=stat_key[1],
+                        _checksum=checksum,
+                        _columns=np.asarray(list(profile.columns)), **arrays)
+
+
+def load_sidecar(path):
+    """
+    Return the cached profile, or None when the sidecar is missing or stale.
+
+    The sidecar is fresh when the report still has the size and mtime it
+    recorded; only when they differ (e.g. the report was copied) is the report
+    read to compare its CRC32.
+    """
+    cache = sidecar_path(path)
+    if not os.path.exists(cache):
+        return None
+    with np.load(cache, allow_pickle=False) as data:
+        if int(data['_version']) != SIDECAR_VERSION:
+            return None
+        if (int(data['_size']), int(data['_mtime_ns'])) != _stat_key(path) and int(data['_checksum']) != _checksum(path):
+            return None
+        profile = pd.DataFrame({column: data[column] for column in data['_columns']})
+    for column in RANKS + ['clade_name', 'clade_taxid', 'coverage']:
+        profile[column] = profile[column].astype(object)
+    profile[RANKS] = profile[RANKS].replace('', np.nan)
+    return profile
+
+
+def read_profile(path, cache=False):
+    """
+    Read a MetaPhlAn report, using a fresh `.npz` sidecar when one exists.
+
+    Args:
+        path (str): Path to the MetaPhlAn report.
+        cache (bool): Write a sidecar after parsing so later reads are fast.
+
+    Returns:
+        pd.DataFrame as described in parse_profile().
+    """
+    profile = load_sidecar(path)
+    if profile is None:
+        stat_key = _stat_key(path)
+        profile = parse_profile(path)
+        if cache:
+            save_sidecar(profile, path, stat_key, _checksum(path))
+    return profile
+
+
+def is_unknown_only(profile):
+    """True for the 100% UNKNOWN/unclassified single-row report."""
+    return profile.shape[0] == 1 and profile.iloc[0]['clade_name'] in UNKNOWN_CLADES
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parse MetaPhlAn reports and cache them as .npz sidecars.")
+    parser.add_argument('profiles', nargs='+', help="MetaPhlAn report(s)")
+    args = parser.parse_args()
+    for profile_path in args.profiles:
+        read_profile(profile_path, cache=True)
+        print(f"Cached {profile_path} -> {sidecar_path(profile_path)}")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Module: perf_metrics.py
+
+Lightweight per-invocation performance instrumentation shared by the bin/
+scripts: import time, wall and CPU time, per-phase timings (read, filter,
+join, write, ...), peak RSS and rows processed.
+
+Recording is off unless the GMWI2_PERF_METRICS environment variable or a
+script's --perf-metrics option names an output directory; a disabled recorder
+only costs a no-op context manager per phase. Each invocation writes one
+<script>.<host>.<pid>.<time>.perf.json file, which perf_report.py aggregates.
+
+Import this module before pandas/numpy so its import timestamp is the start of
+the script's own imports:
+
+  import perf_metrics
+  import pandas as pd
+
+  with perf_metrics.record('marker_map', args.perf_metrics):
+      with perf_metrics.phase('read') as step:
+          df = pd.read_csv(path)
+          step.rows += len(df)
+
+A phase used several times (e.g. once per sample) accumulates its seconds,
+rows and number of calls. phase() is a no-op outside record(), so library
+functions can be instrumented without passing a recorder around.
+"""
+import json
+import os
+import resource
+import socket
+import sys
+import time
+from contextlib import contextmanager
+
+ENV_VAR = 'GMWI2_PERF_METRICS'
+SUFFIX = '.perf.json'
+
+# start of the importing script's own imports (this module is imported first)
+IMPORTED = time.perf_counter()
+
+
+def add_argument(parser):
+    parser.add_argument('--perf-metrics', default=None, metavar='DIR',
+                        help=f"Write a JSON performance record to DIR (default: ${ENV_VAR}; off when unset)")
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(who).ru_maxrss * scale / 1e6
+
+
+class Phase:
+    __slots__ = ('seconds', 'rows', 'calls')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.rows = 0
+        self.calls = 0
+
+
+class Recorder:
+    """Collects the phases of one invocation and writes them as JSON."""
+
+    def __init__(self, script, directory):
+        self.script = script
+        self.directory = directory
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        step = self.phases.setdefault(name, Phase())
+        start = time.perf_counter()
+        try:
+            yield step
+        finally:
+            step.seconds += time.perf_counter() - start
+            step.calls += 1
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def write(self, status):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        record = {
+            'script': self.script,
+            'argv': sys.argv[1:],
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'workdir': os.getcwd(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started)),
+            'status': status,
+            'import_seconds': round(self.start - IMPORTED, 6),
+            'wall_seconds': round(time.perf_counter() - IMPORTED, 6),
+            'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 6),
+            'children_cpu_seconds': round(children.ru_utime + children.ru_stime, 6),
+            'peak_rss_mb': round(peak_rss_mb(), 3),
+            'children_peak_rss_mb': round(peak_rss_mb(resource.RUSAGE_CHILDREN), 3),
+            'phases': [{'name': name, 'seconds': round(p.seconds, 6), 'rows': p.rows, 'calls': p.calls}
+                       for name, p in self.phases.items()],
+            'counters': self.counters,
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{self.script}.{record['host']}.{record['pid']}.{int(self.started * 1e6)}{SUFFIX}"
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'w') as fh:
+            json.dump(record, fh, indent=2)
+        os.replace(path + '.tmp', path)
+        return path
+
+
+_current = None
+
+
+@contextmanager
+def record(script, directory=None):
+    """Record the enclosed block as one invocation of script (no-op when disabled)."""
+    global _current
+    directory = directory or os.environ.get(ENV_VAR) or None
+    if directory is None:
+        yield None
+        return
+    _current = Recorder(script, directory)
+    status = 'ok'
+    try:
+        yield _current
+    except SystemExit as e:
+        status = 'ok' if not e.code else 'failed'
+        raise
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        recorder, _current = _current, None
+        recorder.write(status)
+
+
+@contextmanager
+def phase(name):
+    """Time a phase of the current recording; yields an object whose .rows can be incremented."""
+    if _current is None:
+        yield Phase()
+        return
+    with _current.phase(name) as step:
+        yield step
+
+
+def count(name, value=1):
+    """Add to a named counter of the current recording (e.g. samples processed)."""
+    if _current is not None:
+        _current.count(name, value)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Script: perf_report.py
+
+Aggregate the *.perf.json records written by the instrumented bin/ scripts
+(see perf_metrics.py) into a run-level performance summary.
+
+Outputs:
+  <prefix>.tsv   one row per script and phase: invocations, samples, total and
+                 slowest seconds, rows, rows/s and the largest peak RSS. The
+                 'import' and 'total' pseudo-phases hold the import and wall
+                 time of the invocations; 'total' counts the rows read.
+  <prefix>.html  the same table plus one row per invocation, as a static page.
+
+Usage:
+  python3 perf_report.py --metrics *.perf.json --prefix performance_summary
+"""
+import argparse
+import json
+import sys
+import pandas as pd
+
+SUMMARY_COLUMNS = ['script', 'phase', 'invocations', 'samples', 'seconds', 'max_seconds',
+                   'rows', 'rows_per_second', 'peak_rss_mb']
+
+
+def load_records(paths):
+    records = []
+    for path in paths:
+        with open(path) as fh:
+            records.append(json.load(fh))
+    return records
+
+
+def phase_rows(records):
+    """Long table of (script, invocation, phase, seconds, rows) including import and total."""
+    rows = []
+    for i, rec in enumerate(records):
+        base = {'script': rec['script'], 'invocation': i,
+                'samples': rec.get('counters', {}).get('samples', 0),
+                'peak_rss_mb': max(rec['peak_rss_mb'], rec.get('children_peak_rss_mb', 0))}
+        rows.append(dict(base, phase='import', seconds=rec['import_seconds'], rows=0))
+        for step in rec['phases']:
+            rows.append(dict(base, phase=step['name'], seconds=step['seconds'], rows=step['rows']))
+        rows.append(dict(base, phase='total', seconds=rec['wall_seconds'],
+                         rows=sum(step['rows'] for step in rec['phases'] if step['name'] == 'read')))
+    return pd.DataFrame(rows, columns=['script', 'invocation', 'samples', 'peak_rss_mb', 'phase', 'seconds', 'rows'])
+
+
+def summarise(long):
+    if long.empty:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    summary = (long.groupby(['script', 'phase'], sort=False)
+               .agg(invocations=('invocation', 'nunique'), samples=('samples', 'sum'),
+                    seconds=('seconds', 'sum'), max_seconds=('seconds', 'max'),
+                    rows=('rows', 'sum'), peak_rss_mb=('peak_rss_mb', 'max'))
+               .reset_index())
+    rate = summary['rows'].where(summary['rows'] > 0) / summary['seconds'].where(summary['seconds'] > 0)
+    summary['rows_per_second'] = rate.round(1)
+    summary[['seconds', 'max_seconds']] = summary[['seconds', 'max_seconds']].round(3)
+    # slowest scripts first, phases in the order they ran
+    order = summary[summary['phase'] == 'total'].sort_values('seconds', ascending=False)['script']
+    summary['script'] = pd.Categorical(summary['script'], categories=list(order), ordered=True)
+    return summary.sort_values('script', kind='stable')[SUMMARY_COLUMNS]
+
+
+def invocations(records):
+    return pd.DataFrame([{
+        'script': rec['script'],
+        'started': rec['started'],
+        'status': rec['status'],
+        'samples': rec.get('counters', {}).get('samples', 0),
+        'import_seconds': rec['import_seconds'],
+        'wall_seconds': rec['wall_seconds'],
+        'cpu_seconds': round(rec['cpu_seconds'] + rec.get('children_cpu_seconds', 0), 3),
+        'peak_rss_mb': rec['peak_rss_mb'],
+        'children_peak_rss_mb': rec.get('children_peak_rss_mb', 0),
+        'workdir': rec['workdir'],
+    } for rec in records])
+
+
+def write_html(summary, calls, output):
+    with open(output, 'w') as f:
+        f.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8"/>\n'
+                '<title>Pipeline performance summary</title>\n'
+                '<style>body { font-family:sans-serif; margin:20px } '
+                'table { border-collapse:collapse; margin-bottom:30px } '
+                'td, th { border:1px solid #ccc; padding:3px 8px; text-align:right } '
+                'th { background:#343a40; color:white }</style>\n</head><body>\n')
+        f.write(f'<h2>Per-step performance ({len(calls)} script invocations)</h2>\n')
+        f.write(summary.to_html(index=False, na_rep=''))
+        f.write('\n<h2>Invocations</h2>\n')
+        f.write(calls.to_html(index=False, na_rep=''))
+        f.write('\n</body></html>\n')
+
+
+def main():
+    p = argparse.ArgumentParser(description="Aggregate per-invocation performance records into a run summary.")
+    p.add_argument('--metrics', nargs='*', default=[], help="*.perf.json files written by perf_metrics.py")
+    p.add_argument('--prefix',  default='performance_summary', help="Output prefix (default: performance_summary)")
+    args = p.parse_args()
+
+    records = load_records(args.metrics)
+    summary = summarise(phase_rows(records))
+    calls = invocations(records)
+    summary.to_csv(f"{args.prefix}.tsv", sep='\t', index=False)
+    write_html(summary, calls, f"{args.prefix}.html")
+    print(f"Summarised {len(records)} script invocations -> {args.prefix}.tsv, {args.prefix}.html", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
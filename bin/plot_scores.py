@@ -1,7 +1,43 @@
 #!/usr/bin/env python3
-import argparse, json
+import argparse, base64, json, os, zlib
+import perf_metrics
 import pandas as pd
+import plotly
 import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
+
+PLOTLY_CDN = '<script src="https://cdn.plot.ly/plotly-latest.min.js"></script>'
+
+class GzipBase64Writer:
+    """File-like wrapper that gzips text written to it and emits it base64-encoded to f."""
+    def __init__(self, f):
+        self.f = f
+        self.gz = zlib.compressobj(9, zlib.DEFLATED, 31)
+        self.pending = b''
+
+    def _emit(self, data, final=False):
+        data = self.pending + data
+        # base64 works on 3-byte groups; hold back the remainder until the end
+        cut = len(data) if final else len(data) - len(data) % 3
+        self.f.write(base64.b64encode(data[:cut]).decode('ascii'))
+        self.pending = data[cut:]
+
+    def write(self, text):
+        self._emit(self.gz.compress(text.encode('utf-8')))
+
+    def close(self):
+        self._emit(self.gz.flush(), final=True)
+
+
+def write_stats_json(df_stats, f):
+    """Stream the marker-map records to f as a JSON object keyed by sample, one sample at a time."""
+    f.write('{')
+    for i, (sample, recs) in enumerate(df_stats.groupby('sample', sort=False)):
+        f.write(',\n' if i else '\n')
+        f.write(json.dumps(str(sample)))
+        f.write(':')
+        json.dump(recs.to_dict(orient='records'), f)
+    f.write('\n}')
 
 def main():
     p = argparse.ArgumentParser(
@@ -9,25 +45,42 @@ def main():
     )
     p.add_argument('-i','--input', required=True,
                    help="TSV: sample, gmwi2_score")
-    p.add_argument('-s','--stats', required=True,
-                   help="TSV: sample, species, user_abundance, db_median, db_mean")
+    p.add_argument('-s','--stats', default=None,
+                   help="TSV: sample, species, user_abundance, db_median, db_mean (optional; no tooltips without it)")
+    p.add_argument('--score-column', default='gmwi2_score',
+                   help="Score column of --input to plot (default: gmwi2_score)")
     p.add_argument('-o','--output', default='gmwi2_scores_tooltip.html')
+    p.add_argument('--offline', action='store_true',
+                   help="Inline the minified plotly.js bundled with the plotly package instead of loading it from the CDN")
+    p.add_argument('--compress-data', action='store_true',
+                   help="Embed the marker-map payload gzip+base64 encoded, decoded in the browser on load")
+    p.add_argument('--page-size', type=int, default=500,
+                   help="Max samples drawn per bar-chart page (default: 500)")
+    perf_metrics.add_argument(p)
     args = p.parse_args()
 
+    with perf_metrics.record('plot_scores', args.perf_metrics):
+        plot(args)
+
+def plot(args):
     # load main scores
-    df = pd.read_csv(args.input, sep='\t')
+    with perf_metrics.phase('read') as step:
+        df = pd.read_csv(args.input, sep='\t')
+        step.rows += len(df)
+    perf_metrics.count('samples', len(df))
     samples = df['sample'].tolist()
-    scores  = df['gmwi2_score'].tolist()
+    scores  = df[args.score_column].tolist()
+    label   = 'GMWI2 Score' if args.score_column == 'gmwi2_score' else args.score_column.replace('_', ' ').title()
     colors  = [('#0072B2' if v>=0 else '#D55E00') for v in scores]
 
-    # build bar figure
-    bar = go.Figure(go.Bar(x=samples, y=scores, marker=dict(color=colors), hoverinfo='none'))
+    # build bar figure; the samples are filled in per page by the page script
+    bar = go.Figure(go.Bar(x=[], y=[], marker=dict(color=[]), hoverinfo='none'))
     bar.update_layout(
         paper_bgcolor='#f8f9fa', plot_bgcolor='#f8f9fa',
-        xaxis_title='<b>Sample</b>', yaxis_title='<b>GMWI2 Score</b>',
+        xaxis_title='<b>Sample</b>', yaxis_title=f'<b>{label}</b>',
         margin=dict(l=50,r=20,t=80,b=70),
         annotations=[dict(x=0,y=1.05, xref='paper', yref='paper',
-                          text='<b>GMWI2 Scores per Sample</b>',
+                          text=f'<b>{label}s per Sample</b>',
                           showarrow=False, font=dict(size=24,color='white'),
                           bgcolor='#343a40', borderpad=8, xanchor='left')]
     )
@@ -35,20 +88,38 @@ def main():
     bar.update_yaxes(showgrid=True, gridcolor='lightgrey', zeroline=True,
                      zerolinecolor='darkgrey', zerolinewidth=2,
                      showline=True, linecolor='black', dtick=1)
+    if scores:
+        # keep the y-axis fixed across pages
+        lo, hi = min(min(scores), 0), max(max(scores), 0)
+        bar.update_yaxes(range=[lo - 0.5, hi + 0.5])
+
+    fig_json    = bar.to_json()
+    scores_json = json.dumps({'samples': samples, 'scores': scores, 'colors': colors})
+    page_size   = max(1, args.page_size)
 
-    fig_json   = bar.to_json()
+    # load stats; records are written grouped by sample below
+    with perf_metrics.phase('read') as step:
+        if args.stats:
+            df_stats = pd.read_csv(args.stats, sep='\t')
+        else:
+            df_stats = pd.DataFrame(columns=['sample', 'species', 'user_abundance', 'db_median', 'db_mean'])
+        df_stats   = df_stats.astype(object).where(df_stats.notna(), None)
+        step.rows += len(df_stats)
 
-    # load stats
-    df_stats   = pd.read_csv(args.stats, sep='\t')
-    stats_json = json.dumps(df_stats.to_dict(orient='records'))
+    if args.offline:
+        # pinned to the plotly.js release shipped with the installed plotly package
+        plotly_script = f'<script type="text/javascript">/* plotly.js bundled with plotly {plotly.__version__} */{get_plotlyjs()}</script>'
+    else:
+        plotly_script = PLOTLY_CDN
 
-    html = f"""<!DOCTYPE html>
+    head = f"""<!DOCTYPE html>
 <html><head><meta charset="utf-8"/>
   <title>GMWI2 Scores + Hover Tooltip</title>
-  <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+  {plotly_script}
   <style>
     body {{ margin:0; font-family:sans-serif; background:transparent }}
-    #plot {{ width:100%; height:100vh; }}
+    #plot {{ width:100%; height:calc(100vh - 40px); }}
+    #pager {{ height:40px; display:flex; align-items:center; justify-content:center; gap:12px }}
     #tooltip {{
       position:absolute; display:none;
       width:300px; height:200px;
@@ -58,20 +129,50 @@ def main():
     }}
   </style>
 </head><body>
+  <div id="pager">
+    <button id="prev">&laquo; Prev</button>
+    <span id="pageinfo"></span>
+    <button id="next">Next &raquo;</button>
+  </div>
   <div id="plot"></div>
   <div id="tooltip"></div>
   <script>
     const fig = {fig_json};
-    const statsData = {stats_json};
-    Plotly.newPlot('plot', fig.data, fig.layout, {{responsive:true}});
+    const scoreData = {scores_json};
+    const pageSize = {page_size};
+    // marker-map records keyed by sample for O(1) hover lookups
+    let statsBySample = """
+
+    tail = f""";
     const plotDiv = document.getElementById('plot');
     const tipDiv  = document.getElementById('tooltip');
+    const nPages  = Math.max(1, Math.ceil(scoreData.samples.length / pageSize));
+    let page = 0;
+
+    // draw only one window of samples at a time
+    function drawPage() {{
+      const lo = page * pageSize, hi = lo + pageSize;
+      const trace = Object.assign({{}}, fig.data[0], {{
+        x: scoreData.samples.slice(lo, hi),
+        y: scoreData.scores.slice(lo, hi),
+        marker: Object.assign({{}}, fig.data[0].marker, {{color: scoreData.colors.slice(lo, hi)}})
+      }});
+      Plotly.react(plotDiv, [trace], fig.layout, {{responsive:true}});
+      document.getElementById('pageinfo').textContent =
+        `Samples ${{lo + 1}}-${{Math.min(hi, scoreData.samples.length)}} of ${{scoreData.samples.length}}`;
+      document.getElementById('prev').disabled = page === 0;
+      document.getElementById('next').disabled = page >= nPages - 1;
+    }}
+    document.getElementById('prev').onclick = () => {{ if (page > 0) {{ page--; drawPage(); }} }};
+    document.getElementById('next').onclick = () => {{ if (page < nPages - 1) {{ page++; drawPage(); }} }};
+    if (nPages === 1) document.getElementById('pager').style.display = 'none';
+    drawPage();
 
     plotDiv.on('plotly_hover', evt => {{
       const pt = evt.points[0];
       const samp = pt.x;
-      const recs = statsData.filter(r => r.sample===samp);
-      if(!recs.length) return;
+      const recs = statsBySample[String(samp)];
+      if(!recs || !recs.length) return;
 
       // prepare marker‐map traces
       const sp = recs.map(r=>r.species),
@@ -126,9 +227,22 @@ def main():
 </body></html>
 """
 
-    with open(args.output,'w') as f:
-        f.write(html)
-    print("Wrote interactive tooltip dashboard to", args.output)
+    with perf_metrics.phase('write') as step, open(args.output,'w') as f:
+        step.rows += len(df_stats)
+        f.write(head)
+        if args.compress_data:
+            f.write('{};\n    const statsGz = "')
+            gz = GzipBase64Writer(f)
+            write_stats_json(df_stats, gz)
+            gz.close()
+            f.write('";\n')
+            f.write("""    new Response(new Blob([Uint8Array.from(atob(statsGz), c => c.charCodeAt(0))]).stream()
+      .pipeThrough(new DecompressionStream('gzip'))).text()
+      .then(txt => { statsBySample = JSON.parse(txt); })""")
+        else:
+            write_stats_json(df_stats, f)
+        f.write(tail)
+    print(f"Wrote interactive tooltip dashboard to {args.output} ({os.path.getsize(args.output)} bytes)")
 
 if __name__=='__main__':
     main()
@@ -1,19 +1,54 @@
 #!/usr/bin/env python
+import perf_metrics
+import numpy as np
 import pandas as pd
 import argparse
+import taxonomy_index
+from concurrent.futures import ProcessPoolExecutor
+
+def read_taxonomy(tax):
+    return pd.read_csv(tax, sep="\t")
+
+#with a taxonomy index, features are deduplicated on their integer taxid and take the
+#index lineage, so one taxid written with two spellings no longer yields two rows
+def dedupe_by_taxid(merged_taxon, index):
+    merged_taxon = merged_taxon.drop_duplicates("Feature ID")
+    taxids = pd.to_numeric(merged_taxon["Feature ID"], errors="coerce").fillna(-1).astype(np.int64)
+    lineage = index.lineage_of(taxids)
+    known = pd.notna(lineage)
+    canonical = pd.Series(lineage[known], dtype=object).str.replace("|", ";", regex=False)
+    merged_taxon.loc[known, "Taxon"] = canonical.to_numpy()
+    return merged_taxon
 
 #the following function takes in all taxonomy files and create a non-redundant taxonomy file
-def qiime_taxmerge(taxonomylist, output):
-    dfs = []
-    for tax in taxonomylist:
-        df = pd.read_csv(tax, sep="\t")
-        dfs.append(df)
-    merged_taxon = pd.concat(dfs).drop_duplicates()
-    merged_taxon.to_csv(output, index=False, sep="\t")
+def qiime_taxmerge(taxonomylist, output, jobs=1, index=None):
+    with perf_metrics.phase('read') as step:
+        if jobs <= 1 or len(taxonomylist) <= 1:
+            dfs = [read_taxonomy(tax) for tax in taxonomylist]
+        else:
+            # pool.map keeps the input order, so the merged output is deterministic
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                dfs = list(pool.map(read_taxonomy, taxonomylist, chunksize=max(1, len(taxonomylist) // (jobs * 4))))
+        step.rows += sum(len(df) for df in dfs)
+    with perf_metrics.phase('filter') as step:
+        merged_taxon = pd.concat(dfs)
+        merged_taxon = merged_taxon.drop_duplicates() if index is None else dedupe_by_taxid(merged_taxon, index)
+        step.rows += len(merged_taxon)
+    with perf_metrics.phase('write') as step:
+        merged_taxon.to_csv(output, index=False, sep="\t")
+        step.rows += len(merged_taxon)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="""Merge together all taxonomy file output""")
     parser.add_argument(dest="taxonomylist", nargs='+', type=str, help="list of taxonomic files")
     parser.add_argument("-o", "--output", dest="output", type=str, default="merged_taxonomy.tsv", help="output file name")
+    parser.add_argument("--base", dest="base", type=str, default=None, help="merged taxonomy of a previous run to extend (incremental mode)")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, help="number of worker processes used to read the inputs")
+    parser.add_argument("--taxonomy-index", dest="taxonomy_index", type=str, default=None, help="taxonomy index (.npz from taxonomy_index.py) to deduplicate on integer taxids")
+    perf_metrics.add_argument(parser)
     args = parser.parse_args()
-    qiime_taxmerge(args.taxonomylist, args.output)
+    # the previous merge is already non-redundant, so it just leads the list
+    taxonomylist = ([args.base] if args.base else []) + args.taxonomylist
+    with perf_metrics.record("qiime_taxmerge", args.perf_metrics):
+        perf_metrics.count("samples", len(args.taxonomylist))
+        qiime_taxmerge(taxonomylist, args.output, args.jobs, taxonomy_index.load(args.taxonomy_index))
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Script: result_cache.py
+
+Content-addressed store of per-sample results shared across runs and work
+directories, so a sample resubmitted in a new cohort does not redo GMWI2 or
+HUMAnN.
+
+An entry is keyed by the SHA-256 of the input reads (and any extra inputs such
+as a taxonomic prior), the database locations and the tool version (container
+image), so a new database release or tool build never hits an old entry.
+Files are stored without the sample prefix and restored under the prefix of the
+run asking for them. Read checksums are memoised in the store by (real path,
+size, mtime), so unchanged input files are hashed once.
+
+Store layout (filesystem implementation):
+  <store>/objects/<key[:2]>/<key>/   result files, meta.json, .last_used
+  <store>/checksums/                 memoised input checksums
+  <store>/.lock                      serialises writers and eviction; readers share it
+
+Eviction is least-recently-used: entries unused for --max-age-days are removed
+and then the oldest are removed until the store is under --max-size.
+
+Usage:
+  ARGS="--store /cache --prefix S1 --suffixes _GMWI2.txt _metaphlan.txt \
+        --reads S1_R1.fastq.gz S1_R2.fastq.gz --salt gmwi2 <metaphlan_db> <genome_db> <image>"
+  result_cache.py get $ARGS || { gmwi2 ...; result_cache.py put $ARGS --max-size 500G; }
+  result_cache.py evict --store /cache --max-size 500G --max-age-days 90
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+
+CHUNK_SIZE = 1 << 20
+# Exit status of `get` on a cache miss, distinct from real errors
+MISS = 3
+UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(text):
+    """Parse sizes such as 500G, 20M or 1024 into bytes."""
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1] if text and text[-1] in UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FilesystemStore:
+    """Result store on a (shared or node-local) filesystem directory."""
+
+    def __init__(self, root):
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        self.checksums = os.path.join(root, 'checksums')
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.checksums, exist_ok=True)
+
+    def entry(self, key):
+        return os.path.join(self.objects, key[:2], key)
+
+    @contextmanager
+    def lock(self, shared=False):
+        with open(os.path.join(self.root, '.lock'), 'w') as fh:
+            fcntl.flock(fh, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def checksum(self, path):
+        """SHA-256 of a file, memoised by its real path, size and mtime."""
+        real = os.path.realpath(path)
+        st = os.stat(real)
+        ident = hashlib.sha256(f"{real}\0{st.st_size}\0{st.st_mtime_ns}".encode()).hexdigest()
+        memo = os.path.join(self.checksums, ident)
+        try:
+            with open(memo) as fh:
+                return fh.read().strip()
+        except FileNotFoundError:
+            pass
+        digest = file_sha256(real)
+        tmp = f"{memo}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as fh:
+            fh.write(digest)
+        os.replace(tmp, memo)
+        return digest
+
+    def get(self, key, names, dest):
+        """Restore the named files of an entry into dest; False on a miss."""
+        entry = self.entry(key)
+        # shared lock: concurrent restores proceed, eviction waits until they are done
+        with self.lock(shared=True):
+            if not os.path.isfile(os.path.join(entry, 'meta.json')):
+                return False
+            if not all(os.path.isfile(os.path.join(entry, name)) for name in names.values()):
+                return False
+            restored = []
+            try:
+                for target, stored in names.items():
+                    target = os.path.join(dest, target)
+                    if os.path.lexists(target):
+                        os.remove(target)
+                    try:
+                        os.link(os.path.join(entry, stored), target)
+                    except OSError:
+                        # cross-device store: copy instead of hard-linking
+                        shutil.copyfile(os.path.join(entry, stored), target)
+                    restored.append(target)
+                os.utime(self._touch(entry))
+            except FileNotFoundError:
+                # removed under us where flock is not honoured (some NFS mounts): a miss
+                for target in restored:
+                    os.remove(target)
+                return False
+        return True
+
+    def put(self, key, names, src, meta):
+        """Store the named files of src under key; an existing entry is kept as is."""
+        entry = self.entry(key)
+        with self.lock():
+            if os.path.isfile(os.path.join(entry, 'meta.json')):
+                return False
+            tmp = f"{entry}.{os.getpid()}.tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            for source, stored in names.items():
+                shutil.copyfile(os.path.join(src, source), os.path.join(tmp, stored))
+            with open(os.path.join(tmp, 'meta.json'), 'w') as fh:
+                json.dump(dict(meta, key=key, created=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())), fh, indent=2)
+            self._touch(tmp)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        return True
+
+    def entries(self):
+        """(last_used, size, path) of every complete entry."""
+        for shard in os.scandir(self.objects):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.tmp') or not entry.is_dir():
+                    continue
+                stamp = os.path.join(entry.path, '.last_used')
+                used = os.path.getmtime(stamp) if os.path.exists(stamp) else os.path.getmtime(entry.path)
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                yield used, size, entry.path
+
+    def evict(self, max_size=None, max_age_days=None):
+        """Remove stale entries, then least recently used ones until under max_size."""
+        removed = []
+        with self.lock():
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            cutoff = time.time() - max_age_days * 86400 if max_age_days is not None else None
+            for used, size, path in entries:
+                stale = cutoff is not None and used < cutoff
+                full = max_size is not None and total > max_size
+                if not (stale or full):
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                removed.append(path)
+        return removed, total
+
+    @staticmethod
+    def _touch(entry):
+        stamp = os.path.join(entry, '.last_used')
+        open(stamp, 'a').close()
+        return stamp
+
+
+def file_names(prefix, suffixes):
+    """Map '<prefix><suffix>' run file names to prefix-free stored names."""
+    return {f"{prefix}{suffix}": suffix.lstrip('_') for suffix in suffixes}
+
+
+def add_key_arguments(p):
+    p.add_argument('--reads', nargs='+', default=[], help="Input reads, in order")
+    p.add_argument('--extra', nargs='*', default=[], help="Other input files that change the result (e.g. a taxonomic prior)")
+    p.add_argument('--salt', nargs='*', default=[], help="Tool name, database locations and tool version")
+
+
+def result_key(store, args):
+    """Key of the inputs named on the command line (--key wins when given)."""
+    if getattr(args, 'key', None):
+        return args.key
+    if not args.reads:
+        sys.exit("ERROR: pass --key or the --reads it is computed from")
+    material = [f"{len(args.reads)} reads"] + [store.checksum(r) for r in args.reads]
+    material += [store.checksum(f) for f in args.extra] + args.salt
+    return hashlib.sha256('\n'.join(material).encode()).hexdigest()
+
+
+def add_eviction_arguments(p):
+    p.add_argument('--max-size', default=None, help="Evict least recently used entries down to this size (e.g. 500G)")
+    p.add_argument('--max-age-days', type=float, default=None, help="Evict entries unused for this many days")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Content-addressed cross-run result cache.")
+    sub = p.add_subparsers(dest='command', required=True)
+
+    k = sub.add_parser('key', help="Print the cache key of a set of inputs")
+    k.add_argument('--store', required=True, help="Store directory (holds the memoised checksums)")
+    add_key_arguments(k)
+
+    for name in ['get', 'put']:
+        s = sub.add_parser(name, help="Restore results on a hit (exit 3 on a miss)" if name == 'get' else "Store results")
+        s.add_argument('--store', required=True, help="Store directory")
+        s.add_argument('--key', default=None, help="Key printed by `key`, instead of the key inputs")
+        add_key_arguments(s)
+        s.add_argument('--prefix', required=True, help="Sample prefix of the result files")
+        s.add_argument('--suffixes', nargs='+', required=True, help="Result file suffixes, e.g. _GMWI2.txt")
+        if name == 'put':
+            add_eviction_arguments(s)
+
+    e = sub.add_parser('evict', help="Apply the eviction policy")
+    e.add_argument('--store', required=True, help="Store directory")
+    add_eviction_arguments(e)
+    args = p.parse_args()
+
+    store = FilesystemStore(args.store)
+
+    if args.command == 'key':
+        print(result_key(store, args))
+
+    elif args.command == 'get':
+        key = result_key(store, args)
+        if not store.get(key, file_names(args.prefix, args.suffixes), '.'):
+            print(f"Result cache miss: {args.prefix} ({key[:12]})", file=sys.stderr)
+            sys.exit(MISS)
+        print(f"Result cache hit: {args.prefix} ({key[:12]})", file=sys.stderr)
+
+    elif args.command == 'put':
+        key = result_key(store, args)
+        stored = store.put(key, file_names(args.prefix, args.suffixes), '.', {'prefix': args.prefix, 'salt': args.salt})
+        print(f"Result cache {'stored' if stored else 'already has'}: {args.prefix} ({key[:12]})", file=sys.stderr)
+        if args.max_size or args.max_age_days is not None:
+            store.evict(parse_size(args.max_size) if args.max_size else None, args.max_age_days)
+
+    elif args.command == 'evict':
+        removed, total = store.evict(parse_size(args.max_size) if args.max_size else None, args.max_age_days)
+        print(f"Evicted {len(removed)} entries; store holds {total} bytes", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
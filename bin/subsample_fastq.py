@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Script: subsample_fastq.py
+
+Cap a sample at --max-reads reads (read pairs for paired-end) before GMWI2.
+
+Reads are selected with a seeded selection-sampling pass (Knuth's Algorithm S):
+record i of N is kept with probability (n - kept) / (N - i), which keeps exactly
+n = max_reads records in file order while streaming. R1 and R2 are read record
+by record in lockstep and share every keep/drop decision, so pairs stay in sync;
+both mates are read to their end, and mates of different lengths are an error.
+Input and output are gzip streams; only one record per mate is held in memory.
+
+N is taken from --total-reads (e.g. the check_samplesheet.py pre-flight count);
+without it R1 is decompressed once to count its records first. Samples at or
+under the cap are passed through as symlinks to the original files.
+
+A one-row TSV records: sample, total_reads, kept_reads, fraction.
+
+Usage:
+  python3 subsample_fastq.py \
+    --read1 S1_R1.fastq.gz --read2 S1_R2.fastq.gz \
+    --max-reads 20000000 --seed 42 --prefix S1
+"""
+import argparse
+import gzip
+import os
+import random
+import sys
+from itertools import islice, zip_longest
+
+
+def records(handle):
+    """Yield FASTQ records (tuples of 4 lines) from a binary handle."""
+    while True:
+        record = tuple(islice(handle, 4))
+        if not record:
+            return
+        if len(record) < 4:
+            raise ValueError("FASTQ ends with an incomplete record")
+        yield record
+
+
+def count_records(path):
+    """Count FASTQ records by streaming the decompressed file once."""
+    with gzip.open(path, 'rb') as fh:
+        return sum(1 for _ in fh) // 4
+
+
+def subsample(read_paths, out_paths, total, keep, rng, level):
+    """
+    Write exactly `keep` of the `total` records of each mate to out_paths.
+
+    Returns the number of records written per mate; raises ValueError when the
+    mates do not have the same number of records.
+    """
+    ins = [gzip.open(p, 'rb') for p in read_paths]
+    # no name or timestamp in the gzip header, so reruns give byte-identical files
+    raw = [open(p, 'wb') for p in out_paths]
+    outs = [gzip.GzipFile(filename='', mode='wb', compresslevel=level, fileobj=fh, mtime=0) for fh in raw]
+    kept = 0
+    try:
+        mates = [records(fh) for fh in ins]
+        # zip_longest rather than zip, which would stop silently at the shorter mate
+        for i, pair in enumerate(zip_longest(*mates)):
+            if None in pair:
+                short = read_paths[pair.index(None)]
+                raise ValueError(f"{short} ends after {i} records, before its mate")
+            if kept == keep and len(mates) == 1:
+                break
+            # Algorithm S: keep with probability (records still needed) / (records left);
+            # once all are kept, paired mates are only read on to check they end together
+            if kept < keep and rng.random() * (total - i) < keep - kept:
+                for out, record in zip(outs, pair):
+                    out.writelines(record)
+                kept += 1
+    finally:
+        for fh in ins + outs + raw:
+            fh.close()
+    return kept
+
+
+def main():
+    p = argparse.ArgumentParser(description="Seeded streaming subsampling of (paired) gzipped FASTQ to a read cap.")
+    p.add_argument('--read1',       required=True, help="R1 (or single-end) FASTQ.gz")
+    p.add_argument('--read2',       default=None, help="R2 FASTQ.gz for paired-end samples")
+    p.add_argument('--max-reads',   type=int, required=True, help="Maximum reads (pairs) to keep")
+    p.add_argument('--total-reads', type=int, default=None, help="Reads (pairs) in the input when already known")
+    p.add_argument('--seed',        type=int, default=42, help="Random seed; combined with --prefix so each sample draws its own stream")
+    p.add_argument('--prefix',      required=True, help="Sample/run prefix used for output names")
+    p.add_argument('--compression', type=int, default=1, help="gzip level of the subsampled output (default: 1)")
+    args = p.parse_args()
+
+    read_paths = [args.read1] + ([args.read2] if args.read2 else [])
+    out_paths = [f"{args.prefix}_capped_R{i + 1}.fastq.gz" for i in range(len(read_paths))]
+
+    total = args.total_reads if args.total_reads is not None else count_records(args.read1)
+
+    if total <= args.max_reads:
+        for src, dst in zip(read_paths, out_paths):
+            os.symlink(os.path.realpath(src), dst)
+        kept = total
+    else:
+        rng = random.Random(f"{args.seed}:{args.prefix}")
+        try:
+            kept = subsample(read_paths, out_paths, total, args.max_reads, rng, args.compression)
+        except ValueError as e:
+            sys.exit(f"ERROR: {args.prefix}: {e}")
+        if kept != args.max_reads:
+            sys.exit(f"ERROR: {args.prefix}: expected {total} reads but the input ran out after selecting {kept}")
+
+    fraction = kept / total if total else 1.0
+    with open(f"{args.prefix}_subsample.tsv", 'w') as f:
+        f.write("sample\ttotal_reads\tkept_reads\tfraction\n")
+        f.write(f"{args.prefix}\t{total}\t{kept}\t{fraction:.6g}\n")
+    print(f"{args.prefix}: kept {kept} of {total} reads (fraction {fraction:.6g})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Script: taxonomy_index.py
+
+Integer taxonomy index of a MetaPhlAn database: NCBI species taxid <-> species
+name <-> lineage, stored as sorted numpy arrays in one compressed .npz file.
+It is built once per database version, and the post-processing steps join
+taxa on integer taxids through it instead of matching species-name strings
+(marker_map.py, qiime_taxmerge.py with --taxonomy-index).
+
+Lookups are vectorized: lineages and names go through a hash index
+(pd.Index.get_indexer), taxids through a binary search of the sorted taxid
+array. Names are compared after normalisation (case, 's__' prefix, spaces vs
+underscores), so 'Bacteroides vulgatus' in a marker database and
+'s__Bacteroides_vulgatus' in a profile resolve to the same taxid.
+
+Sources (the clade -> taxid-path pairs of the database):
+  --metaphlan-pkl  the MetaPhlAn database pickle (its 'taxonomy' table)
+  --clades         TSVs whose first two columns are the clade name and the taxid
+                   path; MetaPhlAn reports work, so a cohort can seed an index
+
+Usage:
+  python3 taxonomy_index.py build \
+    --metaphlan-pkl mpa_vJan21_CHOCOPhlAnSGB_202103.pkl \
+    --output taxonomy_index.npz
+
+  python3 taxonomy_index.py build --clades *_metaphlan.txt --database cohort --output taxonomy_index.npz
+"""
+import argparse
+import bz2
+import os
+import pickle
+import sys
+import numpy as np
+import pandas as pd
+from metaphlan_profile import UNKNOWN_CLADES
+
+INDEX_VERSION = 1
+
+
+def normalize_names(names):
+    """Lower-case species names without the 's__' prefix, runs of spaces/underscores as one '_'."""
+    names = pd.Series(names, dtype=object).fillna('')
+    return (names.str.strip()
+                 .str.replace(r'^s__', '', regex=True)
+                 .str.replace(r'[\s_]+', '_', regex=True)
+                 .str.lower())
+
+
+def _lookup(index, keys, taxids):
+    """taxids of the keys found in index (hash lookup), -1 for the others."""
+    pos = index.get_indexer(pd.Index(pd.Series(keys, dtype=object).fillna('')))
+    result = np.full(len(pos), -1, dtype=np.int64)
+    hit = pos >= 0
+    result[hit] = taxids[pos[hit]]
+    return result
+
+
+class TaxonomyIndex:
+    """
+    Species taxids of a MetaPhlAn database with their names and lineages.
+
+    Attributes:
+        taxid (np.ndarray): int64 species taxids, sorted.
+        name (np.ndarray): species name of each taxid (without 's__').
+        lineage (np.ndarray): 'k__..|..|s__..' lineage of each taxid.
+        clade (np.ndarray): every clade of the database, from kingdom to strain.
+        clade_taxid (np.ndarray): species taxid of each species or strain
+            clade, -1 for higher ranks and species without an NCBI taxid.
+        clade_species (np.ndarray): whether each clade is a species.
+        database (str): database version the index was built from.
+    """
+
+    def __init__(self, taxid, name, lineage, clade, clade_taxid, clade_species, database=''):
+        self.taxid = np.asarray(taxid, dtype=np.int64)
+        self.name = np.asarray(name, dtype=str)
+        self.lineage = np.asarray(lineage, dtype=str)
+        self.clade = np.asarray(clade, dtype=str)
+        self.clade_taxid = np.asarray(clade_taxid, dtype=np.int64)
+        self.clade_species = np.asarray(clade_species, dtype=bool)
+        self.database = database
+        self._clades = pd.Index(self.clade)
+        self._species_taxid = np.where(self.clade_species, self.clade_taxid, -1)
+        names = normalize_names(self.name)
+        first = ~names.duplicated().to_numpy()
+        self._names = pd.Index(names[first])
+        self._name_taxid = self.taxid[first]
+
+    def __len__(self):
+        return len(self.taxid)
+
+    @classmethod
+    def from_clades(cls, clades, taxid_paths, database=''):
+        """
+        Build the index from clade names and their taxid paths.
+
+        Species with an NCBI taxid become entries; every clade and its
+        ancestors is recorded, so lookups can tell a higher-rank or unnamed
+        (e.g. MetaPhlAn 4 GGB/SGB placeholder) clade from an unknown one.
+        """
+        table = pd.DataFrame({'clade': pd.Series(clades, dtype=object),
+                              'path': pd.Series(taxid_paths, dtype=object)}).dropna().drop_duplicates('clade')
+        species = table['clade'].str.replace(r'\|t__[^|]*$', '', regex=True)
+        leaf = species.str.contains(r'(?:^|\|)s__[^|]*$')
+        table, species = table[leaf], species[leaf]
+        # the taxid at the species' depth in the path (the last one of shorter paths); empty
+        # there means an unnamed species, whose path only carries its ancestors' taxids
+        depth = species.str.count(r'\|')
+        taxid = pd.to_numeric(pd.Series([f[d] if d < len(f) else f[-1]
+                                         for f, d in zip(table['path'].str.split('|'), depth)],
+                                        index=table.index, dtype=object), errors='coerce')
+        table = table.assign(species=species, taxid=taxid.fillna(-1).astype(np.int64))
+
+        entries = (table[table['taxid'] >= 0].drop_duplicates('species')
+                   .sort_values('taxid', kind='stable').drop_duplicates('taxid'))
+        lineages = table.drop_duplicates('species')
+        ancestors = sorted({'|'.join(parts[:k]) for parts in lineages['species'].str.split('|')
+                            for k in range(1, len(parts))} | set(UNKNOWN_CLADES))
+        # species first, so a species listed only through its strains is still marked as one
+        known = pd.concat([
+            pd.DataFrame({'clade': lineages['species'], 'taxid': lineages['taxid'], 'species': True}),
+            pd.DataFrame({'clade': table['clade'], 'taxid': table['taxid'], 'species': False}),
+            pd.DataFrame({'clade': ancestors, 'taxid': -1, 'species': False}),
+        ]).drop_duplicates('clade')
+        return cls(entries['taxid'].to_numpy(), entries['species'].str.rsplit('s__', n=1).str[-1].to_numpy(),
+                   entries['species'].to_numpy(), known['clade'].to_numpy(), known['taxid'].to_numpy(),
+                   known['species'].to_numpy(), database)
+
+    @classmethod
+    def from_metaphlan_pkl(cls, path, database=None):
+        """Build the index from the 'taxonomy' table of a MetaPhlAn database pickle."""
+        with bz2.BZ2File(path) as handle:
+            taxonomy = pickle.load(handle)['taxonomy']
+        clades = list(taxonomy)
+        # values are (taxid path, genome length)
+        paths = [value[0] if isinstance(value, tuple) else value for value in taxonomy.values()]
+        if database is None:
+            database = os.path.basename(path).split('.pkl')[0]
+        return cls.from_clades(clades, paths, database)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['_version']) != INDEX_VERSION:
+                raise ValueError(f"{path}: taxonomy index version {int(data['_version'])}, expected {INDEX_VERSION}")
+            return cls(data['taxid'], data['name'], data['lineage'], data['clade'],
+                       data['clade_taxid'], data['clade_species'], str(data['database']))
+
+    def save(self, path):
+        # np.savez appends .npz to other names; write to a file handle to keep the name as given
+        with open(path, 'wb') as handle:
+            np.savez_compressed(handle, _version=INDEX_VERSION, database=self.database,
+                                taxid=self.taxid, name=self.name, lineage=self.lineage,
+                                clade=self.clade, clade_taxid=self.clade_taxid, clade_species=self.clade_species)
+
+    def contains(self, taxids):
+        """Boolean array: which taxids are species of the index."""
+        return np.isin(np.asarray(taxids, dtype=np.int64), self.taxid)
+
+    def _take(self, values, taxids):
+        """values of the given taxids, found by binary search of the sorted taxids; None where unknown."""
+        taxids = np.asarray(taxids, dtype=np.int64)
+        pos = np.searchsorted(self.taxid, taxids)
+        found = pos < len(self.taxid)
+        found[found] = self.taxid[pos[found]] == taxids[found]
+        result = np.full(len(taxids), None, dtype=object)
+        result[found] = values[pos[found]]
+        return result
+
+    def name_of(self, taxids):
+        """Species names of taxids (None where unknown)."""
+        return self._take(self.name, taxids)
+
+    def lineage_of(self, taxids):
+        """Species lineages of taxids (None where unknown)."""
+        return self._take(self.lineage, taxids)
+
+    def taxid_of_names(self, names):
+        """Taxids of species names (normalised, see normalize_names); -1 where unknown."""
+        return _lookup(self._names, normalize_names(names), self._name_taxid)
+
+    def taxid_of_lineages(self, lineages, strains=False):
+        """
+        Taxids of species lineages ('|' separated, as in MetaPhlAn); -1 for any
+        other clade. With strains=True, strain clades resolve to their species.
+        """
+        return _lookup(self._clades, lineages, self.clade_taxid if strains else self._species_taxid)
+
+    def species_taxids(self, clades):
+        """
+        Taxids of the species-level clades among clades, -1 for the others.
+
+        Lineages are matched exactly; species lineages the index does not hold
+        (e.g. from another database release) fall back to their species name.
+        """
+        clades = pd.Series(clades, dtype=object).fillna('')
+        pos = self._clades.get_indexer(pd.Index(clades))
+        taxids = np.full(len(pos), -1, dtype=np.int64)
+        known = pos >= 0
+        taxids[known] = self._species_taxid[pos[known]]
+        miss = ~known
+        if miss.any():
+            rest = clades[miss]
+            species = rest.str.contains(r'\|s__[^|]*$')
+            if species.any():
+                fallback = np.full(len(rest), -1, dtype=np.int64)
+                fallback[species.to_numpy()] = self.taxid_of_names(rest[species].str.rsplit('|', n=1).str[-1])
+                taxids[miss] = fallback
+        return taxids
+
+
+def load(path):
+    """Load an index, or None for an empty path (joins then fall back to names)."""
+    return TaxonomyIndex.load(path) if path else None
+
+
+def read_clades(paths):
+    """Clade name and taxid path columns of MetaPhlAn reports or two-column TSVs."""
+    tables = [pd.read_csv(path, sep='\t', comment='#', header=None, usecols=[0, 1], dtype=str,
+                          names=['clade', 'path'], keep_default_na=False) for path in paths]
+    return pd.concat(tables, ignore_index=True)
+
+
+def report_database(path):
+    """Database version on the first line of a MetaPhlAn report ('#mpa_v...'), '' if none."""
+    with open(path) as handle:
+        first = handle.readline().strip()
+    return first[1:] if first.startswith('#mpa_') else ''
+
+
+def main():
+    p = argparse.ArgumentParser(description="Build or inspect the integer taxonomy index of a MetaPhlAn database.")
+    sub = p.add_subparsers(dest='command', required=True)
+
+    b = sub.add_parser('build', help="Build an index from a MetaPhlAn database or clade tables")
+    source = b.add_mutually_exclusive_group(required=True)
+    source.add_argument('--metaphlan-pkl', help="MetaPhlAn database pickle (.pkl)")
+    source.add_argument('--clades',   nargs='+', help="TSVs with clade name and taxid path columns (e.g. MetaPhlAn reports)")
+    b.add_argument('--database',      default=None, help="Database version stored in the index (default: the .pkl name, "
+                                                       "or the version line of the first MetaPhlAn report)")
+    b.add_argument('--output',        default='taxonomy_index.npz', help="Output index (default: taxonomy_index.npz)")
+
+    i = sub.add_parser('info', help="Print the size and database version of an index")
+    i.add_argument('index', help="Index file (.npz)")
+    args = p.parse_args()
+
+    if args.command == 'build':
+        if args.metaphlan_pkl:
+            index = TaxonomyIndex.from_metaphlan_pkl(args.metaphlan_pkl, args.database)
+        else:
+            clades = read_clades(args.clades)
+            database = args.database if args.database is not None else report_database(args.clades[0])
+            index = TaxonomyIndex.from_clades(clades['clade'], clades['path'], database)
+        if not len(index):
+            sys.exit("ERROR: no species with an NCBI taxid found in the input")
+        index.save(args.output)
+        print(f"Indexed {len(index)} species ({len(index.clade)} clades) of "
+              f"'{index.database}' -> {args.output}", file=sys.stderr)
+    else:
+        index = TaxonomyIndex.load(args.index)
+        print(f"database\t{index.database}\nspecies\t{len(index)}\nclades\t{len(index.clade)}")
+
+
+if __name__ == '__main__':
+    main()
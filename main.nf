@@ -9,16 +9,25 @@ ch_design = file(params.design, checkIfExists: true)
 
 // Include modules
 include { INPUT_CHECK } from './modules/input_check.nf'
+include { SUBSAMPLE_READS } from './modules/subsample_reads.nf'
 include { DATABASE_PREPARATION } from './modules/database_preparation.nf'
 include { RUN_GMWI2_SINGLE } from './modules/run_gmwi2.nf'
 include { RUN_GMWI2_PAIR } from './modules/run_gmwi2.nf'
+include { RUN_GMWI2_BATCH } from './modules/run_gmwi2.nf'
 include { METAPHLAN_QIIMEPREP } from './modules/qiime/metaphlan_qiime.nf'
+include { METAPHLAN_QIIMEPREP_COHORT } from './modules/qiime/metaphlan_qiime.nf'
 include { QIIME_IMPORT } from './modules/qiime/qiime_import.nf'
 include { QIIME_DATAMERGE } from './modules/qiime/qiime_merge.nf'
 include { SCORE_TABLE } from './modules/score_table.nf'
 include { PLOT_SCORES } from './modules/plot_score.nf'
 include { MARKER_MAP } from './modules/marker_map.nf'
-include { MERGE_MARKER_MAP } from './modules/merge_marker.nf'
+include { GMWI2_RESCORE } from './modules/gmwi2_rescore.nf'
+include { GMWI2_REPORT } from './modules/gmwi2_report.nf'
+include { COHORT_STORE } from './modules/cohort_store.nf'
+include { RUN_HUMANN } from './modules/q2-predict-dysbiosis/humann3.nf'
+include { DYSBIOSIS_SCORE } from './modules/q2-predict-dysbiosis/q2-dysbiosis.nf'
+include { PERF_REPORT } from './modules/perf_report.nf'
+include { TAXONOMY_INDEX } from './modules/taxonomy_index.nf'
 
 // Define input parameters
 workflow PREPARATION_INPUT {
@@ -32,6 +41,23 @@ workflow PREPARATION_INPUT {
         // Prepare standardized tuple for downstream tools
         prepared_input = input_res.fastq.map { meta, reads -> tuple(meta, reads) }
 
+        // Optionally cap every sample at --max_reads so ultra-deep samples do not set the
+        // batch runtime; samples known (from the pre-flight) to be under the cap skip the stage
+        if ( params.max_reads ) {
+            to_cap = prepared_input.branch { meta, reads ->
+                under: meta.read_count != null && meta.read_count <= params.max_reads
+                cap: true
+            }
+            SUBSAMPLE_READS(to_cap.cap)
+            capped = SUBSAMPLE_READS.out.reads.map { meta, reads, report ->
+                def row = report.splitCsv(header: true, sep: '\t')[0]
+                tuple(meta + [read_count: row.kept_reads.toLong(), subsample_fraction: row.fraction.toDouble()], reads instanceof List ? reads : [reads])
+            }
+            prepared_input = to_cap.under
+                .map { meta, reads -> tuple(meta + [subsample_fraction: 1.0d], reads) }
+                .mix(capped)
+        }
+
     emit:
         prepared_input
 }
@@ -40,30 +66,52 @@ workflow PREPARATION_INPUT {
 workflow GMWI {
     take:
         prepared_input
+        databases
 
     main:
         gmwi_in_single = prepared_input
             .filter { meta, reads -> meta.single_end?.toString() == 'true' }
             .map { meta, reads -> 
                 def prefix = meta.run_accession ? "${meta.sample}_${meta.run_accession}" : meta.sample
-                tuple(prefix, reads[0], file(params.database_location))
+                tuple(prefix, reads[0])
             }
 
         gmwi_in_pair = prepared_input
             .filter { meta, reads -> !(meta.single_end?.toString() == 'true') }
             .map { meta, reads -> 
                 def prefix = meta.run_accession ? "${meta.sample}_${meta.run_accession}" : meta.sample
-                tuple(prefix, reads[0], reads[1], file(params.database_location))
+                tuple(prefix, reads[0], reads[1])
             }
 
-        gmwi_res_single = RUN_GMWI2_SINGLE(gmwi_in_single)
-        gmwi_res_pair   = RUN_GMWI2_PAIR(gmwi_in_pair)
-
-        gmwi_res = [
-            gmwi2_score: (gmwi_res_single.gmwi2_score ?: Channel.empty()).mix(gmwi_res_pair.gmwi2_score ?: Channel.empty()),
-            gmwi2_taxa:  (gmwi_res_single.gmwi2_taxa  ?: Channel.empty()).mix(gmwi_res_pair.gmwi2_taxa  ?: Channel.empty()),
-            metaphlan:   (gmwi_res_single.metaphlan   ?: Channel.empty()).mix(gmwi_res_pair.metaphlan   ?: Channel.empty())
-        ]
+        if ( params.gmwi2_batch_size > 1 ) {
+            // Chunks of up to gmwi2_batch_size samples per task, so the host and MetaPhlAn
+            // indexes are read from storage once per chunk and memory-mapped (Bowtie2 --mm) by
+            // each sample; a failed sample fails (and retries) its chunk; single- and
+            // paired-end samples are chunked apart
+            def chunk = { ch ->
+                ch.buffer(size: params.gmwi2_batch_size, remainder: true)
+                  .map { rows ->
+                      tuple(rows.collect { it[0] }, rows.collect { it[1] },
+                            rows.collect { it.size() > 2 ? it[2] : [] }.flatten())
+                  }
+            }
+            RUN_GMWI2_BATCH( chunk(gmwi_in_single).mix(chunk(gmwi_in_pair)).map { it + [databases] } )
+
+            gmwi_res = [
+                gmwi2_score: RUN_GMWI2_BATCH.out.gmwi2_score.flatten(),
+                gmwi2_taxa:  RUN_GMWI2_BATCH.out.gmwi2_taxa.flatten(),
+                metaphlan:   RUN_GMWI2_BATCH.out.metaphlan.flatten()
+            ]
+        } else {
+            gmwi_res_single = RUN_GMWI2_SINGLE(gmwi_in_single.map { it + [databases] })
+            gmwi_res_pair   = RUN_GMWI2_PAIR(gmwi_in_pair.map { it + [databases] })
+
+            gmwi_res = [
+                gmwi2_score: (gmwi_res_single.gmwi2_score ?: Channel.empty()).mix(gmwi_res_pair.gmwi2_score ?: Channel.empty()),
+                gmwi2_taxa:  (gmwi_res_single.gmwi2_taxa  ?: Channel.empty()).mix(gmwi_res_pair.gmwi2_taxa  ?: Channel.empty()),
+                metaphlan:   (gmwi_res_single.metaphlan   ?: Channel.empty()).mix(gmwi_res_pair.metaphlan   ?: Channel.empty())
+            ]
+        }
 
     emit:
         gmwi2_scores = gmwi_res.gmwi2_score
@@ -76,6 +124,7 @@ workflow QIIME {
         gmwi2_scores
         gmwi2_taxa
         metaphlan
+        taxonomy_index  // taxonomy index of the MetaPhlAn database, or [] to merge on names
 
     main:
         qiime_profiles       = Channel.empty()
@@ -86,32 +135,65 @@ workflow QIIME {
         // Turn the Path-only channel into (prefix, file) tuples:
         def metaphlan_tuples = metaphlan.map { file ->
         // remove the "_metaphlan.txt" suffix to get your prefix
-            def prefix = file.getName().replaceFirst(/_metaphlan\.txt$/, '')
-            tuple(prefix, file)
+            tuple(output_prefix(file, '_metaphlan.txt'), file)
         }
 
-        // Now invoke the process with the correct shape
-        qiime_prep = METAPHLAN_QIIMEPREP(metaphlan_tuples)
-        qiime_profiles = qiime_profiles.mix( METAPHLAN_QIIMEPREP.out.mpa_biomprofile )
-        qiime_taxonomy = qiime_taxonomy.mix( METAPHLAN_QIIMEPREP.out.taxonomy )
+        if (params.qiime_cohort || params.pack_light_steps) {
+            // One task parses every profile straight into a cohort BIOM table,
+            // so QIIME_IMPORT runs once instead of once per sample
+            cohort_in = metaphlan_tuples
+                .toSortedList { a, b -> a[0] <=> b[0] }
+                .filter { rows -> rows }
+                .map { rows -> tuple(rows.collect { it[0] }, rows.collect { it[1] }) }
+
+            METAPHLAN_QIIMEPREP_COHORT(cohort_in)
+            qiime_profiles = qiime_profiles.mix( METAPHLAN_QIIMEPREP_COHORT.out.mpa_biomprofile )
+            qiime_taxonomy = qiime_taxonomy.mix( METAPHLAN_QIIMEPREP_COHORT.out.taxonomy )
+            mpa_profiles   = metaphlan
+            profile_cache  = METAPHLAN_QIIMEPREP_COHORT.out.profile_cache
+            prep_perf      = METAPHLAN_QIIMEPREP_COHORT.out.perf
+        } else {
+            // Now invoke the process with the correct shape
+            qiime_prep = METAPHLAN_QIIMEPREP(metaphlan_tuples)
+            qiime_profiles = qiime_profiles.mix( METAPHLAN_QIIMEPREP.out.mpa_biomprofile )
+            qiime_taxonomy = qiime_taxonomy.mix( METAPHLAN_QIIMEPREP.out.taxonomy )
+            mpa_profiles   = METAPHLAN_QIIMEPREP.out.profile
+            profile_cache  = METAPHLAN_QIIMEPREP.out.profile_cache
+            prep_perf      = METAPHLAN_QIIMEPREP.out.perf
+        }
 
         QIIME_IMPORT ( qiime_profiles )
 
-        QIIME_DATAMERGE( QIIME_IMPORT.out.relabun_qza.collect(), qiime_taxonomy.collect() , METAPHLAN_QIIMEPREP.out.profile.collect() )
+        QIIME_DATAMERGE(
+            QIIME_IMPORT.out.relabun_qza.collect(), qiime_taxonomy.collect() , mpa_profiles.collect(), profile_cache.collect(),
+            taxonomy_index,
+            previous_results(['qiime_mergeddata/total_absolute_abundance.tsv', 'qiime_mergeddata/merged_taxonomy.tsv', 'qiime_mergeddata/merged_raw_counts.qza'])
+        )
 
         ch_output_file_paths = ch_output_file_paths.mix(
             QIIME_DATAMERGE.out.filtered_counts_collapsed_tsv.map{ "${params.outdir}/qiime_mergeddata/" + it.getName() }
             )
+        // Optional cohort-wide rescoring with a new coefficient table or threshold
+        if (params.gmwi2_coefficients) {
+            GMWI2_RESCORE(
+                mpa_profiles.collect(),
+                file(params.gmwi2_coefficients, checkIfExists: true)
+            )
+        }
+
         QIIME_DATAMERGE.out.filtered_counts_collapsed_qza
             .ifEmpty('There were no samples or taxa left after filtering! Try lower filtering criteria or examine your data quality.')
             .filter( String )
             .set{ ch_warning_message }
 
+        perf_metrics = prep_perf.mix( QIIME_DATAMERGE.out.perf )
+
     emit:
         qiime_profiles
         qiime_taxonomy
         ch_output_file_paths
         ch_warning_message
+        perf_metrics
 }
 
 workflow FINAL_REPORT {
@@ -119,37 +201,125 @@ workflow FINAL_REPORT {
         gmwi2_scores
         gmwi2_taxa
         metaphlan
+        taxonomy_index  // taxonomy index of the MetaPhlAn database, or [] to join on names
 
     main:
-        scores_tbl = SCORE_TABLE( gmwi2_scores.collect() )
-
-        stats_pre = metaphlan
-            .combine(gmwi2_taxa)
-            .map { mpa, coef ->
-                def sample = mpa.baseName.replaceAll('_metaphlan\\.txt$', '')
-                tuple(sample, mpa, coef)
-            }
+        // Key both GMWI2 outputs by their run prefix so each sample is paired
+        // with its own coefficient file (no cross-sample pairings)
+        mpa_keyed  = metaphlan.map  { mpa  -> tuple(output_prefix(mpa,  '_metaphlan.txt'),  mpa)  }
+        coef_keyed = gmwi2_taxa.map { coef -> tuple(output_prefix(coef, '_GMWI2_taxa.txt'), coef) }
 
         db_ch = Channel.value( file(params.marker_db) )
 
-        stats_in = stats_pre
-            .combine(db_ch)
-            .map { sample, mpa, coef, db ->
-                tuple(sample, mpa, coef, db)
-            }
+        stats_rows = mpa_keyed.join(coef_keyed)
 
-        marker_map_files = MARKER_MAP(stats_in)
+        // Marker map manifest (sample, mpa, coef), one row per sample; written here rather than
+        // by the task script, so its size is not bounded by the command line
+        stats_manifest = stats_rows.collectFile(name: 'marker_map_manifest.tsv', seed: 'sample\tmpa\tcoef\n',
+                                                newLine: true, sort: true) { prefix, mpa, coef ->
+            "${prefix}\t${mpa.name}\t${coef.name}"
+        }
 
-        all_marker_map = MERGE_MARKER_MAP( marker_map_files.collect() )
+        // Gather every sample into a single batched MARKER_MAP task so the
+        // marker database is loaded once for the whole cohort
+        stats_in = stats_rows
+            .toSortedList { a, b -> a[0] <=> b[0] }
+            .filter { rows -> rows }
+            .map { rows ->
+                tuple(rows.collect { it[0] }, rows.collect { it[1] }, rows.collect { it[2] })
+            }
+            .combine(stats_manifest)
+
+        if ( params.pack_light_steps ) {
+            // Score table, marker map and dashboard in a single job
+            GMWI2_REPORT( gmwi2_scores.collect(), stats_in, db_ch, taxonomy_index,
+                          previous_results(['final/gmwi2_scores_table.tsv', 'marker_map/all_marker_map.tsv']) )
+            all_marker_map = GMWI2_REPORT.out.all_marker_map
+            plot_html      = GMWI2_REPORT.out.plot_html
+            perf_metrics   = GMWI2_REPORT.out.perf
+        } else {
+            scores_tbl     = SCORE_TABLE( gmwi2_scores.collect(), previous_results(['final/gmwi2_scores_table.tsv']) )
+            MARKER_MAP(stats_in, db_ch, taxonomy_index, previous_results(['marker_map/all_marker_map.tsv']))
+            all_marker_map = MARKER_MAP.out.all_marker_map
+            PLOT_SCORES( scores_tbl, all_marker_map, 'gmwi2_score' )
+            plot_html      = PLOT_SCORES.out.plot_html
+            perf_metrics   = MARKER_MAP.out.perf.mix( PLOT_SCORES.out.perf )
+        }
 
-        plot_html = PLOT_SCORES( scores_tbl, all_marker_map )
+        // Consolidate the per-sample results into one indexed SQLite store for cohort queries
+        if ( params.cohort_store ) {
+            COHORT_STORE(
+                gmwi2_scores.collect(), gmwi2_taxa.collect(), metaphlan.collect(), all_marker_map,
+                previous_results(['cohort_store/cohort.sqlite'])
+            )
+            perf_metrics = perf_metrics.mix( COHORT_STORE.out.perf )
+        }
 
     emit:
         all_marker_map
         plot_html
+        perf_metrics
+}
+
+
+
+workflow Q2_PREDICT {
+    take:
+        prepared_input
+        metaphlan       // GMWI2 *_metaphlan.txt profiles, empty when GMWI2 is not run
+
+    main:
+        humann_reads = prepared_input
+            .map { meta, reads ->
+                def prefix = meta.run_accession ? "${meta.sample}_${meta.run_accession}" : meta.sample
+                tuple(prefix, reads[0], reads.size() > 1 ? reads[1] : [])
+            }
+
+        // Pair each sample with its own GMWI2 MetaPhlAn profile so HUMAnN can skip
+        // its prescreen; samples without one get [] and profile themselves
+        mpa_keyed = metaphlan.map { mpa -> tuple(output_prefix(mpa, '_metaphlan.txt'), mpa) }
+
+        // remainder rows hold a single null for the side that is missing, so they do not have
+        // the arity of a full match: [prefix, read1, read2, null] for reads without a profile,
+        // [prefix, null, mpa] for a profile without reads (dropped); index them instead of destructuring
+        humann_in = humann_reads
+            .join(mpa_keyed, remainder: true)
+            .filter { it -> it[1] != null }
+            .map { it ->
+                def mpa = it.size() > 3 ? it[3] : null
+                tuple(it[0], it[1], it[2], mpa ?: [], file(params.humann_nucleotide_db), file(params.humann_protein_db))
+            }
+
+        RUN_HUMANN(humann_in)
+
+        // Score the whole cohort in one task from the gathered HUMAnN tables
+        DYSBIOSIS_SCORE(
+            RUN_HUMANN.out.pathabundance.collect(),
+            RUN_HUMANN.out.genefamilies.collect(),
+            file(params.dysbiosis_signature, checkIfExists: true)
+        )
+        PLOT_SCORES( DYSBIOSIS_SCORE.out.scores_table, [], 'dysbiosis_score' )
+
+    emit:
+        genefamilies  = RUN_HUMANN.out.genefamilies
+        pathabundance = RUN_HUMANN.out.pathabundance
+        pathcoverage  = RUN_HUMANN.out.pathcoverage
+        scores_table  = DYSBIOSIS_SCORE.out.scores_table
+        perf_metrics  = DYSBIOSIS_SCORE.out.perf.mix( PLOT_SCORES.out.perf )
 }
 
+// Incremental mode: the merged outputs of an earlier run (--previous_results <its outdir>)
+// that the samples of this run are appended to; [] for a full rebuild
+def previous_results(relative_paths) {
+    if ( !params.previous_results ) return []
+    return relative_paths.collect { file("${params.previous_results}/${it}") }.findAll { it.exists() }
+}
 
+// Strip a known GMWI2 output suffix to recover the sample/run prefix
+def output_prefix(path, suffix) {
+    def name = path.getName()
+    return name.endsWith(suffix) ? name.substring(0, name.length() - suffix.length()) : name
+}
 
 // Top-level workflow invocation
 workflow {
@@ -158,31 +328,66 @@ workflow {
     // Step 1: Always prepare input, regardless of tool
     PREPARATION_INPUT(raw_sheet)
 
-    // Step 2: Route based on --tool flag
-    if (params.tool == 'gmwi2') {
+    // Step 2: Route based on --tool flag (comma-separated to run both)
+    def tools = params.tool.tokenize(',')*.trim()
+    if (!tools || !tools.every { it in ['gmwi2', 'q2-predict'] }) {
+        exit 1, "ERROR: Invalid value for --tool. Choose 'gmwi2', 'q2-predict' or 'gmwi2,q2-predict'"
+    }
+    if ('q2-predict' in tools && !params.dysbiosis_signature) {
+        exit 1, "ERROR: --tool q2-predict requires --dysbiosis_signature <path>, a TSV with 'feature' and 'group' (health|dysbiosis) columns"
+    }
+
+    perf_metrics = Channel.empty()
+
+    if ('gmwi2' in tools) {
+        // database_location staged into the GMWI2 tasks, or [] when they stage the databases
+        // through the cache of the node they run on themselves (stage_databases)
+        databases = params.stage_databases ? [] : file(params.database_location)
+
         // Run GMWI2 branch
-        GMWI(PREPARATION_INPUT.out.prepared_input)
+        GMWI(PREPARATION_INPUT.out.prepared_input, databases)
+
+        // Integer taxonomy index the post-processing joins taxa through; [] joins on species names.
+        // It is built from the MetaPhlAn database the GMWI2 tasks read
+        taxonomy_index = []
+        if ( params.taxonomy_index_joins ) {
+            if ( params.taxonomy_index ) {
+                taxonomy_index = file(params.taxonomy_index, checkIfExists: true)
+            } else {
+                // the .pkl is looked up inside the task, on the node that reads the database
+                TAXONOMY_INDEX( params.stage_databases ? [] : file(params.metaphlan_db) )
+                taxonomy_index = TAXONOMY_INDEX.out.index
+            }
+        }
 
         QIIME(
             GMWI.out.gmwi2_scores,
             GMWI.out.gmwi2_taxa,
-            GMWI.out.metaphlan
+            GMWI.out.metaphlan,
+            taxonomy_index
         )
 
         FINAL_REPORT(
             GMWI.out.gmwi2_scores,
             GMWI.out.gmwi2_taxa,
-            GMWI.out.metaphlan
+            GMWI.out.metaphlan,
+            taxonomy_index
         )
+        perf_metrics = perf_metrics.mix( QIIME.out.perf_metrics, FINAL_REPORT.out.perf_metrics )
     }
 
-    else if (params.tool == 'q2-predict') {
-        // Run Q2-PREDICT branch
-        Q2_PREDICT(PREPARATION_INPUT.out.prepared_input)
+    if ('q2-predict' in tools) {
+        // Run Q2-PREDICT branch, reusing the GMWI2 MetaPhlAn profiles when available
+        Q2_PREDICT(
+            PREPARATION_INPUT.out.prepared_input,
+            'gmwi2' in tools ? GMWI.out.metaphlan : Channel.empty()
+        )
+        perf_metrics = perf_metrics.mix( Q2_PREDICT.out.perf_metrics )
     }
 
-    else {
-        exit 1, "ERROR: Invalid value for --tool. Choose 'gmwi2' or 'q2-predict'"
+    // Per-step timings, peak RSS and rows of the Python post-processing, next to the dashboards
+    if ( params.perf_metrics ) {
+        PERF_REPORT( perf_metrics.collect() )
     }
 }
 
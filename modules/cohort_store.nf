@@ -0,0 +1,37 @@
+process COHORT_STORE {
+    tag "Cohort store"
+    label 'process_single'
+
+    container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
+
+    publishDir "${params.outdir}/cohort_store", mode: 'copy', overwrite: true
+
+    input:
+      path scores
+      path taxa
+      path metaphlan
+      path all_marker_map
+      path(previous, stageAs: 'previous/*')   // cohort store of an earlier run to extend, or []
+
+    output:
+      path 'cohort.sqlite', emit: store
+      path 'perf_metrics/*.perf.json', optional: true, emit: perf
+
+    script:
+    """
+    # incremental mode: start from a copy of the previous store; loaded samples replace their rows
+    [ -f previous/cohort.sqlite ] && cp previous/cohort.sqlite cohort.sqlite
+
+    cohort_store.py build \\
+      --db         cohort.sqlite \\
+      --scores     ${scores} \\
+      --taxa       ${taxa} \\
+      --metaphlan  ${metaphlan} \\
+      --marker-map ${all_marker_map}
+    """
+
+    stub:
+    """
+    touch cohort.sqlite
+    """
+}
@@ -1,5 +1,24 @@
+// Shell that stages the databases through the node-local cache (db_cache.py) and links them under
+// databases/ in the database_location layout. It runs inside the tasks that read the databases, so
+// the links always point into the cache of the node the task runs on; with genome = false only the
+// MetaPhlAn database is staged
+def stage_databases_script(genome = true) {
+    def genome_arg = genome ? "--genome ${params.genome_db}" : ''
+    """
+    db_cache.py \\
+      --cache-dir ${params.db_cache_dir} \\
+      --verify    ${params.db_cache_verify} \\
+      --output    databases \\
+      --metaphlan ${params.metaphlan_db} \\
+      ${genome_arg}
+    """
+}
+
+// Fills the database cache of the node it runs on ahead of a run; the GMWI2 tasks
+// stage through the cache of their own node themselves with params.stage_databases
 process DATABASE_PREPARATION {
     tag "database_preparation"
+    label 'process_database'
     conda 'bioconda::gmwi2=1.6'
 
     input:
@@ -7,52 +26,7 @@ process DATABASE_PREPARATION {
 
     output:
       val true, emit: db_ready
-    script:
-    workflow.profile.contains('aws') ? 
-    // ───────────── AWS variant ─────────────
-    """
-    # find MetaPhlAn install dir
-    DB_DIR=\$(find \$CONDA_PREFIX -type d -name metaphlan_databases | head -n1)
-    if [ -z "\$DB_DIR" ]; then
-      echo "ERROR: metaphlan_databases not found in \$CONDA_PREFIX" >&2
-      exit 1
-    fi
-
-    # use aws sync
-    aws s3 sync ${params.metaphlan_db} \$DB_DIR
-
-    MD5_FILE=`sh -c "find \$CONDA_PREFIX -type f -name GRCh38_md5sum.txt | head -n1"`
-    if [ -z "\$MD5_FILE" ]; then
-      echo "ERROR: Could not find GRCh38_md5sum.txt in \$CONDA_PREFIX" >&2
-      exit 1
-    fi
 
-    DB_DIR=`sh -c "dirname \$MD5_FILE"`
-
-    aws s3 sync ${params.human_genome} \$DB_DIR/GRCh38_noalt_as
-
-    """ 
-    : 
-    // ───────────── Local copy variant ─────────────
-    """
-    # find MetaPhlAn install dir
-    DB_DIR=\$(find \$CONDA_PREFIX -type d -name metaphlan_databases | head -n1)
-    if [ -z "\$DB_DIR" ]; then
-      echo "ERROR: metaphlan_databases not found in \$CONDA_PREFIX" >&2
-      exit 1
-    fi
-
-    # copy from local filesystem
-    cp -r ${params.metaphlan_db}* \$DB_DIR
-
-    MD5_FILE=`sh -c "find \$CONDA_PREFIX -type f -name GRCh38_md5sum.txt | head -n1"`
-    if [ -z "\$MD5_FILE" ]; then
-      echo "ERROR: Could not find GRCh38_md5sum.txt in \$CONDA_PREFIX" >&2
-      exit 1
-    fi
-
-    DB_DIR=`sh -c "dirname \$MD5_FILE"`
-    
-    cp -r ${params.human_genome} \$DB_DIR/GRCh38_noalt_as
-    """
+    script:
+    stage_databases_script()
 }
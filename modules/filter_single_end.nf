@@ -1,5 +1,6 @@
 process FILTER_SINGLE_END {
     tag "Remove Single-End Samples"
+    label 'process_single'
 
     container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
 
@@ -16,4 +17,9 @@ process FILTER_SINGLE_END {
     # Keep only header + paired-end rows
     awk -F',' 'NR==1 || \$3 != "" { print }' ${design_file} > cleaned_samplesheet.csv
     """
+
+    stub:
+    """
+    touch cleaned_samplesheet.csv
+    """
 }
\ No newline at end of file
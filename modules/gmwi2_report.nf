@@ -0,0 +1,36 @@
+include { score_table_script; marker_map_script; plot_scores_script } from './report_scripts.nf'
+
+process GMWI2_REPORT {
+    tag "GMWI2 report (${sample_ids.size()} samples)"
+    label 'process_low'
+
+    container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
+
+    publishDir "${params.outdir}/final",      mode: 'copy', overwrite: true, pattern: "gmwi2_{scores_table.tsv,dashboard.html}"
+    publishDir "${params.outdir}/marker_map", mode: 'copy', overwrite: true, pattern: "all_marker_map.tsv"
+
+    // Packed SCORE_TABLE + MARKER_MAP + PLOT_SCORES: one job instead of three
+    input:
+      path scores
+      // the staged reports and the manifest naming them (sample, mpa, coef)
+      tuple val(sample_ids), path(mpa_txt), path(coef_txt), path(manifest)
+      path marker_db
+      path taxonomy_index                      // taxonomy_index.py index to join on taxids, or []
+      path(previous, stageAs: 'previous/*')   // score table and marker map of an earlier run to extend, or []
+
+    output:
+      path 'gmwi2_scores_table.tsv', emit: scores_table
+      path 'all_marker_map.tsv',     emit: all_marker_map
+      path 'gmwi2_dashboard.html',   emit: plot_html
+      path 'perf_metrics/*.perf.json', optional: true, emit: perf
+
+    script:
+    [score_table_script(scores),
+     marker_map_script(manifest, marker_db, taxonomy_index),
+     plot_scores_script('gmwi2_scores_table.tsv', 'all_marker_map.tsv', 'gmwi2_score', 'gmwi2_dashboard.html')].join('\n')
+
+    stub:
+    """
+    touch gmwi2_scores_table.tsv all_marker_map.tsv gmwi2_dashboard.html
+    """
+}
@@ -0,0 +1,32 @@
+process GMWI2_RESCORE {
+    tag "Rescore GMWI2 from cohort table"
+    label 'process_single'
+
+    container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
+
+    publishDir "${params.outdir}/rescore", mode: 'copy', overwrite: true
+
+    input:
+      path profiles
+      path coefficients
+
+    output:
+      path 'gmwi2_rescored_table.tsv', emit: scores_table
+      path 'gmwi2_rescored_taxa.tsv',  emit: contributions
+
+    script:
+    """
+    gmwi2_rescore.py \
+      --profiles      ${profiles} \
+      --coefficients  ${coefficients} \
+      --threshold     ${params.gmwi2_presence_threshold} \
+      --jobs          ${task.cpus} \
+      --output        gmwi2_rescored_table.tsv \
+      --contributions gmwi2_rescored_taxa.tsv
+    """
+
+    stub:
+    """
+    touch gmwi2_rescored_table.tsv gmwi2_rescored_taxa.tsv
+    """
+}
@@ -33,6 +33,7 @@ workflow INPUT_CHECK {
     fasta = fasta ?: []                         // channel: [ val(meta), fasta ]
     groups = SAMPLESHEET_CHECK.out.grouping     // channel: [ group_metadata.csv]
     versions = SAMPLESHEET_CHECK.out.versions   // channel: [ versions.yml ]
+    read_counts = SAMPLESHEET_CHECK.out.read_counts // channel: [ read_counts.tsv ], only with --preflight
 }
 
 // Function to get list of [ meta, [ fastq_1, fastq_2 ] ]
@@ -42,6 +43,8 @@ def create_fastq_channel(LinkedHashMap row) {
     meta.id         = meta.sample
     meta.single_end = row.single_end.toBoolean()
     meta.is_fasta   = false
+    // reads (pairs) counted by the pre-flight, null when it was not run
+    meta.read_count = row.read_count ? row.read_count.toLong() : null
 
     // add path(s) of the fastq file(s) to the meta map
     if (!file(row.fastq_1).exists()) {
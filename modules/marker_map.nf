@@ -1,23 +1,29 @@
+include { marker_map_script } from './report_scripts.nf'
+
 process MARKER_MAP {
-    tag { sample_id }
+    tag "Marker Maps (${sample_ids.size()} samples)"
+    label 'process_low'
 
     container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
 
     publishDir "${params.outdir}/marker_map", mode: 'copy', overwrite: true
 
     input:
-      tuple val(sample_id), path(mpa_txt), path(coef_txt), path(marker_db)
+      // the staged reports and the manifest naming them (sample, mpa, coef)
+      tuple val(sample_ids), path(mpa_txt), path(coef_txt), path(manifest)
+      path marker_db
+      path taxonomy_index                      // taxonomy_index.py index to join on taxids, or []
+      path(previous, stageAs: 'previous/*')   // marker map of an earlier run to extend, or []
 
     output:
-      path "${sample_id}_marker_map.tsv"
+      path 'all_marker_map.tsv', emit: all_marker_map
+      path 'perf_metrics/*.perf.json', optional: true, emit: perf
 
     script:
+    marker_map_script(manifest, marker_db, taxonomy_index)
+
+    stub:
     """
-    marker_map.py \
-      --mpa   ${mpa_txt} \
-      --coef  ${coef_txt} \
-      --db    ${marker_db} \
-      --sample ${sample_id} \
-      --output ${sample_id}_marker_map.tsv
+    touch all_marker_map.tsv
     """
 }
@@ -0,0 +1,27 @@
+process PERF_REPORT {
+    tag "Performance summary"
+    label 'process_single'
+
+    container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
+
+    publishDir "${params.outdir}/final", mode: 'copy', overwrite: true
+
+    input:
+      path metrics   // *.perf.json records of the instrumented bin/ scripts
+
+    output:
+      path 'performance_summary.tsv',  emit: summary
+      path 'performance_summary.html', emit: html
+
+    script:
+    """
+    perf_report.py \\
+      --metrics ${metrics} \\
+      --prefix  performance_summary
+    """
+
+    stub:
+    """
+    touch performance_summary.tsv performance_summary.html
+    """
+}
@@ -1,5 +1,8 @@
+include { plot_scores_script } from './report_scripts.nf'
+
 process PLOT_SCORES {
     tag "Visualize GMWI2 Scores"
+    label 'process_single'
     
     container 'namlhs/io-gmwi2-pipeline:5.25'
 
@@ -8,15 +11,18 @@ process PLOT_SCORES {
     input:
       path scores_table
       path all_marker_map
+      val score_column
 
     output:
-      path 'gmwi2_dashboard.html', emit: plot_html
+      path '*_dashboard.html', emit: plot_html
+      path 'perf_metrics/*.perf.json', optional: true, emit: perf
 
     script:
+    // marker-map tooltips only exist for GMWI2; pass [] to plot without them
+    plot_scores_script(scores_table, all_marker_map, score_column, score_column.replace('_score', '') + '_dashboard.html')
+
+    stub:
     """
-    plot_scores.py \
-      --input  ${scores_table} \
-      --stats  ${all_marker_map} \
-      --output gmwi2_dashboard.html
+    touch ${score_column.replace('_score', '')}_dashboard.html
     """
 }
@@ -1,43 +1,89 @@
 process RUN_HUMANN {
     tag { prefix }
+    label 'process_humann'
 
     container 'biobakery/humann:3.8'
 
     publishDir "${params.outdir}/humann/genefamilies",  mode: 'copy', overwrite: true, pattern: "${prefix}_genefamilies.tsv"
     publishDir "${params.outdir}/humann/pathabundance", mode: 'copy', overwrite: true, pattern: "${prefix}_pathabundance.tsv"
     publishDir "${params.outdir}/humann/pathcoverage",  mode: 'copy', overwrite: true, pattern: "${prefix}_pathcoverage.tsv"
+    publishDir "${params.outdir}/humann/scratch",       mode: 'copy', overwrite: true, pattern: "${prefix}_scratch_usage.tsv"
 
     input:
-      tuple val(prefix), path(read1), path(read2), path(chocophlan_db), path(uniref_db)
+      tuple val(prefix), path(read1), path(read2), path(taxonomic_profile), path(chocophlan_db), path(uniref_db)
 
     output:
       path "${prefix}_genefamilies.tsv",  emit: genefamilies
       path "${prefix}_pathabundance.tsv", emit: pathabundance
       path "${prefix}_pathcoverage.tsv",  emit: pathcoverage
+      path "${prefix}_scratch_usage.tsv", emit: scratch_usage
 
     script:
+    // GMWI2 MetaPhlAn profile of the same sample, or [] when GMWI2 was not run
+    def prior = taxonomic_profile ?: ''
+    // Cross-run result cache, keyed by the reads, the prior, the database locations and the HUMAnN image
+    def cache = params.result_cache_dir ?
+        "--store ${params.result_cache_dir} --prefix ${prefix} --suffixes _genefamilies.tsv _pathabundance.tsv _pathcoverage.tsv " +
+        "--reads ${[read1, read2].flatten().join(' ')} ${prior ? "--extra ${prior}" : ''} " +
+        "--salt humann ${params.humann_nucleotide_db} ${params.humann_protein_db} ${task.container}" : ''
+    def evict = [params.result_cache_max_size ? "--max-size ${params.result_cache_max_size}" : '',
+                 params.result_cache_max_age_days ? "--max-age-days ${params.result_cache_max_age_days}" : ''].join(' ')
     """
+    # The joined reads and HUMAnN's temp folder are removed however the task exits
+    trap 'rm -f ${prefix}_merged.fastq; rm -rf *_humann_temp' EXIT
+
+    # A hit restores the three tables and skips HUMAnN; nothing is written to scratch
+    ${cache ? "result_cache.py get ${cache} && printf 'sample\\tjoined_reads_bytes\\thumann_temp_bytes\\n%s\\t0\\t0\\n' ${prefix} > ${prefix}_scratch_usage.tsv && exit 0" : ''}
+
     if [ ! -s "${read2}" ]; then
         echo "Running HUMAnN on single-end read"
-        humann \\
-          --input ${read1} \\
-          --output . \\
-          --nucleotide-database ${chocophlan_db} \\
-          --protein-database ${uniref_db} \\
-          --threads ${task.cpus}
+        HUMANN_INPUT=${read1}
     else
-        echo "Running HUMAnN on paired-end reads: merging ${read1} + ${read2}"
-        cat ${read1} ${read2} > ${prefix}_merged.fastq
-        humann \\
-          --input ${prefix}_merged.fastq \\
-          --output . \\
-          --nucleotide-database ${chocophlan_db} \\
-          --protein-database ${uniref_db} \\
-          --threads ${task.cpus}
+        echo "Running HUMAnN on paired-end reads: joining ${read1} + ${read2}"
+        # HUMAnN needs a regular file it can read several times (a FIFO fails its
+        # isfile check) and decompresses .gz input into its temp folder, so the mates
+        # are joined decompressed: one uncompressed copy in scratch, where a gzip join
+        # would add its own bytes on top of HUMAnN's decompressed copy
+        gzip -cdf ${read1} ${read2} > ${prefix}_merged.fastq
+        HUMANN_INPUT=${prefix}_merged.fastq
     fi
 
+    # Reuse the GMWI2 MetaPhlAn profile as HUMAnN's taxonomic prior when it was
+    # built with a MetaPhlAn database this HUMAnN/ChocoPhlAn release supports
+    PRIOR_ARGS=""
+    if [ -n "${prior}" ]; then
+        MPA_DB=\$(head -n1 ${prior} | tr -d '#[:space:]')
+        if [[ "\$MPA_DB" =~ ^(${params.humann_compatible_mpa_db})\$ ]]; then
+            echo "Using ${prior} (\$MPA_DB) as taxonomic profile; skipping the MetaPhlAn prescreen"
+            PRIOR_ARGS="--taxonomic-profile ${prior}"
+        else
+            echo "WARNING: ${prior} was built with '\$MPA_DB', which does not match '${params.humann_compatible_mpa_db}'; HUMAnN will run its own MetaPhlAn prescreen" >&2
+        fi
+    fi
+
+    humann \\
+      --input \$HUMANN_INPUT \\
+      \$PRIOR_ARGS \\
+      --output . \\
+      --nucleotide-database ${chocophlan_db} \\
+      --protein-database ${uniref_db} \\
+      --threads ${task.cpus}
+
+    # Record the scratch bytes this sample wrote before the trap cleans them up
+    JOINED_BYTES=\$(du -sb ${prefix}_merged.fastq 2>/dev/null | cut -f1)
+    TEMP_BYTES=\$(du -sbc *_humann_temp 2>/dev/null | tail -n1 | cut -f1)
+    printf 'sample\\tjoined_reads_bytes\\thumann_temp_bytes\\n%s\\t%s\\t%s\\n' \\
+      ${prefix} \${JOINED_BYTES:-0} \${TEMP_BYTES:-0} > ${prefix}_scratch_usage.tsv
+
     mv *_genefamilies.tsv  ${prefix}_genefamilies.tsv
     mv *_pathabundance.tsv ${prefix}_pathabundance.tsv
     mv *_pathcoverage.tsv  ${prefix}_pathcoverage.tsv
+
+    ${cache ? "result_cache.py put ${cache} ${evict}" : ''}
+    """
+
+    stub:
+    """
+    touch ${prefix}_genefamilies.tsv ${prefix}_pathabundance.tsv ${prefix}_pathcoverage.tsv ${prefix}_scratch_usage.tsv
     """
 }
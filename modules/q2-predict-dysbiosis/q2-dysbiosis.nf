@@ -0,0 +1,35 @@
+process DYSBIOSIS_SCORE {
+    tag "Batch dysbiosis scoring"
+    label 'process_low'
+
+    container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
+
+    publishDir "${params.outdir}/final", mode: 'copy', overwrite: true
+
+    input:
+      path pathabundance
+      path genefamilies
+      path signature
+
+    output:
+      path 'dysbiosis_scores_table.tsv', emit: scores_table
+      path 'humann_pathabundance_matrix.tsv', emit: pathway_matrix
+      path 'perf_metrics/*.perf.json', optional: true, emit: perf
+
+    script:
+    """
+    dysbiosis_score.py \
+      --pathabundance ${pathabundance} \
+      --genefamilies  ${genefamilies} \
+      --signature     ${signature} \
+      --threshold     ${params.dysbiosis_presence_threshold} \
+      --jobs          ${task.cpus} \
+      --matrix        humann_pathabundance_matrix.tsv \
+      --output        dysbiosis_scores_table.tsv
+    """
+
+    stub:
+    """
+    touch dysbiosis_scores_table.tsv humann_pathabundance_matrix.tsv
+    """
+}
@@ -1,5 +1,6 @@
 process METAPHLAN_QIIMEPREP {
     tag { prefix }
+    label 'process_single'
     container 'quay.io/biocontainers/biom-format:2.1.15'
 
     publishDir "${params.outdir}/metaphlan_profiles", mode: 'copy', overwrite: true, pattern: "${prefix}_profile.txt"
@@ -11,12 +12,48 @@ process METAPHLAN_QIIMEPREP {
     tuple val(prefix), path('*relabun_parsed_mpaprofile.biom') , emit: mpa_biomprofile
     path('*profile_taxonomy.txt') , emit: taxonomy
     path('*_profile.txt') , emit: profile
+    path('*_profile.txt.npz') , emit: profile_cache
+    path('perf_metrics/*.perf.json') , optional: true, emit: perf
 
     script:
     """
     head -n 5 $mpa_profile > ${prefix}_infotext.txt
     sed '1,4d' $mpa_profile | sed 's/#//g' > ${prefix}_profile.txt
-    metaphlan_parse_abun.py -t ${prefix}_profile.txt --label "${prefix}"
+    metaphlan_parse_abun.py -t ${prefix}_profile.txt --label "${prefix}" --cache
     biom convert -i ${prefix}_relabun_parsed_mpaprofile.txt -o ${prefix}_relabun_parsed_mpaprofile.biom --table-type="OTU table" --to-json
     """
+
+    stub:
+    """
+    touch ${prefix}_relabun_parsed_mpaprofile.biom ${prefix}_profile_taxonomy.txt ${prefix}_profile.txt ${prefix}_profile.txt.npz
+    """
+}
+
+process METAPHLAN_QIIMEPREP_COHORT {
+    tag "QIIME prep (${prefixes.size()} samples)"
+    label 'process_low'
+    container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
+
+    input:
+    tuple val(prefixes), path(mpa_profiles)
+
+    output:
+    tuple val('cohort'), path('cohort_relabun_parsed_mpaprofile.biom') , emit: mpa_biomprofile
+    path('cohort_profile_taxonomy.txt') , emit: taxonomy
+    path('*.npz') , emit: profile_cache
+    path('perf_metrics/*.perf.json') , optional: true, emit: perf
+
+    script:
+    """
+    metaphlan_parse_abun.py \\
+        --cohort cohort \\
+        --cache \\
+        -t ${mpa_profiles} \\
+        -l ${prefixes.join(' ')}
+    """
+
+    stub:
+    """
+    touch cohort_relabun_parsed_mpaprofile.biom cohort_profile_taxonomy.txt cohort_profiles.npz
+    """
 }
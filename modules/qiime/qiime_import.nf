@@ -1,5 +1,6 @@
 process QIIME_IMPORT {
     tag { prefix }
+    label 'process_low'
     
     container 'quay.io/qiime2/core:2023.9'
     
@@ -13,4 +14,9 @@ process QIIME_IMPORT {
     """
     qiime tools import --input-path $rel_profile --type 'FeatureTable[Frequency]' --input-format BIOMV100Format --output-path ${prefix}_qiime_relfreq_table.qza
     """
+
+    stub:
+    """
+    touch ${prefix}_qiime_relfreq_table.qza
+    """
 }
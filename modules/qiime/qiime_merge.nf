@@ -1,13 +1,18 @@
 process QIIME_DATAMERGE {
+    label 'process_medium'
 
     container 'quay.io/qiime2/core:2023.9'
 
     publishDir "${params.outdir}/qiime_mergeddata", mode: 'copy', overwrite: true, pattern: "*.tsv"
+    publishDir "${params.outdir}/qiime_mergeddata", mode: 'copy', overwrite: true, pattern: "merged_raw_counts.qza"
 
     input:
     path(abs_qza)
     path(taxonomy)
     path(profile)
+    path(profile_cache)   // parsed .npz sidecars of the profiles, read instead of the text
+    path(taxonomy_index)  // taxonomy_index.py index to deduplicate taxa on taxids, or []
+    path(previous, stageAs: 'previous/*')   // merged tables of an earlier run to extend, or []
 
     output:
     path('merged_taxonomy.qza')                  , optional: true, emit: taxonomy_qza
@@ -17,13 +22,33 @@ process QIIME_DATAMERGE {
     path('merged_filtered_counts.tsv')           , optional: true, emit: count_table
     path('total_relative_abundance.tsv')         , optional: true, emit: relative_abundance_total
     path('total_absolute_abundance.tsv')         , optional: true, emit: absolute_abundance_total
+    path('perf_metrics/*.perf.json')             , optional: true, emit: perf
 
     script:
+    def index_arg = taxonomy_index ? "--taxonomy-index ${taxonomy_index}" : ''
     """
-    merge_absolute_metaphlan.py -i $profile
+    # Incremental mode: extend the merged tables of a previous run with these samples only
+    PREV_ABS=""
+    PREV_TAX=""
+    PREV_QZA=""
+    [ -f previous/total_absolute_abundance.tsv ] && PREV_ABS="--base previous/total_absolute_abundance.tsv"
+    [ -f previous/merged_taxonomy.tsv ] && PREV_TAX="--base previous/merged_taxonomy.tsv"
+    if [ -f previous/merged_raw_counts.qza ]; then
+        # samples submitted again replace their previous counts
+        printf 'sample-id\\n' > rerun_ids.tsv
+        for f in $profile; do basename \$f | sed -E 's/_(profile|metaphlan)\\.txt\$//' >> rerun_ids.tsv; done
+        qiime feature-table filter-samples \
+            --i-table previous/merged_raw_counts.qza \
+            --m-metadata-file rerun_ids.tsv \
+            --p-exclude-ids \
+            --o-filtered-table previous_kept_counts.qza
+        PREV_QZA=previous_kept_counts.qza
+    fi
+
+    merge_absolute_metaphlan.py -i $profile --jobs ${task.cpus} \$PREV_ABS
 
     qiime feature-table merge \
-        --i-tables $abs_qza \
+        --i-tables $abs_qza \$PREV_QZA \
         --o-merged-table merged_raw_counts.qza
     
     qiime tools export \
@@ -38,7 +63,7 @@ process QIIME_DATAMERGE {
     then
         biom convert -i merged_filtered_counts_out/feature-table.biom -o merged_filtered_counts.tsv --to-tsv
 
-        qiime_taxmerge.py $taxonomy
+        qiime_taxmerge.py $taxonomy --jobs ${task.cpus} ${index_arg} \$PREV_TAX
         qiime tools import \
             --input-path merged_taxonomy.tsv \
             --type 'FeatureData[Taxonomy]' \
@@ -59,4 +84,10 @@ process QIIME_DATAMERGE {
 
     convert_abundance.py -i merged_filtered_counts.tsv
     """
+
+    stub:
+    """
+    touch merged_taxonomy.qza merged_filtered_counts_collapsed.qza merged_filtered_counts_collapsed.tsv
+    touch merged_filtered_counts.tsv total_relative_abundance.tsv total_absolute_abundance.tsv
+    """
 }
\ No newline at end of file
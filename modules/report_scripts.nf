@@ -0,0 +1,55 @@
+// Shell of the GMWI2 report steps, shared by SCORE_TABLE, MARKER_MAP and PLOT_SCORES
+// and by GMWI2_REPORT, which runs the three of them as one job (params.pack_light_steps)
+
+// gmwi2_scores_table.tsv from the <sample>_GMWI2.txt files; extends previous/gmwi2_scores_table.tsv if staged
+def score_table_script(scores) {
+    """
+    if [ -f previous/gmwi2_scores_table.tsv ]; then
+      # incremental mode: keep the previous rows, minus the samples scored again
+      for f in ${scores}; do basename "\$f" _GMWI2.txt; done > rescored.txt
+      awk -F'\\t' 'NR == FNR { skip[\$1]; next } FNR == 1 || !(\$1 in skip)' rescored.txt previous/gmwi2_scores_table.tsv > gmwi2_scores_table.tsv
+    else
+      # write header
+      echo -e "sample\\tgmwi2_score" > gmwi2_scores_table.tsv
+    fi
+
+    # loop over each staged file
+    for f in ${scores}; do
+      sample=\$(basename \"\$f\" _GMWI2.txt)
+      score=\$(cat \"\$f\")
+      echo -e \"\$sample\\t\$score\" >> gmwi2_scores_table.tsv
+    done
+    """
+}
+
+// all_marker_map.tsv of the samples of a manifest (sample, mpa, coef); extends previous/all_marker_map.tsv if staged
+def marker_map_script(manifest, marker_db, taxonomy_index) {
+    def index_arg = taxonomy_index ? "--taxonomy-index ${taxonomy_index}" : ''
+    """
+    BASE=""
+    [ -f previous/all_marker_map.tsv ] && BASE="--base previous/all_marker_map.tsv"
+
+    marker_map.py \\
+      --manifest ${manifest} \\
+      --db       ${marker_db} \\
+      --top-n    ${params.marker_top_n} \\
+      ${index_arg} \\
+      \$BASE \\
+      --output   all_marker_map.tsv
+    """
+}
+
+// <score>_dashboard.html of a score table; marker-map tooltips only when stats is given
+def plot_scores_script(scores_table, stats, score_column, dashboard) {
+    def offline   = params.plot_offline ? '--offline --compress-data' : ''
+    def stats_arg = stats ? "--stats ${stats}" : ''
+    """
+    plot_scores.py \\
+      --input  ${scores_table} \\
+      ${stats_arg} \\
+      --score-column ${score_column} \\
+      --page-size ${params.plot_page_size} \\
+      ${offline} \\
+      --output ${dashboard}
+    """
+}
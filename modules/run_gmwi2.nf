@@ -1,5 +1,8 @@
+include { stage_databases_script } from './database_preparation.nf'
+
 process RUN_GMWI2_SINGLE {
     tag { prefix }
+    label 'process_gmwi2'
 
     container 'docker.io/namlhs/gmwi2-custom:7.25'
 
@@ -16,13 +19,31 @@ process RUN_GMWI2_SINGLE {
       path "${prefix}_metaphlan.txt",   emit: metaphlan
 
     script:
+    // db_location is [] with stage_databases: the task stages the databases through its node's cache
+    def db = params.stage_databases ? 'databases' : db_location
+    // Cross-run result cache, keyed by the reads, the database locations and the GMWI2 image
+    def cache = params.result_cache_dir ?
+        "--store ${params.result_cache_dir} --prefix ${prefix} --suffixes _GMWI2.txt _GMWI2_taxa.txt _metaphlan.txt " +
+        "--reads ${read1} --salt gmwi2 ${params.metaphlan_db} ${params.genome_db} ${task.container}" : ''
+    def evict = [params.result_cache_max_size ? "--max-size ${params.result_cache_max_size}" : '',
+                 params.result_cache_max_age_days ? "--max-age-days ${params.result_cache_max_age_days}" : ''].join(' ')
+    """
+    ${cache ? "result_cache.py get ${cache} && exit 0" : ''}
+    ${params.stage_databases ? stage_databases_script() : ''}
+    gmwi2 -f ${read1} --single -n ${task.cpus} -o ${prefix} -m ${db}/metaphlan-databases/ -g ${db}/genome-databases/GRCh38_noalt_as/
+
+    ${cache ? "result_cache.py put ${cache} ${evict}" : ''}
     """
-    gmwi2 -f ${read1} --single -n ${task.cpus} -o ${prefix} -m ${db_location}/metaphlan-databases/ -g ${db_location}/genome-databases/GRCh38_noalt_as/
+
+    stub:
+    """
+    touch ${prefix}_GMWI2.txt ${prefix}_GMWI2_taxa.txt ${prefix}_metaphlan.txt
     """
 }
 
 process RUN_GMWI2_PAIR {
     tag { prefix }
+    label 'process_gmwi2'
 
     container 'docker.io/namlhs/gmwi2-custom:7.25'
 
@@ -39,7 +60,83 @@ process RUN_GMWI2_PAIR {
       path "${prefix}_metaphlan.txt",   emit: metaphlan
 
     script:
+    // db_location is [] with stage_databases: the task stages the databases through its node's cache
+    def db = params.stage_databases ? 'databases' : db_location
+    // Cross-run result cache, keyed by the reads, the database locations and the GMWI2 image
+    def cache = params.result_cache_dir ?
+        "--store ${params.result_cache_dir} --prefix ${prefix} --suffixes _GMWI2.txt _GMWI2_taxa.txt _metaphlan.txt " +
+        "--reads ${read1} ${read2} --salt gmwi2 ${params.metaphlan_db} ${params.genome_db} ${task.container}" : ''
+    def evict = [params.result_cache_max_size ? "--max-size ${params.result_cache_max_size}" : '',
+                 params.result_cache_max_age_days ? "--max-age-days ${params.result_cache_max_age_days}" : ''].join(' ')
+    """
+    ${cache ? "result_cache.py get ${cache} && exit 0" : ''}
+    ${params.stage_databases ? stage_databases_script() : ''}
+    gmwi2 -f ${read1} -r ${read2} -n ${task.cpus} -o ${prefix} -m ${db}/metaphlan-databases/ -g ${db}/genome-databases/GRCh38_noalt_as/
+
+    ${cache ? "result_cache.py put ${cache} ${evict}" : ''}
+    """
+
+    stub:
+    """
+    touch ${prefix}_GMWI2.txt ${prefix}_GMWI2_taxa.txt ${prefix}_metaphlan.txt
+    """
+}
+
+process RUN_GMWI2_BATCH {
+    tag "GMWI2 chunk (${prefixes.size()} samples)"
+    label 'process_gmwi2'
+
+    container 'docker.io/namlhs/gmwi2-custom:7.25'
+
+    publishDir "${params.outdir}/score",      mode: 'copy', overwrite: true, pattern: "*_GMWI2.txt"
+    publishDir "${params.outdir}/taxa_coef",  mode: 'copy', overwrite: true, pattern: "*_GMWI2_taxa.txt"
+    publishDir "${params.outdir}/metaphlan",  mode: 'copy', overwrite: true, pattern: "*_metaphlan.txt"
+    publishDir "${params.outdir}/gmwi2_status", mode: 'copy', overwrite: true, pattern: "{gmwi2_status_*.tsv,*_gmwi2.log}"
+
+    input:
+      // reads are staged in numbered directories so equal file names from different samples cannot clash
+      tuple val(prefixes), path(read1, stageAs: 'r1_?/*'), path(read2, stageAs: 'r2_?/*'), path(db_location)
+
+    output:
+      path "*_GMWI2.txt",       emit: gmwi2_score
+      path "*_GMWI2_taxa.txt",  emit: gmwi2_taxa
+      path "*_metaphlan.txt",   emit: metaphlan
+      // per-sample status and logs of the chunk; a failed sample fails the task, leaving both in its work dir
+      path "gmwi2_status_${prefixes[0]}.tsv", emit: status
+      path "*_gmwi2.log",       optional: true, emit: logs
+
+    script:
+    // one manifest row per sample: prefix, read1, read2 ('' for single-end chunks);
+    // a single staged file is a Path, several a blank-separated list of them
+    def r1s  = read1 instanceof java.nio.file.Path ? [read1] : read1.collect()
+    def r2s  = read2 instanceof java.nio.file.Path ? [read2] : read2.collect()
+    // db_location is [] with stage_databases: the task stages the databases through its node's cache
+    def db   = params.stage_databases ? 'databases' : db_location
+    def rows = [prefixes, r1s, r2s ?: prefixes.collect { '' }].transpose().collect { p, r1, r2 -> "'${p}' '${r1}' '${r2}'" }.join(' ')
+    // same key material as the per-sample processes, so both modes share cache entries
+    def cache = params.result_cache_dir ?
+        "--result-cache ${params.result_cache_dir} --cache-salt ${params.metaphlan_db} ${params.genome_db} ${task.container}" : ''
+    def evict = [params.result_cache_max_size ? "--max-size ${params.result_cache_max_size}" : '',
+                 params.result_cache_max_age_days ? "--max-age-days ${params.result_cache_max_age_days}" : ''].join(' ').trim()
+    """
+    printf 'prefix\\tread1\\tread2\\n' > gmwi2_manifest.tsv
+    printf '%s\\t%s\\t%s\\n' ${rows} >> gmwi2_manifest.tsv
+    ${params.stage_databases ? stage_databases_script() : ''}
+
+    gmwi2_batch.py \\
+      --manifest    gmwi2_manifest.tsv \\
+      --db-location ${db} \\
+      --cpus        ${task.cpus} \\
+      --concurrency ${params.gmwi2_batch_concurrency} \\
+      --status      gmwi2_status_${prefixes[0]}.tsv \\
+      ${cache}
+
+    ${cache && evict ? "result_cache.py evict --store ${params.result_cache_dir} ${evict}" : ''}
+    """
+
+    stub:
     """
-    gmwi2 -f ${read1} -r ${read2} -n ${task.cpus} -o ${prefix} -m ${db_location}/metaphlan-databases/ -g ${db_location}/genome-databases/GRCh38_noalt_as/
+    for p in ${prefixes.join(' ')}; do touch \${p}_GMWI2.txt \${p}_GMWI2_taxa.txt \${p}_metaphlan.txt; done
+    printf 'prefix\\tstatus\\tseconds\\n' > gmwi2_status_${prefixes[0]}.tsv
     """
 }
@@ -1,8 +1,14 @@
 process SAMPLESHEET_CHECK {
     tag "$samplesheet"
+    label 'process_low'
 
     container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
 
+    // A bad samplesheet or FASTQ fails the same way every time, so do not retry it
+    errorStrategy 'terminate'
+
+    publishDir "${params.outdir}/preflight", mode: 'copy', overwrite: true, pattern: 'read_counts.tsv'
+
     input:
     path samplesheet
 
@@ -10,15 +16,19 @@ process SAMPLESHEET_CHECK {
     path '*samplesheet.valid.csv'       , emit: csv
     path '*group_metadata.csv'          , emit: grouping
     path "versions.yml", emit: versions
+    path 'read_counts.tsv'              , emit: read_counts, optional: true
     
     when:
     task.ext.when == null || task.ext.when
 
     script: 
+    // Pre-flight: decompress every FASTQ up front, checking gzip integrity and R1/R2 read parity
+    def preflight = params.preflight ? "--preflight --jobs ${task.cpus} --read-counts read_counts.tsv" : ''
     """
     check_samplesheet.py \\
         $samplesheet \\
-        samplesheet.valid.csv
+        samplesheet.valid.csv \\
+        $preflight
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
@@ -1,5 +1,8 @@
+include { score_table_script } from './report_scripts.nf'
+
 process SCORE_TABLE {
     tag "Final Gut Score Table"
+    label 'process_single'
 
     container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
     
@@ -7,20 +10,16 @@ process SCORE_TABLE {
 
     input:
       path scores
+      path(previous, stageAs: 'previous/*')   // score table of an earlier run to extend, or []
 
     output:
       path 'gmwi2_scores_table.tsv', emit: scores_table
 
     script:
-    """
-    # write header
-    echo -e "sample\\tgmwi2_score" > gmwi2_scores_table.tsv
+    score_table_script(scores)
 
-    # loop over each staged file
-    for f in ${scores}; do
-      sample=\$(basename \"\$f\" _GMWI2.txt)
-      score=\$(cat \"\$f\")
-      echo -e \"\$sample\\t\$score\" >> gmwi2_scores_table.tsv
-    done
+    stub:
+    """
+    touch gmwi2_scores_table.tsv
     """
 }
@@ -0,0 +1,36 @@
+process SUBSAMPLE_READS {
+    tag { meta.run_accession ? "${meta.sample}_${meta.run_accession}" : meta.sample }
+    label 'process_reads'
+
+    container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
+
+    publishDir "${params.outdir}/subsample", mode: 'copy', overwrite: true, pattern: '*_subsample.tsv'
+
+    input:
+      tuple val(meta), path(reads)
+
+    output:
+      tuple val(meta), path('*_capped_R*.fastq.gz'), path('*_subsample.tsv'), emit: reads
+
+    script:
+    def prefix = meta.run_accession ? "${meta.sample}_${meta.run_accession}" : meta.sample
+    def read2  = reads.size() > 1 ? "--read2 ${reads[1]}" : ''
+    // the pre-flight read count, when available, saves a counting pass over R1
+    def total  = meta.read_count != null ? "--total-reads ${meta.read_count}" : ''
+    """
+    subsample_fastq.py \\
+      --read1 ${reads[0]} \\
+      ${read2} \\
+      --max-reads ${params.max_reads} \\
+      ${total} \\
+      --seed ${params.subsample_seed} \\
+      --prefix ${prefix}
+    """
+
+    stub:
+    def prefix = meta.run_accession ? "${meta.sample}_${meta.run_accession}" : meta.sample
+    """
+    touch ${prefix}_capped_R1.fastq.gz
+    printf 'sample\\ttotal_reads\\tkept_reads\\tfraction\\n%s\\t0\\t0\\t1\\n' ${prefix} > ${prefix}_subsample.tsv
+    """
+}
@@ -0,0 +1,53 @@
+include { stage_databases_script } from './database_preparation.nf'
+
+process TAXONOMY_INDEX {
+    tag "taxonomy index"
+    label 'process_medium'
+
+    container 'docker.io/namlhs/io-gmwi2-pipeline:5.25'
+
+    input:
+      // the MetaPhlAn database GMWI2 reads, or [] with stage_databases
+      path metaphlan_db
+
+    output:
+      path "taxonomy_index_*.npz", emit: index
+
+    script:
+    // with stage_databases the task stages the MetaPhlAn database through its node's cache
+    def mpa_db = params.stage_databases ? 'databases/metaphlan-databases' : metaphlan_db
+    """
+    ${params.stage_databases ? stage_databases_script(false) : ''}
+    # the index GMWI2 uses: the one mpa_latest names, else the only .pkl
+    if [ -f ${mpa_db}/mpa_latest ]; then
+      VERSION=\$(tr -d '[:space:]' < ${mpa_db}/mpa_latest)
+    else
+      PKLS=(${mpa_db}/*.pkl)
+      [ \${#PKLS[@]} -eq 1 ] && [ -f "\${PKLS[0]}" ] && VERSION=\$(basename "\${PKLS[0]}" .pkl)
+    fi
+    if [ -z "\${VERSION:-}" ] || [ ! -f ${mpa_db}/\$VERSION.pkl ]; then
+      echo "ERROR: no MetaPhlAn database .pkl in ${params.metaphlan_db} (named by mpa_latest, or the only one);" \\
+           "give a prebuilt index with --taxonomy_index or join on species names with --taxonomy_index_joins false" >&2
+      exit 1
+    fi
+
+    # built once per MetaPhlAn database version; later runs reuse the index kept in taxonomy_index_dir
+    STORED=${params.taxonomy_index_dir}/taxonomy_index_\$VERSION.npz
+    if [ -f \$STORED ]; then
+      echo "Reusing \$STORED"
+      cp \$STORED taxonomy_index_\$VERSION.npz
+    else
+      taxonomy_index.py build \\
+        --metaphlan-pkl ${mpa_db}/\$VERSION.pkl \\
+        --database      \$VERSION \\
+        --output        taxonomy_index_\$VERSION.npz
+      mkdir -p ${params.taxonomy_index_dir}
+      cp taxonomy_index_\$VERSION.npz \$STORED.\$\$.tmp && mv \$STORED.\$\$.tmp \$STORED
+    fi
+    """
+
+    stub:
+    """
+    touch taxonomy_index_stub.npz
+    """
+}